@@ -97,6 +97,7 @@ class BasicQuartoCannon(QuartoCannon):
 
         #board = self.xorMatrix(board)
         game.board = board
+        game.syncState()
         # print()
         # game.printGame()
         return game
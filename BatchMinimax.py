@@ -1,17 +1,53 @@
 from QuartoGame import QuartoGame
 from GreatQuartoCannon import GreatQuartoCannon
 from QuartoDataTypes import IntVector2
+from QuartoBitboard import ZOBRIST_SELECTED, FULL_MASK, MASK_BITS, MASK_SQUARES, SQUARE_VECTORS
+from TranspositionTable import EXACT
 import math
 
 class BatchMinimaxSolver:
-    def __init__(self):
+    # hashMode picks the memo keys, see QuartoMiniMaxSolver:
+    #   'board' (hashBoard tuples), 'zobrist' (zobristKey) or 'audit' (zobrist, checked for collisions)
+    # buildSolutions builds the solution string at every node. When False the memo keeps
+    # [score, best move] instead of [score, solution], and solveBatch rebuilds each solution
+    # from the memo with solutionString
+    # sharedTable is a SharedTranspositionTable used as the memo, so solvers in several processes
+    # share their results. It holds best moves only, so it needs zobrist keys and buildSolutions off
+    # orbitPruning only searches one move per orbit of the board's symmetries, see searchPieces,
+    # turn it off to measure the nodes it saves
+    # endgameTable is an EndgameTable of solved endgames. minimax uses tables built with 'batch' scores
+    # and decide tables with 'negamax' scores, each returning the table's score once a game is small enough
+    def __init__(self, hashMode='board', buildSolutions=True, sharedTable=None, orbitPruning=True, endgameTable=None):
+        if sharedTable is not None and (hashMode == 'board' or buildSolutions):
+            raise ValueError('sharedTable needs zobrist memo keys and buildSolutions=False')
         self.memo = {}
+        self.sharedTable = sharedTable
+        self.buildSolutions = buildSolutions
         self.numMemoed = 0
+        self.numExplored = 0
+        self.numThreatShortcuts = 0
+        self.numDeadDraws = 0
+        self.numOrbitPruned = 0
+        self.numEndgameHits = 0
+        self.orbitPruning = orbitPruning
+        self.endgameTable = endgameTable
+        self.cannonizer = GreatQuartoCannon()
+
+        # Score bounds [lower, upper] of the games tested by decide(), from the view of the player to move
+        self.decisionMemo = {}
+
+        if hashMode not in ('board', 'zobrist', 'audit'):
+            raise ValueError(f'Unknown hashMode {hashMode}')
+        self.hashMode = hashMode
+        self.auditTable = {}
+        self.numCollisions = 0
 
     def solveBatch(self, games: list[QuartoGame]) -> list[str]:
         results = []
         for game in games:
             score, sol = self.minimax(game, 0, True, False)
+            if not self.buildSolutions:
+                sol = self.solutionString(game)
             results.append(sol)
 
             #game.printGame()
@@ -21,6 +57,41 @@ class BatchMinimaxSolver:
 
         return results
 
+    # Win or not classification of a batch of games, with nothing selected and us to choose.
+    # True for the games we can force a win in
+    def classifyBatch(self, games: list[QuartoGame]) -> list[bool]:
+        return [self.canForceWin(game) for game in games]
+
+    # True if the player to move can force a win
+    def canForceWin(self, game: QuartoGame, placingPiece=False) -> bool:
+        return self.decide(game, placingPiece, 1)
+
+    def printStats(self):
+        print(f'Explored: {self.numExplored} | Memoed: {self.numMemoed} | Memo Table: {len(self.memo)} | '
+              f'Threat shortcuts: {self.numThreatShortcuts} | Dead draws: {self.numDeadDraws} | Orbit pruned moves: {self.numOrbitPruned} | Endgame hits: {self.numEndgameHits}')
+
+    # Masks of the pieces a choose node searches, and of the squares a place node searches for piece.
+    # With orbitPruning only the lowest move of each orbit under the transforms that leave the board
+    # (and piece) unchanged, as the others give symmetric games. The first best move stays the same.
+    def searchPieces(self, game: QuartoGame) -> int:
+        pieces = self.cannonizer.choosablePieces(game) if self.orbitPruning else game.remainingMask
+        self.numOrbitPruned += game.remainingPieceCount - pieces.bit_count()
+        return pieces
+
+    def searchSquares(self, game: QuartoGame, piece: int) -> int:
+        squares = self.cannonizer.placeableSquares(game, piece) if self.orbitPruning else ~game.occupied & FULL_MASK
+        self.numOrbitPruned += game.avaliableSquareCount - squares.bit_count()
+        return squares
+
+    # Score and best move of a game in the endgame table, when the table has the given perspective
+    def probeEndgame(self, game: QuartoGame, perspective: str, turn=True):
+        if self.endgameTable is None or self.endgameTable.perspective != perspective or not self.endgameTable.covers(game):
+            return None
+        entry = self.endgameTable.probe(game, turn)
+        if entry is not None:
+            self.numEndgameHits += 1
+        return entry
+
     def printSolution(self, solStr):
         i = 0
         s = ""
@@ -44,6 +115,68 @@ class BatchMinimaxSolver:
         print(s)
 
 
+    # Memo entry [score, solution or best move] of a key, or None
+    def memoGet(self, key):
+        if self.sharedTable is None:
+            return self.memo.get(key)
+        entry = self.sharedTable.probe(key)
+        if entry is None:
+            return None
+        return [entry[0], entry[3]]
+
+    # Memoizes a game's score with its solution (or best move), plies is the number of moves
+    # left in the game, so the shared table keeps the entries that took longest to solve
+    def memoPut(self, key, score, value, plies):
+        if self.sharedTable is None:
+            self.memo[key] = [score, value]
+        else:
+            self.sharedTable.store(key, score, EXACT, plies, value)
+
+    # Rebuilds a solved game's solution string by following the best moves in the memo
+    def solutionString(self, game: QuartoGame) -> str:
+        game = game.copy()
+        turn, placingPiece = True, False
+        sol = ""
+        while True:
+            isFinal = game.checkWin()
+            if isFinal or game.avaliableSquareCount == 0 or game.remainingPieceCount == 0:
+                gameState = 0
+                if isFinal:
+                    gameState = 1 if turn else -1
+                return sol + self.getGameStateChar(gameState)
+
+            key = self.getPieceKey(self.getMemoKey(game), game.selectedPieces[0] if placingPiece else None)
+            entry = self.memoGet(key)
+            while entry is None: # replaced in a shared table, solve it again
+                self.minimax(game, 0, turn, placingPiece)
+                entry = self.memoGet(key)
+
+            move = entry[1]
+            if placingPiece:
+                game.placePiece(game.selectedPieces[0], IntVector2(move >> 2, move & 3))
+            else:
+                game.selectPiece(move)
+                turn = not turn
+            sol += self.getValueChar(move)
+            placingPiece = not placingPiece
+
+    # Solution of a dead drawn game: the first square and piece left at each move, which is
+    # the path solutionString follows through the dead draw memo entries
+    def drawSolution(self, game: QuartoGame, placingPiece: bool) -> str:
+        squares = [(square.x << 2) + square.y for square in game.iterAvaliableSquares()]
+        pieces  = game.iterRemainingPieces()
+        sol = ""
+        s, p = 0, 0
+        while s < len(squares) and p < len(pieces):
+            if placingPiece:
+                sol += self.getValueChar(squares[s])
+                s += 1
+            else:
+                sol += self.getValueChar(pieces[p])
+                p += 1
+            placingPiece = not placingPiece
+        return sol + self.getGameStateChar(0)
+
     # Convert value into the valid char range for solutions
     # values should be 0-15, we add 64 because this makes all 16
     # possible chars simple to read, which is nice for parsing
@@ -59,31 +192,156 @@ class BatchMinimaxSolver:
     def getGameStateChar(self, val):
         return chr(val + 49)
 
+    # Memo key of a game's board, ignoring any selected pieces
+    def getMemoKey(self, game: QuartoGame):
+        if self.hashMode == 'board':
+            return game.hashBoard()
+
+        key = game.zobristKey
+        for piece in game.selectedPieces:
+            key ^= ZOBRIST_SELECTED[piece]
+        if self.hashMode == 'audit':
+            fullKey = game.hashBoard()
+            seenKey = self.auditTable.setdefault(key, fullKey)
+            if seenKey != fullKey:
+                self.numCollisions += 1
+                print(f'Zobrist collision on {key:016x}: {seenKey} and {fullKey}')
+        return key
+
+    # Memo key of the game behind gameHash with piece selected (None for nothing selected)
+    def getPieceKey(self, gameHash, piece):
+        if self.hashMode == 'board':
+            return (gameHash, piece)
+        if piece is None:
+            return gameHash
+        return gameHash ^ ZOBRIST_SELECTED[piece]
+
+    # Decision search with zero window semantics: True if the score of the player to move
+    # is at least beta, so beta 1 asks if they can force a win and beta 0 if they can avoid losing.
+    # Choosing hands the move over, so a choose node reaches beta if a piece holds the
+    # opponent below it, which is the opposite test of the opponent reaching 1 - beta.
+    # Every node stops at the first move that proves the test, and a failed test
+    # has refuted every move. Unlike minimax, scores are always the player to move's.
+    def decide(self, game: QuartoGame, placingPiece: bool, beta: int) -> bool:
+        # The player choosing has just placed, so a win on the board is theirs
+        if not placingPiece and game.checkWin():
+            return beta <= 1
+        if game.avaliableSquareCount == 0 or (not placingPiece and game.remainingPieceCount == 0):
+            return beta <= 0
+
+        key = self.getPieceKey(self.getMemoKey(game), game.selectedPieces[0] if placingPiece else None)
+        bounds = self.decisionMemo.get(key)
+        if bounds is None:
+            bounds = self.decisionMemo[key] = [-1, 1]
+        if bounds[0] >= beta:
+            self.numMemoed += 1
+            return True
+        if bounds[1] < beta:
+            self.numMemoed += 1
+            return False
+
+        if game.isDeadDraw():
+            self.numDeadDraws += 1
+            bounds[0] = bounds[1] = 0
+            return beta <= 0
+
+        entry = self.probeEndgame(game, 'negamax')
+        if entry is not None:
+            bounds[0] = bounds[1] = entry[0]
+            return entry[0] >= beta
+
+        self.numExplored += 1
+        result = False
+        if placingPiece:
+            piece = game.selectedPieces[0]
+            if game.winningSquare(piece) is not None:
+                self.numThreatShortcuts += 1
+                bounds[0] = bounds[1] = 1
+                return True
+
+            for square in MASK_SQUARES[self.searchSquares(game, piece)]:
+                game.placePiece(piece, square)
+                result = self.decide(game, False, beta)
+                game.removePiece(square)
+                if result:
+                    break
+        else:
+            # Pieces that give away a win score -1, which never reaches beta,
+            # and of the pieces giving symmetric games only one is tried
+            for piece in MASK_BITS[game.remainingMask & ~game.threatPieces() & self.searchPieces(game)]:
+                game.selectPiece(piece)
+                result = not self.decide(game, True, 1 - beta)
+                game.deselectAll()
+                if result:
+                    break
+
+        if result:
+            bounds[0] = beta
+        else:
+            bounds[1] = beta - 1
+        return result
+
     # Not tracking depth, assumed to be always exploring full depth
+    # Place nodes score from the placer's view. Choose nodes score from the chooser's view on
+    # our turn, and from ours on the opponent's turn (so both choose nodes maximize)
     def minimax(self, game: QuartoGame, depth:int, turn: bool, placingPiece: bool):
 
         # Base Case
-        isFinal = game.checkWinFull()
+        isFinal = game.checkWin()
         if isFinal or game.avaliableSquareCount == 0 or game.remainingPieceCount == 0:
             gameState = 0
             if isFinal:
                 gameState = 1 if turn else -1
-            return gameState, self.getGameStateChar(gameState)
+            return gameState, self.getGameStateChar(gameState) if self.buildSolutions else None
             #return gameState, [gameState]
 
         bestScore, bestPiece, bestSquare, bestSol = -math.inf, None, None, None
-        gameHash = game.hashBoard()
 
         if placingPiece:
 
             piece = game.selectedPieces[0]
+            pieceHash = self.getPieceKey(self.getMemoKey(game), piece)
 
             # Check Memoization
-            if (gameHash, piece) in self.memo:
+            entry = self.memoGet(pieceHash)
+            if entry is not None:
                 self.numMemoed += 1
-                return self.memo[(gameHash, piece)]
-
-            for square in game.getAvaliableSquares():
+                return entry
+
+            # A piece that wins is placed without searching the other squares
+            winSquare = game.winningSquare(piece)
+            if winSquare is not None:
+                self.numThreatShortcuts += 1
+                squareIndices = (winSquare.x << 2) + winSquare.y
+                sol = self.getValueChar(squareIndices) + self.getGameStateChar(1 if turn else -1) if self.buildSolutions else squareIndices
+                self.memoPut(pieceHash, 1, sol, 2 * game.avaliableSquareCount - 1)
+                return 1, (sol if self.buildSolutions else None)
+
+            # No line can be won any more, so any moves play out the draw
+            if game.isDeadDraw():
+                self.numDeadDraws += 1
+                square = game.iterAvaliableSquares()[0]
+                sol = self.drawSolution(game, True) if self.buildSolutions else (square.x << 2) + square.y
+                self.memoPut(pieceHash, 0, sol, 2 * game.avaliableSquareCount - 1)
+                return 0, (sol if self.buildSolutions else None)
+
+            # Solved endgames take the table's score and move, the solution
+            # follows the table through the child
+            entry = self.probeEndgame(game, 'batch', turn)
+            if entry is not None:
+                score, square = entry
+                square = SQUARE_VECTORS[square]
+                squareIndices = (square.x << 2) + square.y
+                sol = squareIndices
+                if self.buildSolutions:
+                    game.placePiece(piece, square)
+                    sol = self.getValueChar(squareIndices) + self.minimax(game, depth+1, turn, False)[1]
+                    game.removePiece(square)
+                self.memoPut(pieceHash, score, sol, 2 * game.avaliableSquareCount - 1)
+                return score, (sol if self.buildSolutions else None)
+
+            self.numExplored += 1
+            for square in MASK_SQUARES[self.searchSquares(game, piece)]:
 
                 if not game.placePiece(piece, square):
                     print("FAILED TO PLACE PIECE")
@@ -105,25 +363,74 @@ class BatchMinimaxSolver:
                     break
 
             squareIndices = (bestSquare.x << 2) + bestSquare.y
+            if not self.buildSolutions:
+                self.memoPut(pieceHash, bestScore, squareIndices, 2 * game.avaliableSquareCount - 1)
+                return bestScore, None
             sol = self.getValueChar(squareIndices) + bestSol
             #sol = [squareIndices] + bestSol
 
             # Memoize Solution
-            self.memo[(gameHash, piece)] = [bestScore, sol]
+            self.memoPut(pieceHash, bestScore, sol, 2 * game.avaliableSquareCount - 1)
 
             return bestScore, sol
 
         else:
 
-            if (gameHash, None) in self.memo:
+            gameHash = self.getMemoKey(game)
+            noPieceHash = self.getPieceKey(gameHash, None)
+            entry = self.memoGet(noPieceHash)
+            if entry is not None:
                 self.numMemoed += 1
-                return self.memo[(gameHash, None)]
+                return entry
+
+            # When every piece gives away a win the placer takes it, no need to recurse.
+            # Otherwise the pieces the player to move wants are tried first: safe ones on
+            # our turn, and the ones giving away a win on the opponent's (see the note above)
+            threats = game.remainingMask & game.threatPieces()
+            safePieces = game.remainingMask & ~threats
+            if safePieces == 0:
+                self.numThreatShortcuts += 1
+                piece = game.iterRemainingPieces()[0]
+                score = -1 if turn else 1
+                if not self.buildSolutions:
+                    self.memoPut(noPieceHash, score, piece, 2 * game.avaliableSquareCount)
+                    return score, None
+                winSquare = game.winningSquare(piece)
+                sol = (self.getValueChar(piece) + self.getValueChar((winSquare.x << 2) + winSquare.y)
+                       + self.getGameStateChar(1 if not turn else -1))
+                self.memoPut(noPieceHash, score, sol, 2 * game.avaliableSquareCount)
+                return score, sol
+
+            if game.isDeadDraw():
+                self.numDeadDraws += 1
+                sol = self.drawSolution(game, False) if self.buildSolutions else game.iterRemainingPieces()[0]
+                self.memoPut(noPieceHash, 0, sol, 2 * game.avaliableSquareCount)
+                return 0, (sol if self.buildSolutions else None)
+
+            entry = self.probeEndgame(game, 'batch', turn)
+            if entry is not None:
+                score, piece = entry
+                sol = piece
+                if self.buildSolutions:
+                    game.selectPiece(piece)
+                    sol = self.getValueChar(piece) + self.minimax(game, depth+1, not turn, True)[1]
+                    game.deselectAll()
+                self.memoPut(noPieceHash, score, sol, 2 * game.avaliableSquareCount)
+                return score, (sol if self.buildSolutions else None)
+
+            self.numExplored += 1
+            representatives = self.searchPieces(game)
+            safePieces &= representatives
+            threats &= representatives
+            pieceOrder = MASK_BITS[safePieces] + MASK_BITS[threats] if turn else MASK_BITS[threats] + MASK_BITS[safePieces]
 
             score, sol = None, None
-            for piece in game.getRemainingPieces():
+            for piece in pieceOrder:
 
-                if (gameHash, piece) in self.memo:
-                    score, sol = self.memo[(gameHash, piece)]
+                pieceHash = self.getPieceKey(gameHash, piece)
+                entry = self.memoGet(pieceHash)
+                if entry is not None:
+                    score, sol = entry
 
                 else:
                     if not game.selectPiece(piece):
@@ -144,9 +451,12 @@ class BatchMinimaxSolver:
                 if bestScore > 0:
                     break
 
+            if not self.buildSolutions:
+                self.memoPut(noPieceHash, bestScore, bestPiece, 2 * game.avaliableSquareCount)
+                return bestScore, None
             sol = self.getValueChar(bestPiece) + bestSol
             #sol = [bestPiece] + bestSol
 
-            self.memo[(gameHash, None)] = [bestScore, sol]
+            self.memoPut(noPieceHash, bestScore, sol, 2 * game.avaliableSquareCount)
 
             return bestScore, sol
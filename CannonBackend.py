@@ -0,0 +1,548 @@
+import os
+import itertools
+import numpy as np
+from QuartoBitboard import SQUARE_COUNT, FEATURE_MASK, SQUARE_TO_FLAT, MASK_BITS, ZOBRIST_SQUARE, ZOBRIST_SELECTED
+
+try:
+    import FastCannon
+except ImportError:
+    FastCannon = None
+
+# =================================================
+#   Cannonization backends
+#
+#   cannonize(board) applies the 32 structure preserving transforms to a 4x4 int16 board,
+#   XOR normalizes each candidate by its first piece, and writes the lowest scoring
+#   candidate back into the board in place. It returns the XOR piece used (-1 if the
+#   board had no candidate).
+#
+#   cannonizeGame / cannonizePacked go further and apply the whole cannonization of
+#   GreatQuartoCannon (transforms, XOR and feature swaps) to the board, the remaining
+#   pool and the selected pieces in a single call, returning the transform id used.
+#   cannonize_many does the same for a whole array of boards at once.
+#
+#   'native' is the FastCannon C++ extension (see setup.py), 'numpy' is a vectorized
+#   implementation with identical output. The native backend is used when it imports
+#   and exports all of NATIVE_FUNCTIONS (an extension built from an older FastCannon.cpp
+#   does not), the QUARTO_CANNON_BACKEND environment variable or setBackend() can force either.
+# =================================================
+
+BACKENDS = ('native', 'numpy')
+
+# Functions the native backend needs from FastCannon
+NATIVE_FUNCTIONS = ('cannonize', 'cannonizeGame', 'cannonizePacked', 'cannonize_many')
+
+# Swap lists of the transforms in FastCannon.cpp, indexing the contiguous board (x * 4 + y)
+_BOX_SWAPS   = ((0, 5), (1, 4), (2, 7), (3, 6), (8, 13), (9, 12), (10, 15), (11, 14))
+_INNER_SWAPS = ((1, 2), (4, 8), (7, 11), (13, 14), (5, 10), (9, 6))
+_VFLIP_SWAPS = ((0, 12), (1, 13), (2, 14), (3, 15), (4, 8), (5, 9), (6, 10), (7, 11))
+_HFLIP_SWAPS = ((0, 3), (1, 2), (4, 7), (5, 6), (8, 11), (9, 10), (12, 15), (13, 14))
+_TRANSPOSE_SWAPS = ((1, 4), (2, 8), (3, 12), (6, 9), (7, 13), (11, 14))
+_ROTATE_CHAINS   = ((0, 12, 15, 3), (4, 13, 11, 2), (8, 14, 7, 1), (5, 9, 10, 6))
+
+def _swap(board, swaps):
+    for a, b in swaps:
+        board[a], board[b] = board[b], board[a]
+
+def _rotate(board):
+    for chain in _ROTATE_CHAINS:
+        temp = board[chain[0]]
+        for i in range(len(chain) - 1):
+            board[chain[i]] = board[chain[i + 1]]
+        board[chain[-1]] = temp
+
+#======== transformBoard ==================
+#   Same transform numbering as transformBoard in FastCannon.cpp.
+#   The low 2 bits pick the base structure, the rest the D4 transform.
+def _transformBoard(board, transformIndex):
+    baseStructIndex = transformIndex & 3
+    d4Index = transformIndex >> 2
+    if baseStructIndex in (1, 3):
+        _swap(board, _BOX_SWAPS)
+    if baseStructIndex in (2, 3):
+        _swap(board, _INNER_SWAPS)
+
+    if d4Index == 1:
+        _rotate(board); _rotate(board); _rotate(board)
+    elif d4Index == 2:
+        _rotate(board); _rotate(board)
+    elif d4Index == 3:
+        _rotate(board)
+    elif d4Index == 4:
+        _swap(board, _VFLIP_SWAPS)
+    elif d4Index == 5:
+        _swap(board, _HFLIP_SWAPS)
+    elif d4Index == 6:
+        _swap(board, _TRANSPOSE_SWAPS)
+    elif d4Index == 7:
+        _swap(board, _TRANSPOSE_SWAPS)
+        _swap(board, _HFLIP_SWAPS)
+        _swap(board, _VFLIP_SWAPS)
+
+# TRANSFORM_PERMS[t][i] is the index of the square moved to i by transform t
+TRANSFORM_COUNT = 32
+TRANSFORM_PERMS = []
+for _t in range(TRANSFORM_COUNT):
+    _perm = list(range(16))
+    _transformBoard(_perm, _t)
+    TRANSFORM_PERMS.append(_perm)
+TRANSFORM_PERMS = np.array(TRANSFORM_PERMS, dtype=np.intp)
+del _t, _perm
+
+# evaluateBoard shifts a 32 bit int, so shifts wrap at 32 bits and each term is a signed 32 bit value.
+# Saved depth tables were built with this score, so both backends keep it.
+_EVAL_SHIFTS = np.array([(4 * (i - 1)) & 31 for i in range(1, 16)], dtype=np.uint32)
+_NO_CANDIDATE = np.iinfo(np.int64).max
+
+#======== bestSquareTransform ==================
+#   Scores all 32 transforms of a contiguous board at once.
+#   returns (transform, xorPiece, transformed XORed board), or (-1, -1, None) with no candidate
+def _bestSquareTransform(flat: np.ndarray):
+    candidates = flat[TRANSFORM_PERMS]
+
+    # Candidates must have a piece in one of the first two squares, with a piece in the first preferred
+    first, second = candidates[:, 0], candidates[:, 1]
+    xors = np.where(first >= 0, first, second)
+    valid = xors >= 0
+    if not valid.any():
+        return -1, -1, None
+    types = np.where(first >= 0, 1, 2)
+    valid &= types == types[valid].min()
+
+    xored = np.where(candidates >= 0, candidates ^ xors[:, None], candidates)
+    values = xored[:, 1:]
+    terms = (values.astype(np.uint32) << _EVAL_SHIFTS).view(np.int32).astype(np.int64)
+    scores = np.where(values >= 0, terms, 0).sum(axis=1)
+    scores[~valid] = _NO_CANDIDATE
+
+    best = int(np.argmin(scores)) # first lowest, like the strict < in the native loop
+    return best, int(xors[best]), xored[best]
+
+#======== numpyCannonize ==================
+#   Vectorized version of FastCannon.cannonize
+def numpyCannonize(board: np.ndarray) -> int:
+    transform, xorPiece, best = _bestSquareTransform(board.reshape(-1))
+    if transform < 0:
+        return -1
+    board[...] = best.reshape(board.shape)
+    return xorPiece
+
+# =================================================
+#   Full cannonization
+#
+#   A transform id packs a square transform t (0-31), an XOR piece x and a feature
+#   permutation f (0-23) as (t * 16 + x) * 24 + f. A piece p maps to
+#   FEATURE_PERM_MAP[f][p ^ x], and square s (y * 4 + x) maps to SQUARE_TRANSFORMS[t][s].
+#   Id 0 is the identity.
+# =================================================
+FEATURE_PERM_COUNT = 24
+TRANSFORM_ID_COUNT = TRANSFORM_COUNT * 16 * FEATURE_PERM_COUNT
+
+# Bit i of a mapped piece is bit FEATURE_PERMS[f][i] of the piece
+FEATURE_PERMS      = tuple(itertools.permutations(range(4)))
+FEATURE_PERM_INDEX = {perm: f for f, perm in enumerate(FEATURE_PERMS)}
+FEATURE_PERM_MAP   = tuple(
+    tuple(sum(((p >> perm[i]) & 1) << i for i in range(4)) for p in range(16))
+    for perm in FEATURE_PERMS
+)
+FEATURE_PERM_UNMAP = tuple(tuple(pieceMap.index(p) for p in range(16)) for pieceMap in FEATURE_PERM_MAP)
+
+# SQUARE_TRANSFORMS[t][s] is the square index that square s is moved to by transform t
+SQUARE_TRANSFORMS = tuple(
+    tuple(SQUARE_TO_FLAT.index(list(TRANSFORM_PERMS[t]).index(SQUARE_TO_FLAT[s])) for s in range(SQUARE_COUNT))
+    for t in range(TRANSFORM_COUNT)
+)
+
+# SQUARE_MASK_TRANSFORMS[t][0][m] | SQUARE_MASK_TRANSFORMS[t][1][n] is where transform t moves
+# the squares of the mask with low byte m and high byte n
+SQUARE_MASK_TRANSFORMS = tuple(
+    tuple(tuple(sum(1 << squareMap[s + shift] for s in range(8) if (m >> s) & 1) for m in range(256)) for shift in (0, 8))
+    for squareMap in SQUARE_TRANSFORMS
+)
+
+# Squares in the order GreatQuartoCannon.swapBitsToPos scans the board (y outer, x inner)
+_SCAN_ORDER = SQUARE_TO_FLAT
+
+def decodeTransform(transformId: int) -> tuple[int, int, int]:
+    featurePerm = transformId % FEATURE_PERM_COUNT
+    xorPiece    = (transformId // FEATURE_PERM_COUNT) & FEATURE_MASK
+    return transformId // (FEATURE_PERM_COUNT * 16), xorPiece, featurePerm
+
+def transformPiece(transformId: int, piece: int) -> int:
+    _, xorPiece, featurePerm = decodeTransform(transformId)
+    return FEATURE_PERM_MAP[featurePerm][piece ^ xorPiece]
+
+def untransformPiece(transformId: int, piece: int) -> int:
+    _, xorPiece, featurePerm = decodeTransform(transformId)
+    return FEATURE_PERM_UNMAP[featurePerm][piece] ^ xorPiece
+
+def transformSquare(transformId: int, square: int) -> int:
+    return SQUARE_TRANSFORMS[decodeTransform(transformId)[0]][square]
+
+def untransformSquare(transformId: int, square: int) -> int:
+    return SQUARE_TRANSFORMS[decodeTransform(transformId)[0]].index(square)
+
+def transformPool(transformId: int, poolMask: int) -> int:
+    _, xorPiece, featurePerm = decodeTransform(transformId)
+    pieceMap = FEATURE_PERM_MAP[featurePerm]
+    mapped = 0
+    for piece in MASK_BITS[poolMask]:
+        mapped |= 1 << pieceMap[piece ^ xorPiece]
+    return mapped
+
+#======== stabilizer ==================
+#   Transform ids that map a board onto itself. squarePieces[s] is the piece on square s
+#   (-1 if empty) and occupied the mask of the filled squares.
+#   A square transform has to keep the filled squares in place, and then the piece moved onto
+#   the first filled square fixes the XOR piece of each feature permutation, so only
+#   those 24 candidates are checked against the other pieces.
+def stabilizer(squarePieces, occupied: int) -> list[int]:
+    if occupied == 0:
+        return list(range(TRANSFORM_ID_COUNT))
+    squares = MASK_BITS[occupied]
+    first = squares[0]
+    result = []
+    low, high = occupied & 0xFF, occupied >> 8
+    for t in range(TRANSFORM_COUNT):
+        maskMaps = SQUARE_MASK_TRANSFORMS[t]
+        if maskMaps[0][low] | maskMaps[1][high] != occupied:
+            continue
+        squareMap = SQUARE_TRANSFORMS[t]
+        target = squarePieces[squareMap[first]]
+        for f in range(FEATURE_PERM_COUNT):
+            pieceMap = FEATURE_PERM_MAP[f]
+            xorPiece = squarePieces[first] ^ FEATURE_PERM_UNMAP[f][target]
+            if all(pieceMap[squarePieces[s] ^ xorPiece] == squarePieces[squareMap[s]] for s in squares):
+                result.append((t * 16 + xorPiece) * FEATURE_PERM_COUNT + f)
+    return result
+
+#======== orbitRepresentatives ==================
+#   Mask of the lowest piece of each orbit of a pool under a group of transform ids (such as
+#   a stabilizer). Only the XOR piece and feature permutation of an id move pieces.
+def orbitRepresentatives(transformIds, poolMask: int) -> int:
+    pieceTransforms = {transformId % (16 * FEATURE_PERM_COUNT) for transformId in transformIds}
+    pieceMaps = [(FEATURE_PERM_MAP[pieceTransform % FEATURE_PERM_COUNT], pieceTransform // FEATURE_PERM_COUNT)
+                 for pieceTransform in pieceTransforms]
+    representatives, seen = 0, 0
+    for piece in MASK_BITS[poolMask]:
+        if (seen >> piece) & 1:
+            continue
+        representatives |= 1 << piece
+        for pieceMap, xorPiece in pieceMaps:
+            seen |= 1 << pieceMap[piece ^ xorPiece]
+    return representatives
+
+#======== squareOrbitRepresentatives ==================
+#   Mask of the lowest square of each orbit of the free squares under the transform ids
+#   of a group (such as a stabilizer) that also leave piece unchanged.
+def squareOrbitRepresentatives(transformIds, freeMask: int, piece: int) -> int:
+    squareTransforms = set()
+    for transformId in transformIds:
+        t, xorPiece, featurePerm = decodeTransform(transformId)
+        if FEATURE_PERM_MAP[featurePerm][piece ^ xorPiece] == piece:
+            squareTransforms.add(t)
+    squareMaps = [SQUARE_TRANSFORMS[t] for t in squareTransforms]
+    representatives, seen = 0, 0
+    for square in MASK_BITS[freeMask]:
+        if (seen >> square) & 1:
+            continue
+        representatives |= 1 << square
+        for squareMap in squareMaps:
+            seen |= 1 << squareMap[square]
+    return representatives
+
+# SQUARE_SOURCES[t][s] is the square that transform t moves onto square s
+SQUARE_SOURCES = tuple(tuple(squareMap.index(s) for s in range(SQUARE_COUNT)) for squareMap in SQUARE_TRANSFORMS)
+
+#======== exactCanonicalKey ==================
+#   Zobrist key of a complete canonical form of a board and its selected pieces, with the
+#   transform id mapping the board onto it. Symmetric games always get the same key, which
+#   the cannonization above does not promise.
+#   For each square transform giving the lowest occupied mask, the pieces are read in square
+#   order (selected pieces last), XORed so the first one is 0, and the features sorted by
+#   their column of bits over those pieces. The lowest resulting sequence is the form.
+def exactCanonicalKey(squarePieces, occupied: int, selected) -> tuple[int, int]:
+    low, high = occupied & 0xFF, occupied >> 8
+    occupiedMaps = [maskMaps[0][low] | maskMaps[1][high] for maskMaps in SQUARE_MASK_TRANSFORMS]
+    bestOccupied = min(occupiedMaps)
+    squares = MASK_BITS[bestOccupied]
+    if not squares and not selected:
+        return 0, 0
+
+    bestPieces, bestId = None, 0
+    for t in range(TRANSFORM_COUNT):
+        if occupiedMaps[t] != bestOccupied:
+            continue
+        sources = SQUARE_SOURCES[t]
+        pieces = [squarePieces[sources[s]] for s in squares]
+        pieces.extend(selected)
+        xorPiece = pieces[0]
+        columns = [0, 0, 0, 0]
+        for i, piece in enumerate(pieces):
+            piece ^= xorPiece
+            for feature in range(4):
+                columns[feature] |= ((piece >> feature) & 1) << i
+        featurePerm = FEATURE_PERM_INDEX[tuple(sorted(range(4), key=columns.__getitem__))]
+        pieceMap = FEATURE_PERM_MAP[featurePerm]
+        pieces = [pieceMap[piece ^ xorPiece] for piece in pieces]
+        if bestPieces is None or pieces < bestPieces:
+            bestPieces, bestId = pieces, (t * 16 + xorPiece) * FEATURE_PERM_COUNT + featurePerm
+
+    key = 0
+    for s, piece in zip(squares, bestPieces):
+        key ^= ZOBRIST_SQUARE[(s << 4) | piece]
+    for piece in bestPieces[len(squares):]:
+        key ^= ZOBRIST_SELECTED[piece]
+    return key, bestId
+
+# Same rule as GreatQuartoCannon.swapBitsToPos, on a flat list, recording the swap in featurePerm
+def _featureBitSwap(flat, featurePerm, bitPos, thresh) -> bool:
+    posMask = 15 - ((1 << bitPos) - 1)
+    shiftCount = -1
+    for f in _SCAN_ORDER:
+        piece = flat[f]
+        if piece > 0:
+            maskedVal = piece & posMask
+            if maskedVal > 0 and maskedVal.bit_count() == thresh:
+                shiftCount = (maskedVal & -maskedVal).bit_length() - 1
+                break
+    if shiftCount < 0:
+        return False
+    if shiftCount == bitPos:
+        return True
+
+    swapMask = (1 << shiftCount) | (1 << bitPos)
+    for f in range(SQUARE_COUNT):
+        piece = flat[f]
+        if piece > 0 and piece & swapMask != swapMask and piece & swapMask != 0:
+            flat[f] = piece ^ swapMask
+    featurePerm[shiftCount], featurePerm[bitPos] = featurePerm[bitPos], featurePerm[shiftCount]
+    return True
+
+# Same branch sequence as GreatQuartoCannon.cannonizeGame
+def _applyFeatureSwaps(flat, featurePerm) -> None:
+    if _featureBitSwap(flat, featurePerm, 0, 1):
+        if _featureBitSwap(flat, featurePerm, 1, 1):
+            _featureBitSwap(flat, featurePerm, 2, 1)
+        elif _featureBitSwap(flat, featurePerm, 1, 2):
+            _featureBitSwap(flat, featurePerm, 2, 1)
+    elif _featureBitSwap(flat, featurePerm, 0, 2):
+        _featureBitSwap(flat, featurePerm, 1, 2)
+        _featureBitSwap(flat, featurePerm, 2, 1)
+    elif _featureBitSwap(flat, featurePerm, 0, 3):
+        _featureBitSwap(flat, featurePerm, 1, 2)
+        _featureBitSwap(flat, featurePerm, 2, 1)
+
+# Cannonizes a flat list in place, returns the transform id
+def _cannonizeFlat(flat: list) -> int:
+    transform, xorPiece, best = _bestSquareTransform(np.array(flat, dtype=np.int16))
+    if transform < 0:
+        return 0
+    flat[:] = best.tolist()
+    featurePerm = [0, 1, 2, 3]
+    _applyFeatureSwaps(flat, featurePerm)
+    return (transform * 16 + xorPiece) * FEATURE_PERM_COUNT + FEATURE_PERM_INDEX[tuple(featurePerm)]
+
+#======== numpyCannonizeGame ==================
+#   Python version of FastCannon.cannonizeGame.
+#   Cannonizes a 4x4 int16 board in place, along with the remaining pool mask and selected pieces.
+#   returns (remainingMask, selectedPieces, transformId)
+def numpyCannonizeGame(board: np.ndarray, remainingMask: int, selected) -> tuple[int, list[int], int]:
+    flat = board.reshape(-1).tolist()
+    transformId = _cannonizeFlat(flat)
+    board[...] = np.array(flat, dtype=board.dtype).reshape(board.shape)
+    selected = [transformPiece(transformId, piece) for piece in selected]
+    return transformPool(transformId, remainingMask), selected, transformId
+
+#======== numpyCannonizePacked ==================
+#   Python version of FastCannon.cannonizePacked.
+#   returns (cells, occupied, remainingMask, selectedPieces, transformId)
+def numpyCannonizePacked(cells: int, occupied: int, remainingMask: int, selected):
+    flat = [-1] * SQUARE_COUNT
+    for s in MASK_BITS[occupied]:
+        flat[SQUARE_TO_FLAT[s]] = (cells >> (s << 2)) & FEATURE_MASK
+
+    transformId = _cannonizeFlat(flat)
+
+    newCells, newOccupied = 0, 0
+    for s in range(SQUARE_COUNT):
+        piece = flat[SQUARE_TO_FLAT[s]]
+        if piece >= 0:
+            newCells    |= piece << (s << 2)
+            newOccupied |= 1 << s
+    selected = [transformPiece(transformId, piece) for piece in selected]
+    return newCells, newOccupied, transformPool(transformId, remainingMask), selected, transformId
+
+# =================================================
+#   Batched cannonization
+#
+#   cannonize_many(boards, pools=None) cannonizes an (N,16) int16 array of contiguous boards
+#   (QuartoGame.board.reshape(-1) rows) and optionally their (N,) uint16 pool masks.
+#   returns (boards, xorPieces, transformIds), plus the mapped pools when pools are given.
+#   Rows without a candidate (empty boards) keep their board, with XOR -1 and transform 0.
+# =================================================
+_MANY_CHUNK = 1 << 15 # rows scored at once by the numpy version, bounds its memory use
+
+_POPCOUNT = np.array([bin(v).count('1') for v in range(16)], dtype=np.int8)
+_LOWEST_BIT = np.array([(v & -v).bit_length() - 1 if v > 0 else 0 for v in range(16)], dtype=np.int8)
+_FEATURE_PERM_TABLE = np.array(FEATURE_PERM_MAP, dtype=np.int64)
+_FEATURE_PERM_CODES = np.zeros(256, dtype=np.int64)
+for _f, _perm in enumerate(FEATURE_PERMS):
+    _FEATURE_PERM_CODES[((_perm[0] * 4 + _perm[1]) * 4 + _perm[2]) * 4 + _perm[3]] = _f
+del _f, _perm
+
+# One _featureBitSwap step applied to every active row. Returns the rows that succeeded.
+def _featureBitSwapMany(boards, featurePerms, active, bitPos, thresh):
+    posMask = 15 - ((1 << bitPos) - 1)
+    scanned = boards[:, list(_SCAN_ORDER)]
+    masked  = np.where(scanned > 0, scanned & posMask, 0)
+    matches = (masked > 0) & (_POPCOUNT[masked] == thresh)
+
+    success = active & matches.any(axis=1)
+    rows    = np.flatnonzero(success)
+    shifts  = _LOWEST_BIT[masked[rows, matches[rows].argmax(axis=1)]].astype(np.int64)
+
+    swapping = shifts != bitPos
+    rows, shifts = rows[swapping], shifts[swapping]
+    if len(rows) > 0:
+        swapMasks = ((1 << shifts) | (1 << bitPos)).astype(np.int16)[:, None]
+        pieces  = boards[rows]
+        partial = (pieces > 0) & ((pieces & swapMasks) != swapMasks) & ((pieces & swapMasks) != 0)
+        boards[rows] = np.where(partial, pieces ^ swapMasks, pieces)
+
+        fromShift = featurePerms[rows, shifts]
+        featurePerms[rows, shifts] = featurePerms[rows, bitPos]
+        featurePerms[rows, bitPos] = fromShift
+    return success
+
+def _cannonizeChunk(boards):
+    count = len(boards)
+    candidates = boards[:, TRANSFORM_PERMS] # (N, 32, 16)
+    first, second = candidates[:, :, 0], candidates[:, :, 1]
+    xors  = np.where(first >= 0, first, second)
+    valid = xors >= 0
+    types = np.where(first >= 0, 1, 2)
+    hasFirst = (valid & (types == 1)).any(axis=1)
+    valid &= types == np.where(hasFirst, 1, 2)[:, None]
+
+    xored  = np.where(candidates >= 0, candidates ^ xors[:, :, None], candidates)
+    values = xored[:, :, 1:]
+    terms  = (values.astype(np.uint32) << _EVAL_SHIFTS).view(np.int32).astype(np.int64)
+    scores = np.where(values >= 0, terms, 0).sum(axis=2)
+    scores[~valid] = _NO_CANDIDATE
+
+    hasCandidate = valid.any(axis=1)
+    rowIndex   = np.arange(count)
+    transforms = scores.argmin(axis=1)
+    xorPieces  = np.where(hasCandidate, xors[rowIndex, transforms], -1).astype(np.int16)
+    result     = np.where(hasCandidate[:, None], xored[rowIndex, transforms], boards).astype(np.int16)
+
+    featurePerms = np.tile(np.arange(4, dtype=np.int64), (count, 1))
+    s1 = _featureBitSwapMany(result, featurePerms, hasCandidate, 0, 1)
+    s2 = _featureBitSwapMany(result, featurePerms, s1, 1, 1)
+    _featureBitSwapMany(result, featurePerms, s1 & s2, 2, 1)
+    s3 = _featureBitSwapMany(result, featurePerms, s1 & ~s2, 1, 2)
+    _featureBitSwapMany(result, featurePerms, s1 & ~s2 & s3, 2, 1)
+    t2 = _featureBitSwapMany(result, featurePerms, hasCandidate & ~s1, 0, 2)
+    _featureBitSwapMany(result, featurePerms, t2, 1, 2)
+    _featureBitSwapMany(result, featurePerms, t2, 2, 1)
+    t3 = _featureBitSwapMany(result, featurePerms, hasCandidate & ~s1 & ~t2, 0, 3)
+    _featureBitSwapMany(result, featurePerms, t3, 1, 2)
+    _featureBitSwapMany(result, featurePerms, t3, 2, 1)
+
+    codes = ((featurePerms[:, 0] * 4 + featurePerms[:, 1]) * 4 + featurePerms[:, 2]) * 4 + featurePerms[:, 3]
+    transformIds = (transforms * 16 + np.maximum(xorPieces, 0)) * FEATURE_PERM_COUNT + _FEATURE_PERM_CODES[codes]
+    transformIds = np.where(hasCandidate, transformIds, 0).astype(np.int32)
+    return result, xorPieces, transformIds
+
+# Maps (N,) pool masks through (N,) transform ids
+def transformPools(transformIds: np.ndarray, pools: np.ndarray) -> np.ndarray:
+    transformIds = np.asarray(transformIds, dtype=np.int64)
+    pieces   = np.arange(16, dtype=np.int64)
+    xors     = (transformIds // FEATURE_PERM_COUNT) & FEATURE_MASK
+    mapped   = _FEATURE_PERM_TABLE[(transformIds % FEATURE_PERM_COUNT)[:, None], pieces ^ xors[:, None]]
+    bits     = (np.asarray(pools, dtype=np.int64)[:, None] >> pieces) & 1
+    return np.bitwise_or.reduce(bits << mapped, axis=1).astype(np.uint16)
+
+# _ORBIT_PIECE_MAPS[x][f][p] is FEATURE_PERM_MAP[f][p ^ x], with -1 (an empty square) kept at index 16
+_ORBIT_PIECE_MAPS = np.array([[[FEATURE_PERM_MAP[f][p ^ x] for p in range(16)] + [-1] for f in range(FEATURE_PERM_COUNT)]
+                              for x in range(16)], dtype=np.int16)
+
+#======== orbitBoards ==================
+#   Every transform of a contiguous board, as a (TRANSFORM_ID_COUNT, 16) array whose row i
+#   is the board mapped by transform id i.
+def orbitBoards(board: np.ndarray) -> np.ndarray:
+    squareMoved = np.asarray(board, dtype=np.int16).reshape(-1)[TRANSFORM_PERMS] # (32, 16)
+    pieces = np.where(squareMoved >= 0, squareMoved, 16)
+    return _ORBIT_PIECE_MAPS[:, :, pieces].transpose(2, 0, 1, 3).reshape(TRANSFORM_ID_COUNT, SQUARE_COUNT)
+
+#======== numpyCannonizeMany ==================
+#   Vectorized version of FastCannon.cannonize_many
+def numpyCannonizeMany(boards, pools=None):
+    boards, pools = checkManyArgs(boards, pools)
+    count = len(boards)
+
+    outBoards = np.empty_like(boards)
+    outXors   = np.empty(count, dtype=np.int16)
+    outIds    = np.empty(count, dtype=np.int32)
+    for start in range(0, count, _MANY_CHUNK):
+        end = min(start + _MANY_CHUNK, count)
+        outBoards[start:end], outXors[start:end], outIds[start:end] = _cannonizeChunk(boards[start:end])
+
+    if pools is None:
+        return outBoards, outXors, outIds
+    return outBoards, outXors, outIds, transformPools(outIds, pools)
+
+#======== checkManyArgs ==================
+#   Checks the arguments of cannonize_many for both backends, so bad shapes raise
+#   the same ValueError whichever backend is used.
+def checkManyArgs(boards, pools=None):
+    boards = np.ascontiguousarray(boards, dtype=np.int16)
+    if boards.ndim != 2 or boards.shape[1] != SQUARE_COUNT:
+        raise ValueError('Expected an (N,16) board array')
+    if pools is not None:
+        pools = np.asarray(pools)
+        if pools.shape != (len(boards),):
+            raise ValueError('Expected an (N,) pool array')
+    return boards, pools
+
+def _nativeCannonizeMany(boards, pools=None):
+    boards, pools = checkManyArgs(boards, pools)
+    return FastCannon.cannonize_many(boards, pools)
+
+def _nativeCannonize(board: np.ndarray) -> int:
+    return FastCannon.cannonize(board)
+
+# name -> (cannonize, cannonizeGame, cannonizePacked, cannonize_many)
+_IMPLEMENTATIONS = {
+    'native': (_nativeCannonize, lambda *args: FastCannon.cannonizeGame(*args),
+               lambda *args: FastCannon.cannonizePacked(*args),
+               _nativeCannonizeMany),
+    'numpy' : (numpyCannonize, numpyCannonizeGame, numpyCannonizePacked, numpyCannonizeMany),
+}
+
+# True if FastCannon is built and up to date with NATIVE_FUNCTIONS
+def nativeAvaliable() -> bool:
+    return FastCannon is not None and all(hasattr(FastCannon, name) for name in NATIVE_FUNCTIONS)
+
+def avaliableBackends() -> list[str]:
+    return [name for name in BACKENDS if name != 'native' or nativeAvaliable()]
+
+def getBackend() -> str:
+    return _backend
+
+#======== setBackend ==================
+#   Forces a backend by name. Raises a ValueError for unknown names, and for
+#   'native' when FastCannon is not built or is missing functions.
+def setBackend(name: str) -> None:
+    global _backend, cannonize, cannonizeGame, cannonizePacked, cannonize_many
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown cannon backend {name}, expected one of {BACKENDS}')
+    if name not in avaliableBackends():
+        raise ValueError(f'Cannon backend {name} is not avaliable, build or rebuild it with python setup.py build_ext --inplace')
+    _backend  = name
+    cannonize, cannonizeGame, cannonizePacked, cannonize_many = _IMPLEMENTATIONS[name]
+
+_backend  = None
+cannonize = cannonizeGame = cannonizePacked = cannonize_many = None
+setBackend(os.environ.get('QUARTO_CANNON_BACKEND', avaliableBackends()[0]))
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+"""
+CannonCache remembers the result of cannonizing a game, so boards that recur across
+siblings and across moves are not cannonized again.
+
+Entries map a raw key (the zobristKey of the uncannonized game, covering its board and
+selected pieces) to (canonical key, transform id), where the canonical key is the
+zobristKey of the cannonized game and the transform id is the one CannonBackend returned.
+The cache holds at most capacity entries, evicting the least recently used.
+
+GreatQuartoCannon uses sharedCache unless it is given its own, so every solver in a
+process shares one cache, along with its counters. The solvers reset the counters at the
+start of each move, so the stats they print cover their own move.
+
+The default capacity of 1 << 20 entries costs about 240 MB once full (an OrderedDict entry
+with a 64 bit key and a (key, transform id) tuple is about 240 bytes). Give solvers a
+smaller cache of their own (cannonCacheSize) where that is too much.
+"""
+class CannonCache:
+    def __init__(self, capacity=1 << 20):
+        self.capacity  = capacity
+        self.table     = OrderedDict()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    """ get()
+    Returns (canonical key, transform id) for a raw key, or None if it is not cached.
+    """
+    def get(self, rawKey):
+        entry = self.table.get(rawKey)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.table.move_to_end(rawKey)
+        return entry
+
+    """ put()
+    Stores the cannonization of a raw key, evicting the least recently used entry when full.
+    """
+    def put(self, rawKey, cannonKey: int, transformId: int) -> None:
+        if self.capacity <= 0:
+            return
+        self.table[rawKey] = (cannonKey, transformId)
+        self.table.move_to_end(rawKey)
+        if len(self.table) > self.capacity:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def items(self):
+        return self.table.items()
+
+    def clear(self) -> None:
+        self.table.clear()
+        self.resetCounters()
+
+    def resetCounters(self) -> None:
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def hitRate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f'Cannon cache: {len(self.table)}/{self.capacity} entries | Hits: {self.hits} | '
+                f'Misses: {self.misses} | Evictions: {self.evictions} | Hit rate: {self.hitRate():.1%}')
+
+
+sharedCache = CannonCache()
@@ -0,0 +1,307 @@
+import itertools
+import multiprocessing
+import os
+import time
+import numpy as np
+from QuartoGame import QuartoGame
+from GreatQuartoCannon import GreatQuartoCannon
+from QuartoBitboard import FULL_MASK, MASK_BITS, MASK_SQUARES, squareIndex
+import CannonBackend
+
+"""
+EndgameTable is a solved table of the games with few empty squares, so a search can
+stop as soon as it gets there instead of solving the last plies again for every root.
+
+Games are keyed by their exact canonical key (see CannonBackend.exactCanonicalKey), so a
+game is found under any of its symmetries. The table is two arrays saved as .npy files:
+    keys - the sorted uint64 keys
+    data - a uint8 per key packing
+        bits 0-1   score + 1
+        bits 2-5   best move (square index or piece), in the frame of the canonical form
+A third small array holds the largest number of empty squares in the table and its perspective.
+Loading memory maps the arrays, so a probe is a binary search that only pages in what it reads.
+
+The perspective is the score convention of the table:
+    'negamax' - scores from the view of the player to move (QuartoMiniMaxSolver.negamax,
+                BatchMinimaxSolver.decide)
+    'batch'   - the scores of BatchMinimaxSolver.minimax, where both choose nodes maximize our
+                score. They depend on whose turn it is, which is part of the key.
+
+buildEndgameTable enumerates the games with at most maxEmpty empty squares that can be reached
+from a list of roots (every game of that size is far too many to enumerate), then solves them
+in a process pool. Each worker solves its games exactly, keeping every game it meets on the way,
+and the merged results are sorted and saved.
+"""
+
+PERSPECTIVES = ('negamax', 'batch')
+
+# Folded into the keys of 'batch' tables on the opponent's turn
+OPPONENT_TURN_KEY = 0x9E3779B97F4A7C15
+
+# Worker globals, set up by initEndgameWorker
+endgameMemo   = None
+endgameBatch  = False
+endgameCannon = None
+
+
+def packData(score: int, move: int) -> int:
+    return (score + 1) | (move << 2)
+
+def unpackData(data: int) -> tuple:
+    return (data & 3) - 1, (data >> 2) & 15
+
+""" endgameKey()
+Returns (table key, transform id) of a game. turn only matters for batch tables.
+"""
+def endgameKey(cannonizer: GreatQuartoCannon, game: QuartoGame, batch: bool, turn: bool) -> tuple:
+    key, transformId = cannonizer.exactCannonKey(game)
+    if batch and not turn:
+        key ^= OPPONENT_TURN_KEY
+    return key, transformId
+
+def tableFiles(fileName: str, path: str) -> tuple:
+    return tuple(f'{path}{fileName}.{part}.npy' for part in ('keys', 'data', 'meta'))
+
+
+class EndgameTable:
+
+    """
+    Loads a table saved by buildEndgameTable.
+
+    Parameters:
+        fileName (str): Name the table was saved under.
+        path (str): Folder of the table files.
+    """
+    def __init__(self, fileName: str, path="endgameTables/"):
+        self.fileName = fileName
+        self.path = path
+        keysFile, dataFile, metaFile = tableFiles(fileName, path)
+        self.keys = np.load(keysFile, mmap_mode='r')
+        self.data = np.load(dataFile, mmap_mode='r')
+        meta = np.load(metaFile)
+        self.maxEmpty = int(meta[0])
+        self.perspective = PERSPECTIVES[int(meta[1])]
+        self.cannonizer = GreatQuartoCannon()
+
+        self.probes = 0
+        self.hits   = 0
+
+    # Workers load the table again, mapping the same files, instead of copying the arrays
+    def __reduce__(self):
+        return (EndgameTable, (self.fileName, self.path))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # True if a game is small enough to be in the table
+    def covers(self, game: QuartoGame) -> bool:
+        return game.avaliableSquareCount <= self.maxEmpty
+
+    # Data byte stored for a key, or None
+    def lookup(self, key: int):
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index < len(self.keys) and int(self.keys[index]) == key:
+            return int(self.data[index])
+        return None
+
+    """ probe()
+    Looks up a game. turn is whose turn it is, only used by batch tables.
+
+    Returns:
+        Tuple: (score, best square index (with a selected piece) or best piece, in the
+                game's own frame), or None if the game is not in the table
+    """
+    def probe(self, game: QuartoGame, turn=True):
+        if not self.covers(game):
+            return None
+        self.probes += 1
+        key, transformId = endgameKey(self.cannonizer, game, self.perspective == 'batch', turn)
+        data = self.lookup(key)
+        if data is None:
+            return None
+        self.hits += 1
+        score, move = unpackData(data)
+        if len(game.selectedPieces) > 0:
+            return score, CannonBackend.untransformSquare(transformId, move)
+        return score, CannonBackend.untransformPiece(transformId, move)
+
+    def __str__(self) -> str:
+        return (f'Endgame table: {len(self)} games with at most {self.maxEmpty} empty squares ({self.perspective}) | '
+                f'Probes: {self.probes} | Hits: {self.hits}')
+
+
+""" solveEndgame()
+Exact score of a game under a perspective, memoizing every game it solves in memo as
+{key: data byte}. Only stops early at a win, so every stored score is exact.
+"""
+def solveEndgame(cannonizer: GreatQuartoCannon, game: QuartoGame, placingPiece: bool, turn: bool, batch: bool, memo: dict) -> int:
+    # Base cases, as BatchMinimaxSolver.minimax and QuartoMiniMaxSolver.negamax check them
+    if batch:
+        isFinal = game.checkWin()
+        if isFinal or game.avaliableSquareCount == 0 or game.remainingPieceCount == 0:
+            return (1 if turn else -1) if isFinal else 0
+    else:
+        if not placingPiece and game.checkWin():
+            return 1
+        if game.avaliableSquareCount == 0 or (not placingPiece and game.remainingPieceCount == 0):
+            return 0
+
+    key, transformId = endgameKey(cannonizer, game, batch, turn)
+    data = memo.get(key)
+    if data is not None:
+        return unpackData(data)[0]
+
+    if placingPiece:
+        piece = game.selectedPieces[0]
+        square = game.winningSquare(piece)
+        if square is not None:
+            bestScore, bestMove = 1, squareIndex(square)
+        elif game.isDeadDraw():
+            bestScore, bestMove = 0, squareIndex(game.iterAvaliableSquares()[0])
+        else:
+            bestScore, bestMove = -2, None
+            for square in MASK_SQUARES[~game.occupied & FULL_MASK]:
+                game.placePiece(piece, square)
+                score = solveEndgame(cannonizer, game, False, turn, batch, memo)
+                game.removePiece(square)
+                # Batch place nodes score from the placer's view, like negamax
+                if batch and not turn:
+                    score = -score
+                if score > bestScore:
+                    bestScore, bestMove = score, squareIndex(square)
+                if bestScore > 0:
+                    break
+        memo[key] = packData(bestScore, CannonBackend.transformSquare(transformId, bestMove))
+        return bestScore
+
+    threats = game.remainingMask & game.threatPieces()
+    safePieces = game.remainingMask & ~threats
+    if batch and not turn and threats != 0:
+        # The opponent chooses for us here, and batch scores maximize our score
+        bestScore, bestMove = 1, MASK_BITS[threats][0]
+    elif safePieces == 0:
+        bestScore, bestMove = -1, game.iterRemainingPieces()[0]
+    elif game.isDeadDraw():
+        bestScore, bestMove = 0, game.iterRemainingPieces()[0]
+    else:
+        bestScore, bestMove = -2, None
+        for piece in MASK_BITS[safePieces]:
+            game.selectPiece(piece)
+            score = solveEndgame(cannonizer, game, True, not turn if batch else turn, batch, memo)
+            game.deselectAll()
+            # Choosing hands the move over, except on the opponent's batch turn
+            if not batch or turn:
+                score = -score
+            if score > bestScore:
+                bestScore, bestMove = score, piece
+            if bestScore > 0:
+                break
+    memo[key] = packData(bestScore, CannonBackend.transformPiece(transformId, bestMove))
+    return bestScore
+
+
+def initEndgameWorker(batch: bool) -> None:
+    global endgameMemo, endgameBatch, endgameCannon
+    endgameMemo   = {}
+    endgameBatch  = batch
+    endgameCannon = GreatQuartoCannon()
+
+""" solveEndgameChunk()
+Worker task, solves a chunk of (game, placingPiece, turn) games.
+Workers keep their memo between tasks, so each task returns only the (key, data)
+entries it added.
+"""
+def solveEndgameChunk(chunk: list) -> list:
+    start = len(endgameMemo)
+    for game, placingPiece, turn in chunk:
+        solveEndgame(endgameCannon, game, placingPiece, turn, endgameBatch, endgameMemo)
+    return list(itertools.islice(endgameMemo.items(), start, None))
+
+
+""" enumerateEndgames()
+Finds the games with at most maxEmpty empty squares first reached from the roots, skipping
+symmetric repeats. Roots are games with us to move, placing if they have a selected piece.
+
+Returns:
+    List: (game, placingPiece, turn) of each game found
+"""
+def enumerateEndgames(roots: list, maxEmpty: int, batch: bool) -> list:
+    cannonizer = GreatQuartoCannon()
+    seen, found = set(), []
+
+    def explore(game, placingPiece, turn):
+        if not placingPiece and game.checkWin():
+            return
+        if game.avaliableSquareCount == 0 or (not placingPiece and game.remainingPieceCount == 0):
+            return
+        key, _ = endgameKey(cannonizer, game, batch, turn)
+        if key in seen:
+            return
+        seen.add(key)
+        if game.avaliableSquareCount <= maxEmpty:
+            found.append((game.copy(), placingPiece, turn))
+            return
+
+        if placingPiece:
+            piece = game.selectedPieces[0]
+            for square in MASK_SQUARES[~game.occupied & FULL_MASK]:
+                game.placePiece(piece, square)
+                explore(game, False, turn)
+                game.removePiece(square)
+        else:
+            for piece in MASK_BITS[game.remainingMask]:
+                game.selectPiece(piece)
+                explore(game, True, not turn)
+                game.deselectAll()
+
+    for root in roots:
+        explore(root.copy(), len(root.selectedPieces) > 0, True)
+    return found
+
+
+""" buildEndgameTable()
+Builds and saves the table of the games with at most maxEmpty empty squares reachable
+from roots, solved in a pool of workers (in this process when workers is None).
+
+Parameters:
+    roots (list): Games to start from, with us to move.
+    maxEmpty (int): Largest number of empty squares of the games in the table.
+    fileName (str): Name to save the table under, see EndgameTable.
+    perspective (str): 'negamax' or 'batch', see above.
+    chunkSize (int): Games solved per worker task.
+
+Returns:
+    EndgameTable: The saved table, loaded.
+"""
+def buildEndgameTable(roots: list, maxEmpty: int, fileName: str, path="endgameTables/", perspective='negamax',
+                      workers=None, chunkSize=64) -> EndgameTable:
+    if perspective not in PERSPECTIVES:
+        raise ValueError(f'Unknown perspective {perspective}')
+    batch = perspective == 'batch'
+
+    startTime = time.time()
+    games = enumerateEndgames(roots, maxEmpty, batch)
+    print(f'Found {len(games)} endgames with at most {maxEmpty} empty squares in {(time.time() - startTime):.03f}')
+
+    chunks = [games[start:start + chunkSize] for start in range(0, len(games), chunkSize)]
+    entries = {}
+    if workers is None:
+        initEndgameWorker(batch)
+        for chunk in chunks:
+            entries.update(solveEndgameChunk(chunk))
+    else:
+        with multiprocessing.Pool(workers, initializer=initEndgameWorker, initargs=(batch,)) as pool:
+            for chunkEntries in pool.imap_unordered(solveEndgameChunk, chunks):
+                entries.update(chunkEntries)
+    print(f'Solved {len(entries)} games in {(time.time() - startTime):.03f}')
+
+    keys = np.fromiter(entries.keys(), dtype=np.uint64, count=len(entries))
+    data = np.fromiter(entries.values(), dtype=np.uint8, count=len(entries))
+    order = np.argsort(keys)
+
+    os.makedirs(path, exist_ok=True)
+    keysFile, dataFile, metaFile = tableFiles(fileName, path)
+    np.save(keysFile, keys[order])
+    np.save(dataFile, data[order])
+    np.save(metaFile, np.array([maxEmpty, PERSPECTIVES.index(perspective)], dtype=np.int64))
+    return EndgameTable(fileName, path)
@@ -1,8 +1,13 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/numpy.h>
+#include <pybind11/stl.h>
 
 #include <math.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <algorithm>
+#include <vector>
 
 namespace py = pybind11;
 
@@ -183,11 +188,15 @@ void boardXOR(short* board, int xorPiece, int boardSize){
     }
 }
 
+// Each term is a 32 bit shift, so shift counts wrap at 32 and terms are signed 32 bit values.
+// Saved depth tables were built with this score, so it is spelled out here instead of
+// relying on what the compiler does with an oversized int shift.
 int64_t evaluateBoard(short* board, int boardSize){
     int64_t boardHash = 0;
     for(int i=1; i<boardSize; i++){
         if (board[i] >= 0){
-            boardHash += board[i] << (4 * (i-1));
+            uint32_t term = (uint32_t)board[i] << ((4 * (i-1)) & 31);
+            boardHash += (int32_t)term;
         }
     }
     return boardHash;
@@ -198,7 +207,7 @@ void printBoard(short *brdPtr, int boardSize){
     for (int i=0; i<boardSize; i++){
         if (brdPtr[i] >= 0){
             outStr[0] = brdPtr[i] + '0';
-            printf(outStr);
+            printf("%s", outStr);
             printf(", ");
         }
     }
@@ -261,171 +270,274 @@ int cannonizeBoardTransforms(short *brdPtr, int boardSize){
     return bestXor;
 }
 
-int numOnesInBinStr(int binStr) {
-    int count = 0;
-    if (binStr < 0) { return count; }
-    while (binStr > 0) {
-        if (binStr % 2 == 1) {
-            count++;
+// ----------- Full Game Cannonization ----------
+/*
+A full cannonization maps the game through one element of the symmetry group:
+    a square transform t (0-31, numbered as in transformBoard),
+    an XOR piece x (0-15),
+    a feature (bit) permutation f (0-23, lexicographic order of the 4 bit images).
+A piece p is mapped to FEATURE_PERM_MAP[f][p ^ x], and the applied transform is returned
+as the id (t * 16 + x) * 24 + f.
+The tables are filled once when the module loads.
+*/
+const int TRANSFORM_COUNT = 32;
+const int FEATURE_PERM_COUNT = 24;
+
+int SQUARE_PERMS[TRANSFORM_COUNT][16];      // SQUARE_PERMS[t][i] is the index moved to i by t
+int FEATURE_PERMS[FEATURE_PERM_COUNT][4];   // bit i of a mapped piece is bit FEATURE_PERMS[f][i] of the piece
+int FEATURE_PERM_MAP[FEATURE_PERM_COUNT][16];
+int FEATURE_PERM_INDEX[256];                // index of a permutation from its base 4 encoding
+// Squares in the order the python cannonizer scans them (y outer, x inner)
+const int SCAN_ORDER[16] = {0, 4, 8, 12, 1, 5, 9, 13, 2, 6, 10, 14, 3, 7, 11, 15};
+
+void buildSymmetryTables(){
+    short board[16];
+    for (int t=0; t<TRANSFORM_COUNT; t++){
+        for (int i=0; i<16; i++){ board[i] = i; }
+        transformBoard(board, t);
+        for (int i=0; i<16; i++){ SQUARE_PERMS[t][i] = board[i]; }
+    }
+
+    int perm[4] = {0, 1, 2, 3};
+    int f = 0;
+    do {
+        int code = 0;
+        for (int i=0; i<4; i++){
+            FEATURE_PERMS[f][i] = perm[i];
+            code = code * 4 + perm[i];
+        }
+        FEATURE_PERM_INDEX[code] = f;
+        for (int p=0; p<16; p++){
+            int mapped = 0;
+            for (int i=0; i<4; i++){ mapped |= ((p >> perm[i]) & 1) << i; }
+            FEATURE_PERM_MAP[f][p] = mapped;
+        }
+        f++;
+    } while (std::next_permutation(perm, perm + 4));
+}
+
+int popCount4(int value){
+    return (value & 1) + ((value >> 1) & 1) + ((value >> 2) & 1) + ((value >> 3) & 1);
+}
+
+// Picks the square transform and XOR piece the same way cannonizeBoardTransforms does,
+// and writes the XORed, transformed board into dst. Returns the transform, or -1 if none exists.
+int bestSquareTransform(const short* board, short* dst, int* xorOut){
+    short buffBoard[16];
+    int64_t bestHash = 0;
+    int bestTransform = -1;
+    int bestCandidateType = -1;
+
+    for (int t=0; t<TRANSFORM_COUNT; t++){
+        for (int i=0; i<16; i++){ buffBoard[i] = board[SQUARE_PERMS[t][i]]; }
+        int currXor = getXOR(buffBoard);
+        if (currXor < 0){ continue; }
+
+        int currCandidateType = getCandidateType(buffBoard);
+        if (bestCandidateType < 0){ bestCandidateType = currCandidateType; }
+        else if (bestCandidateType == 2 && currCandidateType == 1){
+            bestCandidateType = currCandidateType;
+            bestTransform = -1;
+        }
+        else if (currCandidateType != bestCandidateType){ continue; }
+
+        boardXOR(buffBoard, currXor, 16);
+        int64_t currHash = evaluateBoard(buffBoard, 16);
+        if (bestTransform < 0 || currHash < bestHash){
+            bestTransform = t;
+            bestHash = currHash;
+            *xorOut = currXor;
+            copyBoard(buffBoard, dst, 16);
         }
-        binStr = binStr >> 1;
     }
-    return count;
+    return bestTransform;
 }
 
-bool featureBitSwap(
-    short* brdPtr, 
-    int boardSize, 
-    uint8_t* remPtr,
-    int remSize,
-    int* selectPtr,
-    int selectSize,
-    int bitPos, 
-    int thresh
-){
+// Same rule as GreatQuartoCannon.swapBitsToPos. Finds the first piece (in scan order) with
+// exactly thresh bits set at and above bitPos, and swaps its lowest such bit into bitPos
+// on the board. The swap is recorded in featurePerm.
+bool featureBitSwap(short* board, int* featurePerm, int bitPos, int thresh){
     int posMask = 15 - ((1 << bitPos) - 1);
-    int swapMask = -1;
-    int maskedVal, shiftCount, currPiece;
-    uint8_t remDummyArr[16] = {0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0};
-
-    for (int i = 0; i < boardSize; i++) {
-        if (brdPtr[i] > 0) {
-            maskedVal = brdPtr[i] & posMask;
-            if (maskedVal > 0 && numOnesInBinStr(maskedVal) == thresh) {
+    int shiftCount = -1;
+    for (int n=0; n<16; n++){
+        int piece = board[SCAN_ORDER[n]];
+        if (piece > 0){
+            int maskedVal = piece & posMask;
+            if (maskedVal > 0 && popCount4(maskedVal) == thresh){
                 shiftCount = 0;
-                while (maskedVal % 2 == 0) {
-                    maskedVal = maskedVal >> 1;
+                while ((maskedVal & 1) == 0){
+                    maskedVal >>= 1;
                     shiftCount++;
                 }
-                if (shiftCount == bitPos) {
-                    return true;
-                }
-                else {
-                    swapMask = (1 << shiftCount) + (1 << bitPos);
-                }
                 break;
             }
         }
     }
+    if (shiftCount < 0){ return false; }
+    if (shiftCount == bitPos){ return true; }
 
-    if (swapMask < 0)
-        return false;
-
-    // Swap board piece features
-    for (int i = 0; i < boardSize; i++) {
-        currPiece = brdPtr[i];
-        if ((currPiece > 0) && 
-            ((currPiece & swapMask) != swapMask) && 
-            ((currPiece & swapMask) != 0)) 
-        {
-            brdPtr[i] = currPiece ^ swapMask;
+    int swapMask = (1 << shiftCount) | (1 << bitPos);
+    for (int i=0; i<16; i++){
+        int piece = board[i];
+        if (piece > 0 && (piece & swapMask) != swapMask && (piece & swapMask) != 0){
+            board[i] = piece ^ swapMask;
         }
     }
+    int temp = featurePerm[shiftCount];
+    featurePerm[shiftCount] = featurePerm[bitPos];
+    featurePerm[bitPos] = temp;
+    return true;
+}
 
-    // Swap selected piece features
-    for (int i=0; i<selectSize; i++){
-        currPiece = selectPtr[i];
-        if ((currPiece > 0) && 
-            ((currPiece & swapMask) != swapMask) && 
-            ((currPiece & swapMask) != 0)) 
-        {
-            selectPtr[i] = currPiece ^ swapMask;
+// Same branch sequence as GreatQuartoCannon.cannonizeGame
+void applyFeatureSwaps(short* board, int* featurePerm){
+    if (featureBitSwap(board, featurePerm, 0, 1)){
+        if (featureBitSwap(board, featurePerm, 1, 1)){
+            featureBitSwap(board, featurePerm, 2, 1);
+        }
+        else if (featureBitSwap(board, featurePerm, 1, 2)){
+            featureBitSwap(board, featurePerm, 2, 1);
         }
     }
+    else if (featureBitSwap(board, featurePerm, 0, 2)){
+        featureBitSwap(board, featurePerm, 1, 2);
+        featureBitSwap(board, featurePerm, 2, 1);
+    }
+    else if (featureBitSwap(board, featurePerm, 0, 3)){
+        featureBitSwap(board, featurePerm, 1, 2);
+        featureBitSwap(board, featurePerm, 2, 1);
+    }
+}
 
-    // Swap Remaining piece features
-    for (int i=0; i<remSize; i++){
-        if (remPtr[i] == 1){
-            if (((i & swapMask) != swapMask) && ((i & swapMask) != 0)) {
-                remDummyArr[i ^ swapMask] = 1;
-            } else {
-                remDummyArr[i] = 1;
-            }
-        } 
+// Cannonizes a contiguous (x * 4 + y) board in place.
+// Returns the transform id, the piece mapping is FEATURE_PERM_MAP[id % 24][p ^ ((id / 24) % 16)]
+// If xorOut is given, the XOR piece is written to it (-1 when the board has no candidate).
+int cannonizeBoardFull(short* board, int* xorOut = nullptr){
+    short bestBoard[16];
+    int xorPiece = 0;
+    int squareTransform = bestSquareTransform(board, bestBoard, &xorPiece);
+    if (xorOut != nullptr){
+        *xorOut = squareTransform < 0 ? -1 : xorPiece;
     }
-    for (int i=0; i<remSize; i++){
-        remPtr[i] = remDummyArr[i];
+    if (squareTransform < 0){
+        return 0; // No pieces, identity
     }
 
-    return true;
+    int featurePerm[4] = {0, 1, 2, 3};
+    applyFeatureSwaps(bestBoard, featurePerm);
+    copyBoard(bestBoard, board, 16);
+
+    int code = 0;
+    for (int i=0; i<4; i++){ code = code * 4 + featurePerm[i]; }
+    return (squareTransform * 16 + xorPiece) * FEATURE_PERM_COUNT + FEATURE_PERM_INDEX[code];
 }
 
-void ApplyFeatureSwaps(py::array_t<short> board, py::array_t<uint8_t> remPieces, py::array_t<int> selPieces){
-    // Get buffer info (allows access to raw data)
+int mapPiece(int transformId, int piece){
+    int xorPiece = (transformId / FEATURE_PERM_COUNT) & 15;
+    return FEATURE_PERM_MAP[transformId % FEATURE_PERM_COUNT][piece ^ xorPiece];
+}
+
+int mapPool(int transformId, int poolMask){
+    int mapped = 0;
+    for (int p=0; p<16; p++){
+        if ((poolMask >> p) & 1){ mapped |= 1 << mapPiece(transformId, p); }
+    }
+    return mapped;
+}
+
+//======== cannonizeGame ==================
+//   Cannonizes a 4x4 int16 board in place, along with the remaining pool mask and selected pieces.
+//   returns (remainingMask, selectedPieces, transformId)
+py::tuple cannonizeGame(py::array_t<short> board, int remainingMask, std::vector<int> selected){
     py::buffer_info buf = board.request();
-    // Ensure it's mutable
     if (buf.readonly) {
         throw std::runtime_error("Input array is not writable!");
     }
-    short* brdPtr = static_cast<short*>(buf.ptr);
-    int boardSize = static_cast<int>(buf.size);
-    
-    // Get rem pieces buffer
-    py::buffer_info remBuf = board.request();
-    // Ensure it's mutable
-    if (remBuf.readonly) {
-        throw std::runtime_error("Input array is not writable!");
-    }
-    uint8_t* remPtr = static_cast<uint8_t*>(remBuf.ptr);
-    int remPiecesCount = static_cast<int>(remBuf.size);
-
-    // Get rem pieces buffer
-    py::buffer_info selectBuf = board.request();
-    // Ensure it's mutable
-    if (selectBuf.readonly) {
-        throw std::runtime_error("Input array is not writable!");
+    if (buf.size != 16) {
+        throw std::runtime_error("Expected a 4x4 board!");
     }
-    int* selectPtr = static_cast<int*>(selectBuf.ptr);
-    int selectPiecesCount = static_cast<int>(selectBuf.size);
+    short* brdPtr = static_cast<short*>(buf.ptr);
 
+    int transformId = cannonizeBoardFull(brdPtr);
+    for (size_t i=0; i<selected.size(); i++){ selected[i] = mapPiece(transformId, selected[i]); }
+    return py::make_tuple(mapPool(transformId, remainingMask), selected, transformId);
+}
 
-    bool success = featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 0, 1);
-    if (success) {
-        bool success = featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 1, 1);
-        if (success) {
-            featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 2, 1);
-        }
-        else {
-            bool success = featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 1, 2);
-            if (success) {
-                featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 2, 3);
-            }
-        }
-    }
-    else {
-        bool success = featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 0, 2);
-        if (success) {
-            featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 1, 2);
-            featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 2, 1);
-        }
-        else {
-            bool success = featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 0, 3);
-            if (success) {
-                featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 1, 2);
-                featureBitSwap(brdPtr, boardSize, remPtr, remPiecesCount, selectPtr, selectPiecesCount, 2, 1);
-            }
+//======== cannonizePacked ==================
+//   Cannonizes a packed game (see QuartoBitboard). Square s of the packed board is (x, y) = (s % 4, s / 4).
+//   returns (cells, occupied, remainingMask, selectedPieces, transformId)
+py::tuple cannonizePacked(uint64_t cells, int occupied, int remainingMask, std::vector<int> selected){
+    short board[16];
+    for (int s=0; s<16; s++){
+        int f = (s & 3) * 4 + (s >> 2);
+        board[f] = ((occupied >> s) & 1) ? (short)((cells >> (s << 2)) & 15) : -1;
+    }
+
+    int transformId = cannonizeBoardFull(board);
+
+    uint64_t newCells = 0;
+    int newOccupied = 0;
+    for (int s=0; s<16; s++){
+        int f = (s & 3) * 4 + (s >> 2);
+        if (board[f] >= 0){
+            newCells |= (uint64_t)board[f] << (s << 2);
+            newOccupied |= 1 << s;
         }
     }
+    for (size_t i=0; i<selected.size(); i++){ selected[i] = mapPiece(transformId, selected[i]); }
+    return py::make_tuple(newCells, newOccupied, mapPool(transformId, remainingMask), selected, transformId);
 }
 
-void xorPieces(int* selectPtr, int selectSize, uint8_t* remPtr, int remSize, int xorPiece){
-    if (xorPiece < 0 || xorPiece > remSize){
-        return;
-    }
-    for(int i=0; i<selectSize; i++){
-        selectPtr[i] = selectPtr[i] ^ xorPiece;
+//======== cannonize_many ==================
+//   Cannonizes N boards given as an (N,16) int16 array of contiguous (x * 4 + y) boards,
+//   and optionally their (N,) uint16 remaining pool masks. The loop runs without the GIL.
+//   returns (boards, xorPieces, transformIds) or (boards, xorPieces, transformIds, pools)
+py::tuple cannonizeMany(py::array_t<short, py::array::c_style | py::array::forcecast> boards, py::object pools){
+    if (boards.ndim() != 2 || boards.shape(1) != 16) {
+        throw std::runtime_error("Expected an (N,16) board array!");
+    }
+    py::ssize_t count = boards.shape(0);
+    bool hasPools = !pools.is_none();
+
+    py::array_t<uint16_t, py::array::c_style | py::array::forcecast> poolArray;
+    if (hasPools) {
+        poolArray = py::array_t<uint16_t, py::array::c_style | py::array::forcecast>::ensure(pools);
+        if (!poolArray || poolArray.ndim() != 1 || poolArray.shape(0) != count) {
+            throw std::runtime_error("Expected an (N,) pool array!");
+        }
     }
 
-    uint8_t remDummyArr[16] = {0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0};
-    // Swap Remaining piece features
-    for (int i=0; i<remSize; i++){
-        if (((i & xorPiece) != xorPiece) && ((i & xorPiece) != 0)) {
-            remDummyArr[i ^ xorPiece] = 1;
+    py::array_t<short> outBoards({count, (py::ssize_t)16});
+    py::array_t<short> outXors(count);
+    py::array_t<int32_t> outIds(count);
+    py::array_t<uint16_t> outPools(hasPools ? count : 0);
+
+    const short* src = boards.data();
+    short* dst = outBoards.mutable_data();
+    short* xors = outXors.mutable_data();
+    int32_t* ids = outIds.mutable_data();
+    const uint16_t* poolSrc = hasPools ? poolArray.data() : nullptr;
+    uint16_t* poolDst = hasPools ? outPools.mutable_data() : nullptr;
+
+    {
+        py::gil_scoped_release release;
+        for (py::ssize_t n=0; n<count; n++){
+            short* board = dst + n * 16;
+            copyBoard((short*)(src + n * 16), board, 16);
+            int xorPiece = -1;
+            int transformId = cannonizeBoardFull(board, &xorPiece);
+            xors[n] = (short)xorPiece;
+            ids[n] = transformId;
+            if (hasPools){
+                poolDst[n] = (uint16_t)mapPool(transformId, poolSrc[n]);
+            }
         }
     }
-    for (int i=0; i<remSize; i++){
-        remPtr[i] = remDummyArr[i];
+
+    if (hasPools){
+        return py::make_tuple(outBoards, outXors, outIds, outPools);
     }
+    return py::make_tuple(outBoards, outXors, outIds);
 }
 
 int cannonize(py::array_t<short> board) {
@@ -478,8 +590,13 @@ bool PlacePiece(py::array_t<short> board, int x, int y, int piece){
 
 
 PYBIND11_MODULE(FastCannon, m) {
+    buildSymmetryTables();
     m.def("cannonize", &cannonize, "Fast Quarto Cannonization");
     m.def("placePiece", &PlacePiece, "Place Piece Quickly");
+    m.def("cannonizeGame", &cannonizeGame, "Cannonize a board, pool and selection in one call");
+    m.def("cannonizePacked", &cannonizePacked, "Cannonize a packed game in one call");
+    m.def("cannonize_many", &cannonizeMany, "Cannonize an (N,16) array of boards",
+          py::arg("boards"), py::arg("pools") = py::none());
 }
 
 
@@ -3,11 +3,19 @@ from QuartoCannon import QuartoCannon
 from QuartoDataTypes import IntVector2
 import numpy as np
 
-import FastCannon
+import CannonBackend
+import CannonCache
+from QuartoBitboard import SQUARE_COUNT, FULL_MASK
+
+# Boards with more pieces than this almost never have a stabilizer that moves a remaining piece,
+# or square, so choosablePieces and placeableSquares do not look for one there
+ORBIT_PRUNING_MAX_PIECES = 8
 
 class GreatQuartoCannon(QuartoCannon):
-    def __init__(self):
+    # cache (CannonCache): where cannonizations are remembered, the process wide sharedCache by default
+    def __init__(self, cache=None):
         super().__init__()
+        self.cache = cache if cache is not None else CannonCache.sharedCache
 
     def reset(self):
         return super().reset()
@@ -158,10 +166,95 @@ class GreatQuartoCannon(QuartoCannon):
     #======= cannonizeGame ==========
     # Canonicalizes a game board by applying D4 transformations, candidate selection,
     # and XOR normalization, then returns the best board based on evaluation.
+    # The board, selection and pool are cannonized in one backend call (see CannonBackend).
     def cannonizeGame(self, game):
+        return self.cannonizeGameWithTransform(game)[0]
+
+    #======= cannonizeGameWithTransform ==========
+    # Same as cannonizeGame, but also returns the transform id that was applied,
+    # so moves can be mapped between the game and its cannonized copy.
+    # The result is remembered in the cannon cache.
+    def cannonizeGameWithTransform(self, game):
+        rawKey = game.zobristKey
+        game = game.copy()
+        transformId = game.cannonize()
+        self.cache.put(rawKey, game.zobristKey, transformId)
+        return game, transformId
+
+    #======= stabilizer ==========
+    # Returns the transform ids (see CannonBackend) that leave the game's board unchanged.
+    def stabilizer(self, game):
+        return CannonBackend.stabilizer([game.squarePiece(s) for s in range(SQUARE_COUNT)], game.occupied)
+
+    #======= pieceRepresentatives ==========
+    # Returns the mask of one remaining piece (the lowest) from each orbit of the pool under
+    # the board's stabilizer. Choosing pieces from the same orbit gives symmetric games
+    # with the same score, so a choose node only has to search these.
+    def pieceRepresentatives(self, game) -> int:
+        return CannonBackend.orbitRepresentatives(self.stabilizer(game), game.remainingMask)
+
+    #======= squareRepresentatives ==========
+    # Returns the mask of one empty square (the lowest) from each orbit under the transforms
+    # that leave both the board and piece unchanged. Placing piece on squares from the same
+    # orbit gives symmetric games, so a place node only has to search these.
+    def squareRepresentatives(self, game, piece: int) -> int:
+        return CannonBackend.squareOrbitRepresentatives(self.stabilizer(game), ~game.occupied & FULL_MASK, piece)
+
+    #======= choosablePieces ==========
+    # The remaining pieces a choose node has to search: pieceRepresentatives on boards with
+    # at most ORBIT_PRUNING_MAX_PIECES pieces, every remaining piece on fuller boards.
+    def choosablePieces(self, game) -> int:
+        if SQUARE_COUNT - game.avaliableSquareCount > ORBIT_PRUNING_MAX_PIECES:
+            return game.remainingMask
+        return self.pieceRepresentatives(game)
+
+    #======= placeableSquares ==========
+    # The empty squares a place node has to search for piece, squareRepresentatives when
+    # the board is small enough, like choosablePieces.
+    def placeableSquares(self, game, piece: int) -> int:
+        if SQUARE_COUNT - game.avaliableSquareCount > ORBIT_PRUNING_MAX_PIECES:
+            return ~game.occupied & FULL_MASK
+        return self.squareRepresentatives(game, piece)
+
+    #======= cannonKey ==========
+    # Returns (canonical zobristKey, transform id) of a game. Cached games are answered
+    # without copying or cannonizing the game.
+    def cannonKey(self, game):
+        entry = self.cache.get(game.zobristKey)
+        if entry is None:
+            cannonGame, transformId = self.cannonizeGameWithTransform(game)
+            entry = (cannonGame.zobristKey, transformId)
+        return entry
+
+    #======= exactCannonKey ==========
+    # Returns (exact canonical key, transform id) of a game, a key shared by all its
+    # symmetric games (see CannonBackend.exactCanonicalKey). Slower than cannonKey,
+    # it is meant for tables that must find a game under any of its symmetries.
+    def exactCannonKey(self, game):
+        return CannonBackend.exactCanonicalKey([game.squarePiece(s) for s in range(SQUARE_COUNT)],
+                                               game.occupied, game.selectedPieces)
+
+    #======= cannonizeGameCached ==========
+    # Same as cannonizeGame, but a cached game is rebuilt from its stored transform
+    # instead of searching the transforms again.
+    def cannonizeGameCached(self, game):
+        entry = self.cache.get(game.zobristKey)
+        if entry is None:
+            return self.cannonizeGame(game)
+        game = game.copy()
+        game.applyTransform(entry[1])
+        return game
+
+    #======= cannonizeGameStepwise ==========
+    # The step by step version of cannonizeGame, board transforms through the backend and
+    # the feature swaps in python. Gives the same game, kept for testing and reference.
+    def cannonizeGameStepwise(self, game):
         game = game.copy()
         
-        xorPiece = FastCannon.cannonize(game.board)
+        # Packed engines build board on request, so the edited board is assigned back
+        board = game.board
+        xorPiece = CannonBackend.cannonize(board)
+        game.board = board
         game.xorPieces(xorPiece)
         
         
@@ -185,6 +278,7 @@ class GreatQuartoCannon(QuartoCannon):
                     self.swapBitsToPos(game, 1, 2)
                     self.swapBitsToPos(game, 2, 1)
 
+        game.syncState()
         return game
 
         #Python Cannoize logic, kept commented for testing and reference
@@ -287,6 +381,7 @@ class GreatQuartoCannon(QuartoCannon):
                 piece = board[x,y]
                 if piece > 0 and piece & swapMask != swapMask and piece & swapMask != 0:
                     board[x,y] = piece ^ swapMask
+        game.board = board
 
         self.maskedBitSwap(game, swapMask)
 
@@ -5,6 +5,8 @@ import time
 import math
 import multiprocessing
 from BatchMinimax import BatchMinimaxSolver
+from TranspositionTable import SharedTranspositionTable
+from EndgameTable import EndgameTable
 
 # Parallel Worker
 # def solveGame(index, dataLoader, solver):
@@ -15,11 +17,17 @@ from BatchMinimax import BatchMinimaxSolver
 
 #     return moves
 
-def solveGameBatch(indices, dataLoader):
-    solver = BatchMinimaxSolver()
+# Solves a batch of games with the memo in the shared table, returns the solutions and
+# the worker's (probes, hits, cross hits, stores) table counters. endgameTable (an EndgameTable
+# built with 'batch' scores, or None) is memory mapped again in each worker
+def solveGameBatch(indices, dataLoader, sharedTable, workerId, endgameTable=None):
+    sharedTable.workerId = workerId
+    solver = BatchMinimaxSolver(hashMode='zobrist', buildSolutions=False, sharedTable=sharedTable, endgameTable=endgameTable)
     games = [dataLoader.getGame(indices[i]) for i in range(len(indices))]
     solutions = solver.solveBatch(games)
-    return solutions
+    counters = sharedTable.counters()
+    sharedTable.close()
+    return solutions, counters
 
 # Worker dispatcher
 if __name__ == '__main__':
@@ -30,9 +38,15 @@ if __name__ == '__main__':
     depthTableLocation = "S:/QuartoStates/"
     numToSolve = 100
     numPerBatch = 100
+    tableBytes = 1 << 30 # shared by every worker
+    endgameTableName = None # name of an EndgameTable in endgameTables/, see EndgameTable.buildEndgameTable
+
+    sharedTable = SharedTranspositionTable(tableBytes)
+    probes, hits, crossHits = 0, 0, 0
 
     dataLoader = DepthSaver()
     dataLoader.loadGames(fileName=depthTableName, path=depthTableLocation)
+    endgameTable = EndgameTable(endgameTableName) if endgameTableName is not None else None
 
     startTime = time.time()
     bestTime, worstTime = math.inf, 0
@@ -67,10 +81,15 @@ if __name__ == '__main__':
                 break
         
         with multiprocessing.Pool(processes=len(indices)) as pool:
-            results = pool.starmap(solveGameBatch, [(indices[i], dataLoader) for i in range(len(indices))])
+            results = pool.starmap(solveGameBatch, [(indices[i], dataLoader, sharedTable, i + 1, endgameTable) for i in range(len(indices))])
             for i in range(len(results)):
-                for n in range(len(results[i])):
-                    dataLoader.setSolution(indices[i][n], results[i][n])
+                solutions, counters = results[i]
+                for n in range(len(solutions)):
+                    dataLoader.setSolution(indices[i][n], solutions[n])
+                probes    += counters[0]
+                hits      += counters[1]
+                crossHits += counters[2]
+        print(f'Shared table probes: {probes} | Hits: {hits} | Cross worker hits: {crossHits} ({crossHits / max(probes, 1):.1%} of probes)')
 
         startIndex += numWorkers * numPerBatch
 
@@ -81,6 +100,7 @@ if __name__ == '__main__':
     print(f'Took a total of {time.time() - startTime :.03f} seconds')
     print(f'Best Time: {bestTime:.03f} and worst time: {worstTime:.03f}')
 
+    sharedTable.close()
     dataLoader.saveSolution(solutionName)
 
 
@@ -0,0 +1,201 @@
+import multiprocessing
+import time
+from SearchBudget import SearchBudget, SearchAborted
+
+"""
+ParallelRootSearch spreads the root moves of a solver's search over a process pool.
+Each root move (a square when placing, a piece when choosing) is searched by its own task,
+on a solver built in the worker with the same settings as the parent's.
+
+Workers given a SharedTranspositionTable share it (Lazy SMP style), each storing its entries
+under its own worker id, and report how many of their hits came from other workers.
+
+The serial search takes the first move with the best score and stops at the first win,
+so only moves before the first win matter. Workers share the lowest index of a winning
+move, and searches of later moves stop as soon as one is known. The merge then walks the
+results in move order, exactly like the serial loop, so it picks the same move.
+
+The parent's budget stays a hard limit across the workers: tasks get an absolute deadline
+instead of a duration, so a task picked up late does not get a fresh clock, and every
+worker counts its nodes in one shared counter checked against the nodes left.
+"""
+
+# Worker globals, set up by initRootWorker
+rootSolver = None
+winIndex   = None
+nodeCount  = None
+
+# How many nodes a worker explores between checks of the shared win index
+WIN_CHECK_NODES = 256
+
+# How many nodes a worker counts locally before adding them to the shared node count,
+# so workers only take its lock once per batch. A search can overshoot max_nodes by
+# at most this many nodes per worker.
+NODE_FLUSH_NODES = 64
+
+
+class RootMoveBudget(SearchBudget):
+
+    """
+    A worker's budget: the parent's deadline (time.time() seconds) and the nodes left of its
+    budget, counted over all workers in sharedNodes in batches of NODE_FLUSH_NODES, and an
+    abort once a root move before this one is known to win.
+    """
+    def __init__(self, deadline, max_nodes, sharedWinIndex, sharedNodes, index: int):
+        super().__init__(None, max_nodes)
+        self.deadline = deadline
+        self.sharedWinIndex = sharedWinIndex
+        self.sharedNodes = sharedNodes
+        self.index = index
+        self.unflushedNodes = 0
+        self.sharedTotal = sharedNodes.value # shared node count at the last flush
+
+    # Adds the locally counted nodes to the shared count
+    def flush(self) -> None:
+        with self.sharedNodes.get_lock():
+            self.sharedNodes.value += self.unflushedNodes
+            self.sharedTotal = self.sharedNodes.value
+        self.unflushedNodes = 0
+
+    def spend(self) -> None:
+        self.nodes += 1
+        if self.max_nodes is not None:
+            self.unflushedNodes += 1
+            if self.unflushedNodes >= NODE_FLUSH_NODES:
+                self.flush()
+            if self.sharedTotal + self.unflushedNodes > self.max_nodes:
+                raise SearchAborted()
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchAborted()
+        if self.nodes % WIN_CHECK_NODES == 0 and self.sharedWinIndex.value < self.index:
+            raise SearchAborted()
+
+
+def initRootWorker(solverClass, solverArgs: dict, sharedWinIndex, sharedNodes, workerCounter) -> None:
+    global rootSolver, winIndex, nodeCount
+    rootSolver = solverClass(**solverArgs)
+    winIndex   = sharedWinIndex
+    nodeCount  = sharedNodes
+    with workerCounter.get_lock():
+        workerCounter.value += 1
+        workerId = workerCounter.value # the parent process is worker 0
+    if hasattr(rootSolver.transpositionTable, 'workerId'):
+        rootSolver.transpositionTable.workerId = workerId
+
+# Returns a worker's (probes, hits, cross hits) shared table counters
+def tableCounters() -> tuple:
+    table = rootSolver.transpositionTable
+    if not hasattr(table, 'crossHits'):
+        return 0, 0, 0
+    return table.probes, table.hits, table.crossHits
+
+""" searchRootMove()
+Worker task, searches one root move of the cannonized root game.
+deadline is an absolute time.time() in seconds and max_nodes the nodes left for all the tasks.
+
+Returns:
+    Tuple: (move index, score from the root player's view or None if the search stopped, nodes explored,
+            (probes, hits, cross hits) of the shared table during the search)
+"""
+def searchRootMove(game, index: int, move, placingPiece: bool, depth: int, deadline, max_nodes):
+    if winIndex.value < index:
+        return index, None, 0, (0, 0, 0)
+
+    startExplored = rootSolver.exploredCounter
+    startCounters = tableCounters()
+    rootSolver.budget = RootMoveBudget(deadline, max_nodes, winIndex, nodeCount, index)
+    try:
+        score = rootSolver.searchRootMove(game, move, placingPiece, depth)
+    except SearchAborted:
+        score = None
+    finally:
+        rootSolver.budget.flush()
+        rootSolver.budget = None
+
+    if score is not None and score > 0:
+        with winIndex.get_lock():
+            if index < winIndex.value:
+                winIndex.value = index
+    counters = tuple(end - start for start, end in zip(startCounters, tableCounters()))
+    return index, score, rootSolver.exploredCounter - startExplored, counters
+
+
+class ParallelRootSearch:
+
+    """
+    Parameters:
+        workers (int): Number of worker processes.
+        solverClass: Solver class the workers build, it must provide searchRootMove().
+        solverArgs (dict): Constructor arguments of the workers' solvers.
+    """
+    def __init__(self, workers: int, solverClass, solverArgs: dict):
+        self.workers     = workers
+        self.solverClass = solverClass
+        self.solverArgs  = solverArgs
+        self.winIndex    = multiprocessing.Value('i', 0)
+        self.nodeCount   = multiprocessing.Value('q', 0)
+        self.workerCounter = multiprocessing.Value('i', 0)
+        self.pool        = None
+
+        self.probes    = 0
+        self.hits      = 0
+        self.crossHits = 0
+
+    # Workers keep their solvers (and memo tables) between searches, so the pool is made once
+    def getPool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=initRootWorker,
+                                             initargs=(self.solverClass, self.solverArgs, self.winIndex, self.nodeCount,
+                                                       self.workerCounter))
+        return self.pool
+
+    """ search()
+    Searches the root moves of a cannonized root game in the pool and merges the results
+    in move order, taking the first best score and stopping at the first win.
+    moves are the root moves in the order the serial search tries them.
+    Raises SearchAborted if a move that decides the result ran out of budget.
+
+    Returns:
+        Tuple: (best score, best move, nodes explored by the workers)
+    """
+    def search(self, game, moves: list, placingPiece: bool, depth: int, budget=None):
+        deadline, max_nodes = None, None
+        if budget is not None:
+            if budget.time_ms is not None:
+                deadline = time.time() + max(0, budget.time_ms - budget.elapsedMs()) / 1000
+            if budget.max_nodes is not None:
+                max_nodes = max(0, budget.max_nodes - budget.nodes)
+
+        self.winIndex.value = len(moves)
+        self.nodeCount.value = 0
+        tasks = [(game, i, move, placingPiece, depth, deadline, max_nodes) for i, move in enumerate(moves)]
+        results = sorted(self.getPool().starmap(searchRootMove, tasks, chunksize=1))
+
+        nodes = sum(result[2] for result in results)
+        if budget is not None:
+            budget.nodes += nodes
+        for _, _, _, (probes, hits, crossHits) in results:
+            self.probes    += probes
+            self.hits      += hits
+            self.crossHits += crossHits
+
+        bestScore, bestMove = -2, None
+        for index, score, _, _ in results:
+            if score is None:
+                raise SearchAborted()
+            if score > bestScore:
+                bestScore, bestMove = score, moves[index]
+            if bestScore > 0:
+                break
+        return bestScore, bestMove, nodes
+
+    def __str__(self) -> str:
+        crossRate = self.crossHits / self.probes if self.probes > 0 else 0.0
+        return (f'Root workers: {self.workers} | Shared table probes: {self.probes} | Hits: {self.hits} | '
+                f'Cross worker hits: {self.crossHits} ({crossRate:.1%} of probes)')
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,184 @@
+import numpy as np
+import CannonBackend
+from QuartoBitboard import SQUARE_COUNT, PIECE_COUNT, FULL_MASK, FEATURE_MASK, LINES, FLAT_TO_SQUARE, SQUARE_TO_FLAT, ZOBRIST_SQUARE
+
+# =================================================
+#   Vectorized tools for working with millions of boards at once
+#
+#   Boards are (N,16) int16 arrays in the same layout as QuartoGame.board.reshape(-1)
+#   (index x * 4 + y), with -1 for empty squares, so a row can be assigned straight
+#   to a game with game.board = boards[i].reshape(4, 4).
+#
+#   hashBoard values are 80 bits, which numpy cannot hold, so they are split into
+#       values   (uint64): the piece nibbles, hash >> 16
+#       occupied (uint16): the occupancy field, hash & 0xFFFF
+# =================================================
+
+# Win lines in board layout
+FLAT_LINES = np.array([[SQUARE_TO_FLAT[s] for s in line] for line in LINES], dtype=np.intp)
+
+#======== splitHashes ==================
+#   Splits hashBoard ints (or their string forms) into values and occupied arrays.
+def splitHashes(hashes) -> tuple[np.ndarray, np.ndarray]:
+    hashes = [int(h) for h in hashes]
+    values   = np.fromiter((h >> SQUARE_COUNT for h in hashes), dtype=np.uint64, count=len(hashes))
+    occupied = np.fromiter((h & FULL_MASK for h in hashes), dtype=np.uint16, count=len(hashes))
+    return values, occupied
+
+#======== decodeHashes ==================
+#   Vectorized QuartoGame.loadFromHash for N boards.
+#   Returns (N,16) boards in board layout.
+def decodeHashes(values: np.ndarray, occupied: np.ndarray) -> np.ndarray:
+    values   = np.asarray(values, dtype=np.uint64)
+    occupied = np.asarray(occupied, dtype=np.uint16).astype(np.uint32)
+
+    # Square s is flagged by bit 15 - s of the occupancy field
+    shifts = np.arange(SQUARE_COUNT - 1, -1, -1, dtype=np.uint32)
+    isOccupied = ((occupied[:, None] >> shifts) & 1).astype(bool)
+
+    # The last occupied square holds the least significant nibble, so a square's
+    # nibble index is the number of occupied squares after it
+    after = np.cumsum(isOccupied[:, ::-1], axis=1)[:, ::-1] - isOccupied
+    nibbles = (values[:, None] >> (after.astype(np.uint64) * np.uint64(4))) & np.uint64(FEATURE_MASK)
+
+    squares = np.where(isOccupied, nibbles.astype(np.int16), np.int16(-1))
+    return np.ascontiguousarray(squares[:, list(FLAT_TO_SQUARE)])
+
+#======== encodeBoards ==================
+#   Vectorized QuartoGame.hashBoard for N boards, the inverse of decodeHashes.
+#   Returns (values, occupied) arrays, see hashesFromArrays to join them.
+def encodeBoards(boards: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    squares = np.asarray(boards)[:, list(SQUARE_TO_FLAT)]
+    isOccupied = squares >= 0
+
+    values   = np.zeros(len(squares), dtype=np.uint64)
+    occupied = np.zeros(len(squares), dtype=np.uint32)
+    for s in range(SQUARE_COUNT):
+        pieces = squares[:, s].astype(np.uint64) & np.uint64(FEATURE_MASK)
+        values   = np.where(isOccupied[:, s], (values << np.uint64(4)) | pieces, values)
+        occupied = (occupied << 1) | isOccupied[:, s]
+    return values, occupied.astype(np.uint16)
+
+# Joins values and occupied arrays back into hashBoard ints
+def hashesFromArrays(values: np.ndarray, occupied: np.ndarray) -> list[int]:
+    return [(v << SQUARE_COUNT) | o for v, o in zip(values.tolist(), occupied.tolist())]
+
+#======== zobristKeys ==================
+#   Zobrist keys of the placed pieces of N boards, matching QuartoGame.zobristKey
+#   for games with no selected pieces.
+_ZOBRIST_SQUARE = np.array(ZOBRIST_SQUARE, dtype=np.uint64)
+_FLAT_SQUARES   = np.array(FLAT_TO_SQUARE, dtype=np.int64)
+def zobristKeys(boards: np.ndarray) -> np.ndarray:
+    boards = np.asarray(boards)
+    indices = _FLAT_SQUARES * PIECE_COUNT + np.maximum(boards, 0)
+    keys = np.where(boards >= 0, _ZOBRIST_SQUARE[indices], np.uint64(0))
+    return np.bitwise_xor.reduce(keys, axis=1)
+
+#======== expandBoards ==================
+#   Every board reached by placing one unused piece on one empty square of N boards.
+def expandBoards(boards: np.ndarray) -> np.ndarray:
+    return expandBoardMoves(boards)[0]
+
+#======== expandBoardMoves ==================
+#   Same children as expandBoards, in the same order (by parent, then square, then piece).
+#   Returns:
+#       (children, parent rows, board indices of the squares, pieces)
+def expandBoardMoves(boards: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    boards = np.asarray(boards, dtype=np.int16)
+    rows = np.arange(len(boards))[:, None]
+    used = np.zeros((len(boards), PIECE_COUNT + 1), dtype=bool)
+    used[rows, np.where(boards >= 0, boards, PIECE_COUNT)] = True
+
+    parents, squares, pieces = np.nonzero((boards < 0)[:, :, None] & ~used[:, None, :PIECE_COUNT])
+    children = boards[parents]
+    children[np.arange(len(children)), squares] = pieces
+    return children, parents, squares, pieces
+
+#======== uniqueBoards ==================
+#   Removes duplicate rows from an (N,16) board array
+def uniqueBoards(boards: np.ndarray) -> np.ndarray:
+    boards = np.ascontiguousarray(boards, dtype=np.int16)
+    if len(boards) == 0:
+        return boards
+    rows = boards.view(np.dtype((np.void, boards.itemsize * SQUARE_COUNT))).reshape(-1)
+    _, first = np.unique(rows, return_index=True)
+    return boards[np.sort(first)]
+
+#======== expandLayer ==================
+#   The boards with one more piece on them than a layer of boards with placed - 1 pieces:
+#   every child, cannonized, without won boards and without duplicates.
+#   The layer is expanded chunkSize boards at a time.
+def expandLayer(layer: np.ndarray, placed: int, chunkSize=4096) -> np.ndarray:
+    nextLayer = []
+    for start in range(0, len(layer), chunkSize):
+        children = expandBoards(layer[start:start + chunkSize])
+        children, _, _ = CannonBackend.cannonize_many(children)
+        if placed >= 4:
+            children = children[~winMask(children)]
+        nextLayer.append(uniqueBoards(children))
+    if len(nextLayer) == 0:
+        return np.empty((0, SQUARE_COUNT), dtype=np.int16)
+    return uniqueBoards(np.concatenate(nextLayer))
+
+#======== winMask ==================
+#   True for every board with a won line
+def winMask(boards: np.ndarray) -> np.ndarray:
+    boards = np.asarray(boards)
+    wins = np.zeros(len(boards), dtype=bool)
+    for line in FLAT_LINES:
+        pieces = boards[:, line]
+        full   = (pieces >= 0).all(axis=1)
+        andCmp = np.bitwise_and.reduce(pieces, axis=1)
+        orCmp  = np.bitwise_or.reduce(pieces, axis=1)
+        wins  |= full & ((andCmp != 0) | (orCmp != FEATURE_MASK))
+    return wins
+
+#======== duplicateMask ==================
+#   True for every board that holds the same piece more than once
+def duplicateMask(boards: np.ndarray) -> np.ndarray:
+    ordered = np.sort(np.asarray(boards), axis=1)
+    return ((ordered[:, 1:] == ordered[:, :-1]) & (ordered[:, 1:] >= 0)).any(axis=1)
+
+#======== validMask ==================
+#   True for hashes that decode to a legal board: no duplicate pieces, and no
+#   piece bits beyond the number of occupied squares (the hash round trips).
+def validMask(values: np.ndarray, occupied: np.ndarray, boards: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    counts = (np.asarray(boards) >= 0).sum(axis=1)
+    # Shifting a uint64 by 64 is undefined, a full board has no spare bits to check
+    shifts = (np.minimum(counts, SQUARE_COUNT - 1) * 4).astype(np.uint64)
+    spare  = np.where(counts < SQUARE_COUNT, values >> shifts, np.uint64(0))
+    return (spare == 0) & ~duplicateMask(boards)
+
+#======== analyzeHashes ==================
+#   Decodes N hashes and checks them in vectorized passes.
+#   Returns:
+#       (boards, wins, duplicates, valid)
+def analyzeHashes(hashes):
+    values, occupied = splitHashes(hashes)
+    boards = decodeHashes(values, occupied)
+    return boards, winMask(boards), duplicateMask(boards), validMask(values, occupied, boards)
+
+#======== filterDepthTable ==================
+#   Copies a depth table of hash,solution lines, keeping only valid non-winning boards.
+#   The table is processed chunkSize lines at a time to bound memory.
+#   Returns:
+#       (lines kept, lines read)
+def filterDepthTable(srcPath, dstPath, chunkSize=1_000_000):
+    kept, total = 0, 0
+    with open(srcPath) as src, open(dstPath, 'w') as dst:
+        while True:
+            lines = src.readlines(chunkSize * 16) # size hint in characters
+            if len(lines) == 0:
+                break
+            pairs = [line.rstrip('\n').split(',') for line in lines]
+            pairs = [pair for pair in pairs if len(pair) == 2]
+            total += len(pairs)
+            if len(pairs) == 0:
+                continue
+
+            _, wins, _, valid = analyzeHashes([pair[0] for pair in pairs])
+            keep = valid & ~wins
+            dst.writelines(pairs[i][0] + ',' + pairs[i][1] + '\n' for i in np.flatnonzero(keep))
+            kept += int(keep.sum())
+    return kept, total
@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import numpy as np
+from QuartoDataTypes import IntVector2
+from QuartoGame import QuartoGame, UNDO_SELECT, UNDO_PLACE
+import CannonBackend
+from QuartoBitboard import (
+    SQUARE_COUNT, PIECE_COUNT, FULL_MASK, FEATURE_MASK, LINE_COUNT,
+    SQUARE_TO_FLAT, ZOBRIST_SQUARE, ZOBRIST_SELECTED, MASK_BITS,
+    squareIndex, cellPiece, packedWin, packedHash, unpackHash, packedZobrist
+)
+
+"""
+QuartoBitGame is a drop in replacement for QuartoGame that stores the game in packed ints
+rather than numpy arrays. The board is a 64 bit int holding one nibble per square plus a
+16 bit occupancy mask, and the piece pool is a 16 bit mask (see QuartoBitboard).
+
+The method surface matches QuartoGame, so the solvers, cannonizers and DepthSaver can use
+either engine. board and remainingPieces are still avaliable as numpy arrays, but they are
+built on request, and must be assigned back for edits to take effect.
+"""
+class QuartoBitGame(QuartoGame):
+    def __init__(self, twistCount=1, verbose=True, undoMemLength=8):
+        self.twistCount      = twistCount
+        self.verbose         = verbose
+        self.dims            = IntVector2(4, 4) #hardcoded to 4x4 for now
+        self.selectedPieces  = []
+        self.cells           = 0
+        self.occupied        = 0
+        self.remainingMask   = FULL_MASK
+
+        self.selectedPieceCount   = 0
+        self.avaliableSquareCount = SQUARE_COUNT
+        self.remainingPieceCount  = PIECE_COUNT
+
+        self.undoMemLength  = undoMemLength
+        self.isWinningState = False
+        self.last_move = None
+
+        self.lineAnd  = [FEATURE_MASK] * LINE_COUNT
+        self.lineOr   = [0] * LINE_COUNT
+        self.lineFill = [0] * LINE_COUNT
+        self.lineFeatures = [0] * LINE_COUNT
+        self.winningLineCount = 0
+        self.placedFeatures = 0
+
+        self.zobristKey = 0
+
+#======= Numpy views of the packed state ==========
+#   Built fresh on every access. Assign the edited array back to apply changes.
+    @property
+    def board(self) -> np.ndarray:
+        flat = [-1] * SQUARE_COUNT
+        occupied = self.occupied
+        while occupied:
+            low = occupied & -occupied
+            s = low.bit_length() - 1
+            flat[SQUARE_TO_FLAT[s]] = (self.cells >> (s << 2)) & FEATURE_MASK
+            occupied ^= low
+        return np.array(flat, dtype=np.int16).reshape(self.dims)
+
+    @board.setter
+    def board(self, board) -> None:
+        flat = np.asarray(board).reshape(-1)
+        cells, occupied = 0, 0
+        for s in range(SQUARE_COUNT):
+            piece = int(flat[SQUARE_TO_FLAT[s]])
+            if piece >= 0:
+                cells |= piece << (s << 2)
+                occupied |= 1 << s
+        self.cells    = cells
+        self.occupied = occupied
+        self.avaliableSquareCount = SQUARE_COUNT - occupied.bit_count()
+        self.syncState()
+
+    @property
+    def remainingPieces(self) -> np.ndarray:
+        return np.array([(self.remainingMask >> p) & 1 for p in range(PIECE_COUNT)], dtype=np.uint8)
+
+    @remainingPieces.setter
+    def remainingPieces(self, remainingPieces) -> None:
+        mask = 0
+        for p in range(PIECE_COUNT):
+            if remainingPieces[p] > 0:
+                mask |= 1 << p
+        self.remainingMask = mask
+        self.remainingPieceCount = mask.bit_count()
+
+#======= Copies data of this game, and returns a copy ==========
+#   Copied games are NEW games, and therefore do not have an undo stack loaded
+    def copy(self, dest:QuartoBitGame=None) -> QuartoBitGame:
+        g                 = dest if dest is not None else QuartoBitGame(self.twistCount, self.verbose, self.undoMemLength)
+        g.dims            = self.dims
+        g.selectedPieces  = [piece for piece in self.selectedPieces]
+        g.cells           = self.cells
+        g.occupied        = self.occupied
+        g.remainingMask   = self.remainingMask
+        if dest is not None:
+            g.undoMemLength = self.undoMemLength
+        g.isWinningState  = self.isWinningState
+        g.avaliableSquareCount = self.avaliableSquareCount
+        g.remainingPieceCount  = self.remainingPieceCount
+        g.selectedPieceCount   = self.selectedPieceCount
+        g.lineAnd         = self.lineAnd[:]
+        g.lineOr          = self.lineOr[:]
+        g.lineFill        = self.lineFill[:]
+        g.lineFeatures    = self.lineFeatures[:]
+        g.winningLineCount = self.winningLineCount
+        g.placedFeatures  = self.placedFeatures
+        g.zobristKey      = self.zobristKey
+        return g
+
+    def squareIsEmpty(self, index:IntVector2) -> bool:
+        return not (self.occupied >> squareIndex(index)) & 1
+
+    def squarePiece(self, square:int) -> int:
+        if (self.occupied >> square) & 1:
+            return (self.cells >> (square << 2)) & FEATURE_MASK
+        return -1
+
+    def selectPiece(self, piece:int) -> bool:
+        if piece < 0 or piece >= PIECE_COUNT or not (self.remainingMask >> piece) & 1:
+            if self.verbose:
+                print(f'Cannot select piece {piece} when remaining pieces are {self.getRemainingPieces()}')
+            return False
+        if self.twistCount <= len(self.selectedPieces):
+            if self.verbose:
+                print(f'Cannot select another piece, there are {len(self.selectedPieces)} already selected.')
+            return False
+
+        self.logMove(UNDO_SELECT, 0, piece)
+        self.selectedPieces.append(piece)
+        self.remainingMask ^= 1 << piece
+        self.zobristKey ^= ZOBRIST_SELECTED[piece]
+
+        self.selectedPieceCount  += 1
+        self.remainingPieceCount -= 1
+
+        return True
+
+    def takeFromPool(self, piece:int) -> None:
+        self.selectedPieces.append(piece)
+        self.remainingMask ^= 1 << piece
+        self.zobristKey ^= ZOBRIST_SELECTED[piece]
+        self.selectedPieceCount  += 1
+        self.remainingPieceCount -= 1
+
+    def deselectPiece(self, piece:int) -> None:
+        self.selectedPieces.remove(piece)
+        self.remainingMask |= 1 << piece
+        self.zobristKey ^= ZOBRIST_SELECTED[piece]
+        self.selectedPieceCount  -= 1
+        self.remainingPieceCount += 1
+
+    def deselectAll(self):
+        for piece in self.selectedPieces:
+            self.remainingMask |= 1 << piece
+            self.zobristKey ^= ZOBRIST_SELECTED[piece]
+        self.remainingPieceCount += len(self.selectedPieces)
+        self.selectedPieces = []
+        self.selectedPieceCount = 0
+
+    def placePiece(self, piece:int, index:IntVector2) -> bool:
+        if index.x < 0 or index.y < 0 or index.x >= self.dims.x or index.y >= self.dims.y:
+            if self.verbose:
+                print(f'Cannot place piece at invalid index X:{index.x} Y:{index.y}')
+            return False
+        s = squareIndex(index)
+        if (self.occupied >> s) & 1:
+            if self.verbose:
+                print('Cannot place piece, square is occupied.')
+            return False
+        if piece not in self.selectedPieces:
+            if self.verbose:
+                print('Attempted to place a piece that is not selected.')
+            return False
+
+        self.logMove(UNDO_PLACE, s, piece)
+        self.cells    |= piece << (s << 2)
+        self.occupied |= 1 << s
+        self.addToLines(s, piece)
+        self.zobristKey ^= ZOBRIST_SQUARE[(s << 4) | piece] ^ ZOBRIST_SELECTED[piece]
+        self.selectedPieces.remove(piece)
+        self.avaliableSquareCount -= 1
+        self.deselectAll()
+
+        return True
+
+    # Removes piece at a given index, if one is there.
+    # Adds piece back to selected
+    def removePiece(self, index:IntVector2) -> bool:
+        if index.x < 0 or index.y < 0 or index.x >= self.dims.x or index.y >= self.dims.y:
+            if self.verbose:
+                print(f'Cannot place piece at invalid index X:{index.x} Y:{index.y}')
+            return False
+        s = squareIndex(index)
+        if not (self.occupied >> s) & 1:
+            if self.verbose:
+                print('No piece to remove at this index.')
+            return False
+        piece = cellPiece(self.cells, s)
+        self.selectedPieces.append(piece)
+        self.selectedPieceCount += 1
+        self.cells    &= ~(FEATURE_MASK << (s << 2))
+        self.occupied ^= 1 << s
+        self.removeFromLines(s, piece)
+        self.zobristKey ^= ZOBRIST_SQUARE[(s << 4) | piece] ^ ZOBRIST_SELECTED[piece]
+        self.avaliableSquareCount += 1
+        return True
+
+    # The packed pool already is the mask
+    def syncPoolMask(self) -> None:
+        pass
+
+    def computeZobrist(self) -> int:
+        return packedZobrist(self.cells, self.occupied, self.selectedPieces)
+
+    def checkWinFull(self):
+        return packedWin(self.cells, self.occupied)
+
+#================ Hashes board into unique int ============================
+    # Produces the same value as QuartoGame.hashBoard, so saved depth tables stay valid
+    def hashBoard(self):
+        return packedHash(self.cells, self.occupied)
+
+    def loadFromHash(self, boardHash):
+        self.cells, self.occupied = unpackHash(boardHash)
+
+        placed = 0
+        for s in MASK_BITS[self.occupied]:
+            placed |= 1 << cellPiece(self.cells, s)
+        self.remainingMask = FULL_MASK & ~placed
+
+        self.avaliableSquareCount = SQUARE_COUNT - self.occupied.bit_count()
+        self.remainingPieceCount  = self.remainingMask.bit_count()
+
+        self.syncState()
+
+    # Performs XOR operation using the given XORpiece on the selected and remaining pieces
+    def xorPieces(self, xorPiece):
+        if xorPiece <= 0 or xorPiece >= PIECE_COUNT:
+            return
+        for i in range(len(self.selectedPieces)):
+            self.selectedPieces[i] = self.selectedPieces[i] ^ xorPiece
+
+        newRemaining = 0
+        for piece in MASK_BITS[self.remainingMask]:
+            newRemaining |= 1 << (piece ^ xorPiece)
+        self.remainingMask = newRemaining
+        self.zobristKey = self.computeZobrist()
+
+    # Cannonizes the packed state directly, without building numpy views
+    def cannonize(self) -> int:
+        self.cells, self.occupied, self.remainingMask, self.selectedPieces, transformId = \
+            CannonBackend.cannonizePacked(self.cells, self.occupied, self.remainingMask, self.selectedPieces)
+        self.undoCount = 0
+        self.syncState()
+        return transformId
+
+    def applyTransform(self, transformId: int) -> None:
+        squareTransform, xorPiece, featurePerm = CannonBackend.decodeTransform(transformId)
+        squareMap = CannonBackend.SQUARE_TRANSFORMS[squareTransform]
+        pieceMap  = CannonBackend.FEATURE_PERM_MAP[featurePerm]
+
+        cells, occupied = 0, 0
+        for s in MASK_BITS[self.occupied]:
+            dest = squareMap[s]
+            cells    |= pieceMap[cellPiece(self.cells, s) ^ xorPiece] << (dest << 2)
+            occupied |= 1 << dest
+        self.cells    = cells
+        self.occupied = occupied
+        self.selectedPieces = [pieceMap[piece ^ xorPiece] for piece in self.selectedPieces]
+        self.remainingMask  = CannonBackend.transformPool(transformId, self.remainingMask)
+        self.undoCount = 0
+        self.syncState()
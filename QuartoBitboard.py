@@ -0,0 +1,146 @@
+import random
+from QuartoDataTypes import IntVector2
+from geometricPlanes import base_quarto_lines
+
+# =================================================
+#   Bitboard tables shared by the packed game engines
+#
+#   Squares are numbered in the order hashBoard and getAvaliableSquares
+#   visit them (y outer, x inner), so square index = y * 4 + x.
+#   A board is packed into
+#       cells    : 64 bit int, one 4 bit nibble per square (piece value)
+#       occupied : 16 bit mask, bit s set if square s holds a piece
+#   and the piece pool is a 16 bit mask, bit p set if piece p is avaliable.
+#
+#   Numpy boards (QuartoGame.board) are indexed board[x, y], so their
+#   flattened index is x * 4 + y. Use SQUARE_TO_FLAT / FLAT_TO_SQUARE
+#   to convert between the two.
+# =================================================
+
+BOARD_SIZE   = 4
+SQUARE_COUNT = BOARD_SIZE * BOARD_SIZE
+PIECE_COUNT  = 16
+FULL_MASK    = (1 << SQUARE_COUNT) - 1
+FEATURE_MASK = PIECE_COUNT - 1
+
+SQUARE_VECTORS = tuple(IntVector2(s % BOARD_SIZE, s // BOARD_SIZE) for s in range(SQUARE_COUNT))
+SQUARE_TO_FLAT = tuple(v.x * BOARD_SIZE + v.y for v in SQUARE_VECTORS)
+FLAT_TO_SQUARE = tuple(SQUARE_TO_FLAT.index(f) for f in range(SQUARE_COUNT))
+
+# base_quarto_lines numbers squares as row * 4 + col, with a row being fixed y,
+# which is the same numbering as the square index used here.
+LINES        = tuple(tuple(line) for line in base_quarto_lines())
+LINE_COUNT   = len(LINES)
+LINE_MASKS   = tuple(sum(1 << s for s in line) for line in LINES)
+SQUARE_LINES = tuple(tuple(l for l in range(LINE_COUNT) if s in LINES[l]) for s in range(SQUARE_COUNT))
+
+
+# A line with 3 pieces on it is won by a 4th piece sharing a 1 with all of them (its AND)
+# or a 0 with all of them (its OR). LINE_WINNERS[(lineAnd << 4) | lineOr] is the mask of
+# the pieces that would complete such a line.
+LINE_WINNERS = tuple(sum(1 << p for p in range(PIECE_COUNT) if (lineAnd & p) != 0 or (lineOr | p) != FEATURE_MASK)
+                     for lineAnd in range(PIECE_COUNT) for lineOr in range(PIECE_COUNT))
+
+# FEATURE_ONES[piece] has a 1 in the nibble of each feature the piece has set, so a sum of
+# them counts, per nibble, how many of the pieces have each feature. Each feature value
+# (a 1 or a 0 on a feature) is on FEATURE_PIECES of the pieces.
+FEATURE_ONES   = tuple(sum(1 << (f << 2) for f in range(4) if (p >> f) & 1) for p in range(PIECE_COUNT))
+FEATURE_PIECES = PIECE_COUNT // 2
+
+
+# Index of the square an IntVector2 points to
+def squareIndex(index: IntVector2) -> int:
+    return index.y * BOARD_SIZE + index.x
+
+
+# Piece stored at square s of a packed board
+def cellPiece(cells: int, s: int) -> int:
+    return (cells >> (s << 2)) & FEATURE_MASK
+
+
+# True if four pieces share at least one feature
+def featuresShared(a: int, b: int, c: int, d: int) -> bool:
+    return (a & b & c & d) != 0 or (a | b | c | d) != FEATURE_MASK
+
+
+#======== Win check on a packed board ==================
+#   Checks every full line of a packed board for a shared feature.
+def packedWin(cells: int, occupied: int) -> bool:
+    for l in range(LINE_COUNT):
+        if occupied & LINE_MASKS[l] == LINE_MASKS[l]:
+            a, b, c, d = LINES[l]
+            if featuresShared(cellPiece(cells, a), cellPiece(cells, b),
+                              cellPiece(cells, c), cellPiece(cells, d)):
+                return True
+    return False
+
+
+#======== Packed board <-> hashBoard ==================
+#   hashBoard concatenates the occupied pieces in square order (first square
+#   most significant), followed by a 16 bit occupancy field whose most
+#   significant bit is square 0.
+def packedHash(cells: int, occupied: int) -> int:
+    values = 0
+    occupiedField = 0
+    for s in range(SQUARE_COUNT):
+        occupiedField <<= 1
+        if occupied >> s & 1:
+            values = (values << 4) | ((cells >> (s << 2)) & FEATURE_MASK)
+            occupiedField |= 1
+    return (values << SQUARE_COUNT) | occupiedField
+
+
+def unpackHash(boardHash: int) -> tuple[int, int]:
+    values = boardHash >> SQUARE_COUNT
+    occupiedField = boardHash & FULL_MASK
+    cells, occupied = 0, 0
+    for s in range(SQUARE_COUNT - 1, -1, -1):
+        if (occupiedField >> (SQUARE_COUNT - 1 - s)) & 1:
+            cells |= (values & FEATURE_MASK) << (s << 2)
+            occupied |= 1 << s
+            values >>= 4
+    return cells, occupied
+
+
+#======== Zobrist keys ==================
+#   64 bit random keys for every (square, piece) pair, and for every selected piece.
+#   Generated from a fixed seed so every process (and every run) uses the same keys.
+#   A game's zobristKey is the XOR of the keys of its placed and selected pieces.
+ZOBRIST_SEED = 0x51A7
+_zobristRandom = random.Random(ZOBRIST_SEED)
+ZOBRIST_SQUARE   = tuple(_zobristRandom.getrandbits(64) for _ in range(SQUARE_COUNT * PIECE_COUNT))
+ZOBRIST_SELECTED = tuple(_zobristRandom.getrandbits(64) for _ in range(PIECE_COUNT))
+
+
+# Key of a placed piece
+def zobristPlaced(square: int, piece: int) -> int:
+    return ZOBRIST_SQUARE[(square << 4) | piece]
+
+
+# Zobrist key of a packed board plus a list of selected pieces
+def packedZobrist(cells: int, occupied: int, selectedPieces) -> int:
+    key = 0
+    while occupied:
+        low = occupied & -occupied
+        s = low.bit_length() - 1
+        key ^= ZOBRIST_SQUARE[(s << 4) | ((cells >> (s << 2)) & FEATURE_MASK)]
+        occupied ^= low
+    for piece in selectedPieces:
+        key ^= ZOBRIST_SELECTED[piece]
+    return key
+
+
+#======== Mask iteration tables ==================
+#   MASK_BITS[mask] is a tuple of the set bit indices of a 16 bit mask in ascending order,
+#   and MASK_SQUARES[mask] the matching IntVector2 squares. Both are shared and immutable,
+#   so move generation can index them instead of building new lists on every node.
+MASK_BITS    = [()] * (FULL_MASK + 1)
+MASK_SQUARES = [()] * (FULL_MASK + 1)
+for _mask in range(1, FULL_MASK + 1):
+    _low = _mask & -_mask
+    _rest = _mask ^ _low
+    MASK_BITS[_mask]    = (_low.bit_length() - 1,) + MASK_BITS[_rest]
+    MASK_SQUARES[_mask] = (SQUARE_VECTORS[_low.bit_length() - 1],) + MASK_SQUARES[_rest]
+MASK_BITS    = tuple(MASK_BITS)
+MASK_SQUARES = tuple(MASK_SQUARES)
+del _mask, _low, _rest
@@ -1,3 +1,10 @@
 from collections import namedtuple
 
-IntVector2 = namedtuple("IntVector2", ["x", "y"])
\ No newline at end of file
+IntVector2 = namedtuple("IntVector2", ["x", "y"])
+# Outcome of a solver's move search
+#   score  - score of the move, from the view of the player making it
+#   move   - square (IntVector2) when placing, piece (int) when choosing
+#   depth  - deepest fully searched depth
+#   proven - True if the score is exact, not just the result of a depth limited search
+#   nodes  - nodes explored by the search
+SearchResult = namedtuple("SearchResult", ["score", "move", "depth", "proven", "nodes"])
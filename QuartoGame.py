@@ -3,12 +3,19 @@ from __future__ import annotations
 import numpy as np
 import math
 from QuartoDataTypes import IntVector2
+from QuartoBitboard import (
+    SQUARE_COUNT, FULL_MASK, FEATURE_MASK, SQUARE_VECTORS, LINE_COUNT, LINE_MASKS, SQUARE_LINES,
+    LINE_WINNERS, FEATURE_ONES, FEATURE_PIECES, ZOBRIST_SQUARE, ZOBRIST_SELECTED, MASK_BITS, MASK_SQUARES, squareIndex
+)
+import CannonBackend
 import random
 
-import FastCannon
-
 random.seed(3)
 
+# Move kinds recorded in the undo ring
+UNDO_SELECT = 0
+UNDO_PLACE  = 1
+
 class QuartoGame:
     def __init__(self, twistCount=1, verbose=True, undoMemLength=8):
         self.twistCount      = twistCount
@@ -20,58 +27,156 @@ class QuartoGame:
         #self.remainingPieces = [1 for i in range(self.dims[0] * self.dims[1])]
         self.remainingPieces = np.ones([self.dims[0] * self.dims[1]],dtype=np.uint8)
 
+        # Bit masks of the occupied squares (by square index) and of the remaining pieces,
+        # used to generate moves without scanning the arrays
+        self.occupied      = 0
+        self.remainingMask = FULL_MASK
+
         self.selectedPieceCount  = 0
         self.avaliableSquareCount = self.dims[0] * self.dims[1]
         self.remainingPieceCount = self.dims[0] * self.dims[1]
 
         self.undoMemLength  = undoMemLength
-        self.undoStack      = []
         self.isWinningState = False
         self.last_move = None
 
+        # Running AND / OR of the features on each line, and how many of its squares are filled
+        self.lineAnd  = [FEATURE_MASK] * LINE_COUNT
+        self.lineOr   = [0] * LINE_COUNT
+        self.lineFill = [0] * LINE_COUNT
+        # Pieces with each feature set on each line, one nibble per feature (see FEATURE_ONES)
+        self.lineFeatures = [0] * LINE_COUNT
+        self.winningLineCount = 0
+        # Placed pieces with each feature set, one nibble per feature (see FEATURE_ONES)
+        self.placedFeatures = 0
+
+        # Zobrist key of the placed and selected pieces, kept current by every move
+        self.zobristKey = 0
+
 #======= Copies data of this game, and returns a copy ==========
 #   dest (QuartoGame): If dst is specified, data is copied into this the 
 #                   dest QuartoGame. Otherwise, a new QuartoGame is created
 #   Copied games are NEW games, and therefore do not have an undo stack loaded
     def copy(self, dest:QuartoGame=None) -> QuartoGame:
-        g                 = dest if dest is not None else QuartoGame(self.twistCount, self.verbose)
+        g                 = dest if dest is not None else QuartoGame(self.twistCount, self.verbose, self.undoMemLength)
         g.dims            = IntVector2(self.dims.x, self.dims.y)
         g.selectedPieces  = [piece for piece in self.selectedPieces]
         #g.selectedPieces  = np.copy(self.selectedPieces)
         g.board           = np.copy(self.board)
         #g.remainingPieces = [piece for piece in self.remainingPieces]
         g.remainingPieces = np.copy(self.remainingPieces)
-        g.undoMemLength   = self.undoMemLength
+        g.occupied        = self.occupied
+        g.remainingMask   = self.remainingMask
+        if dest is not None:
+            g.undoMemLength = self.undoMemLength
         g.isWinningState  = self.isWinningState
         g.avaliableSquareCount = self.avaliableSquareCount
         g.remainingPieceCount = self.remainingPieceCount
         g.selectedPieceCount  = self.selectedPieceCount
-        # Undo stack is not copied, to avoid exploding memory
+        g.lineAnd         = self.lineAnd[:]
+        g.lineOr          = self.lineOr[:]
+        g.lineFill        = self.lineFill[:]
+        g.lineFeatures    = self.lineFeatures[:]
+        g.winningLineCount = self.winningLineCount
+        g.placedFeatures  = self.placedFeatures
+        g.zobristKey      = self.zobristKey
+        # Undo history is not copied, to avoid exploding memory
         return g
 
     def squareIsEmpty(self, index:IntVector2) -> bool:
         return self.board[index] < 0
 
+    # Piece on a square index (see QuartoBitboard), -1 if the square is empty
+    def squarePiece(self, square:int) -> int:
+        return int(self.board[SQUARE_VECTORS[square]])
+
+#========== Undo Memory ============
+#   selectPiece and placePiece (the make moves) record a small delta of each move in a
+#   ring buffer of undoMemLength slots: the move kind, square, piece, and a mask of the
+#   other selected pieces that placing returned to the pool.
+#   Changing undoMemLength reallocates the ring, and clears the undo history.
+    @property
+    def undoMemLength(self) -> int:
+        return len(self.undoKinds)
+
+    @undoMemLength.setter
+    def undoMemLength(self, undoMemLength:int) -> None:
+        undoMemLength = max(0, undoMemLength)
+        self.undoKinds    = [UNDO_SELECT] * undoMemLength
+        self.undoSquares  = [0] * undoMemLength
+        self.undoPieces   = [0] * undoMemLength
+        self.undoSelected = [0] * undoMemLength
+        self.undoHead  = 0
+        self.undoCount = 0
+
+#======= LogMove ==================
+#   Logs a move into undo memory. Must be called before the move is applied.
+    def logMove(self, kind:int, square:int, piece:int) -> None:
+        size = len(self.undoKinds)
+        if size < 1: return
+        others = 0
+        for selected in self.selectedPieces:
+            if selected != piece:
+                others |= 1 << int(selected)
+        i = self.undoHead
+        self.undoKinds[i]    = kind
+        self.undoSquares[i]  = square
+        self.undoPieces[i]   = piece
+        self.undoSelected[i] = others
+        self.undoHead = (i + 1) % size
+        if self.undoCount < size:
+            self.undoCount += 1
+
+#========== Unmake Move ============
+#   Reverts the last logged move.
+#   Returns:
+#       boolean : was there a move to undo
+    def unmakeMove(self) -> bool:
+        if self.undoCount < 1: return False
+        self.undoHead = (self.undoHead - 1) % len(self.undoKinds)
+        self.undoCount -= 1
+        i = self.undoHead
+
+        if self.undoKinds[i] == UNDO_SELECT:
+            self.deselectPiece(self.undoPieces[i])
+            return True
+
+        # Removing puts the placed piece back into the selection, then the
+        # pieces placing deselected are taken back out of the pool
+        self.removePiece(SQUARE_VECTORS[self.undoSquares[i]])
+        others = self.undoSelected[i]
+        while others:
+            low = others & -others
+            self.takeFromPool(low.bit_length() - 1)
+            others ^= low
+        return True
+
 #========== Undo ============
 #   Returns the state of this game to its previous game state.
-#   Preserves undoStack, to allow for multiple undos
 #   input:
 #       numberOfUndos (int): How many moves to undo, default 1
-
     def undo(self, numberOfUndos=1) -> None:
-        if numberOfUndos < 1:       return
-        if len(self.undoStack) < 1: return
+        for _ in range(numberOfUndos):
+            if not self.unmakeMove():
+                return
 
-        newUndoStack   = self.undoStack[1:]
-        prevState      = self.undoStack[0]
-        prevState.copy(dest=self)
-        self.undoStack = newUndoStack
+    # Moves a remaining piece into the selection, without checks or logging
+    def takeFromPool(self, piece:int) -> None:
+        self.selectedPieces.append(piece)
+        self.remainingPieces[piece] = 0
+        self.remainingMask ^= 1 << piece
+        self.zobristKey ^= ZOBRIST_SELECTED[piece]
+        self.selectedPieceCount  += 1
+        self.remainingPieceCount -= 1
 
-#======= LogGameState ==================
-#   Logs the current game state into undo memory.
-    def logGameState(self) -> None:
-        if self.undoMemLength < 1: return
-        self.undoStack = [self.copy()] + self.undoStack[:self.undoMemLength-1]
+    # Returns a single selected piece to the remaining pieces, without logging
+    def deselectPiece(self, piece:int) -> None:
+        self.selectedPieces.remove(piece)
+        self.remainingPieces[piece] = 1
+        self.remainingMask |= 1 << piece
+        self.zobristKey ^= ZOBRIST_SELECTED[piece]
+        self.selectedPieceCount  -= 1
+        self.remainingPieceCount += 1
 
 #======== Select a given piece ==================
 #   Inputs:
@@ -88,10 +193,12 @@ class QuartoGame:
                 print(f'Cannot select another piece, there are {sum(self.remainingPieces)} already selected.')
             return False
 
-        self.logGameState()
+        self.logMove(UNDO_SELECT, 0, piece)
         self.selectedPieces.append(piece)
         #self.selectedPieces = np.append(self.selectedPieces, piece)
         self.remainingPieces[piece] = 0
+        self.remainingMask ^= 1 << piece
+        self.zobristKey ^= ZOBRIST_SELECTED[piece]
 
         self.selectedPieceCount  += 1
         self.remainingPieceCount -= 1
@@ -102,6 +209,8 @@ class QuartoGame:
         for piece in self.selectedPieces:
             self.remainingPieceCount += 1
             self.remainingPieces[piece] = 1
+            self.remainingMask |= 1 << piece
+            self.zobristKey ^= ZOBRIST_SELECTED[piece]
         #self.selectedPieces  = np.array([], dtype=np.int32)
         self.selectedPieces = []
         self.selectedPieceCount = 0
@@ -127,8 +236,11 @@ class QuartoGame:
                 print(f'Attempted to place a piece that is not selected.')
             return False
 
-        self.logGameState()
+        self.logMove(UNDO_PLACE, squareIndex(index), piece)
         self.board[index] = piece
+        self.occupied |= 1 << squareIndex(index)
+        self.addToLines(squareIndex(index), piece)
+        self.zobristKey ^= ZOBRIST_SQUARE[(squareIndex(index) << 4) | piece] ^ ZOBRIST_SELECTED[piece]
         #self.isWinningState = FastCannon.placePiece(self.board, index.x, index.y, piece)
         #pieceIndex = np.where(self.selectedPieces == piece)[0][0]
         #self.selectedPieces = np.delete(self.selectedPieces, pieceIndex)
@@ -153,50 +265,190 @@ class QuartoGame:
                 print(f'No piece to remove at this index.')
             return False
         #self.selectedPieces = np.append(self.selectedPieces, self.board[index])
-        self.selectedPieces.append(self.board[index])
+        piece = int(self.board[index])
+        self.selectedPieces.append(piece)
         self.selectedPieceCount += 1
         self.board[index] = -1
+        self.occupied ^= 1 << squareIndex(index)
+        self.removeFromLines(squareIndex(index), piece)
+        self.zobristKey ^= ZOBRIST_SQUARE[(squareIndex(index) << 4) | piece] ^ ZOBRIST_SELECTED[piece]
         self.avaliableSquareCount += 1
-    
+
+    # Sets the winning state if a line through index is won.
+    # placePiece keeps the win state current, so this is only needed after editing the board directly
     def updateWinStatus(self, index):
         if self.isWinningState: return
-        row = self.board[:, index.y]
-        if self.checkFeatureList(row):
-            self.isWinningState = True
-            return
-        col = self.board[index.x]
-        if self.checkFeatureList(col):
-            self.isWinningState = True
-            return
-        if index.x == index.y:
-            diag = [self.board[i, i] for i in range(self.board.shape[0])]
-            if self.checkFeatureList(diag):
-                self.isWinningState = True
-            return
-        elif index.x + index.y == self.board.shape[0] - 1:
-            diag = [self.board[i, (self.board.shape[0] - 1) - i] for i in range(self.board.shape[0])]
-            if self.checkFeatureList(diag):
+        for l in SQUARE_LINES[squareIndex(index)]:
+            if self.lineFill[l] == 4 and (self.lineAnd[l] != 0 or self.lineOr[l] != FEATURE_MASK):
                 self.isWinningState = True
-            return
+                return
+
+#======== Line Accumulators ==================
+#   Each of the 10 lines keeps the AND and OR of the pieces on it, and a fill count.
+#   A full line is won when its AND is not 0 (shared 1) or its OR is not 15 (shared 0).
+#   Lines also count their pieces with each feature set (lineFeatures), so a removal
+#   subtracts the piece and reads the AND and OR off the counts without the board.
+#   Placing or removing a piece only touches the 2-3 lines through its square.
+    def addToLines(self, square:int, piece:int) -> None:
+        lineAnd, lineOr, lineFill, lineFeatures = self.lineAnd, self.lineOr, self.lineFill, self.lineFeatures
+        featureOnes = FEATURE_ONES[piece]
+        for l in SQUARE_LINES[square]:
+            andCmp = lineAnd[l] & piece
+            orCmp  = lineOr[l] | piece
+            lineAnd[l] = andCmp
+            lineOr[l]  = orCmp
+            lineFill[l] += 1
+            lineFeatures[l] += featureOnes
+            if lineFill[l] == 4 and (andCmp != 0 or orCmp != FEATURE_MASK):
+                self.winningLineCount += 1
+        self.placedFeatures += FEATURE_ONES[piece]
+        self.isWinningState = self.winningLineCount > 0
+
+    # The AND cannot be undone in place, so it is read off the feature counts left on each line:
+    # a feature is in the OR when its count is not 0, and in the AND when it equals the fill.
+    # Counts are at most 4, so a nibble is not 0 when one of its low 3 bits is set.
+    def removeFromLines(self, square:int, piece:int) -> None:
+        featureOnes = FEATURE_ONES[piece]
+        self.placedFeatures -= featureOnes
+        lineAnd, lineOr, lineFill, lineFeatures = self.lineAnd, self.lineOr, self.lineFill, self.lineFeatures
+        for l in SQUARE_LINES[square]:
+            if lineFill[l] == 4 and (lineAnd[l] != 0 or lineOr[l] != FEATURE_MASK):
+                self.winningLineCount -= 1
+            fill = lineFill[l] - 1
+            counts = lineFeatures[l] - featureOnes
+            nonZero = (counts | counts >> 1 | counts >> 2) & 0x1111
+            lineOr[l] = (nonZero | nonZero >> 3 | nonZero >> 6 | nonZero >> 9) & FEATURE_MASK
+            missing = fill * 0x1111 - counts
+            notShared = (missing | missing >> 1 | missing >> 2) & 0x1111
+            lineAnd[l] = ~(notShared | notShared >> 3 | notShared >> 6 | notShared >> 9) & FEATURE_MASK
+            lineFill[l] = fill
+            lineFeatures[l] = counts
+        self.isWinningState = self.winningLineCount > 0
+
+    # Rebuilds the line accumulators and win state from the board.
+    # Call after editing the board directly (eg. cannonizing or loading).
+    def syncState(self) -> None:
+        self.lineAnd  = [FEATURE_MASK] * LINE_COUNT
+        self.lineOr   = [0] * LINE_COUNT
+        self.lineFill = [0] * LINE_COUNT
+        self.lineFeatures = [0] * LINE_COUNT
+        self.winningLineCount = 0
+        self.placedFeatures = 0
+        occupied = 0
+        for s in range(SQUARE_COUNT):
+            piece = self.squarePiece(s)
+            if piece >= 0:
+                self.addToLines(s, piece)
+                occupied |= 1 << s
+        self.occupied = occupied
+        self.syncPoolMask()
+        self.isWinningState = self.winningLineCount > 0
+        self.zobristKey = self.computeZobrist()
+
+    # Rebuilds remainingMask from the remainingPieces array
+    def syncPoolMask(self) -> None:
+        mask = 0
+        for piece in range(len(self.remainingPieces)):
+            if self.remainingPieces[piece] > 0:
+                mask |= 1 << piece
+        self.remainingMask = mask
+
+#======== Threat Map ==================
+#   Read from the line accumulators: a line with 3 pieces on it is won next move by any
+#   piece in LINE_WINNERS for its AND and OR, placed on its empty square.
+
+    # For each line, the mask of the pieces that would win it next move (0 if none can)
+    def threatMap(self) -> list[int]:
+        lineAnd, lineOr, lineFill = self.lineAnd, self.lineOr, self.lineFill
+        return [LINE_WINNERS[(lineAnd[l] << 4) | lineOr[l]] if lineFill[l] == 3 else 0 for l in range(LINE_COUNT)]
+
+    # Mask of the pieces that would let the player placing them win, somewhere on the board
+    def threatPieces(self) -> int:
+        lineAnd, lineOr, lineFill = self.lineAnd, self.lineOr, self.lineFill
+        threats = 0
+        for l in range(LINE_COUNT):
+            if lineFill[l] == 3:
+                threats |= LINE_WINNERS[(lineAnd[l] << 4) | lineOr[l]]
+        return threats
+
+    # A square where placing piece wins, or None
+    def winningSquare(self, piece:int) -> IntVector2:
+        lineAnd, lineOr, lineFill = self.lineAnd, self.lineOr, self.lineFill
+        for l in range(LINE_COUNT):
+            if lineFill[l] == 3 and (LINE_WINNERS[(lineAnd[l] << 4) | lineOr[l]] >> piece) & 1:
+                return SQUARE_VECTORS[(LINE_MASKS[l] & ~self.occupied).bit_length() - 1]
+        return None
+
+#======== Dead Lines ==================
+#   A line is dead when the pieces left off the board can not complete it: for each feature
+#   value its pieces still share, fewer unplaced pieces have that value than it has empty squares.
+#   Lines only lose shared features and the pool only shrinks, so a dead line stays dead,
+#   and once every line is dead the game can only end in a draw.
+
+    # True if the pieces left off the board can still complete line l
+    def lineIsLive(self, l:int) -> bool:
+        need = 4 - self.lineFill[l]
+        if need == 0:
+            return False
+        placedFeatures = self.placedFeatures
+        placedCount = SQUARE_COUNT - self.avaliableSquareCount
+        for f in MASK_BITS[self.lineAnd[l]]:
+            if FEATURE_PIECES - ((placedFeatures >> (f << 2)) & 15) >= need:
+                return True
+        for f in MASK_BITS[~self.lineOr[l] & FEATURE_MASK]:
+            if FEATURE_PIECES - (placedCount - ((placedFeatures >> (f << 2)) & 15)) >= need:
+                return True
+        return False
+
+    # Mask of the lines that can still be completed, bit l set for line l
+    def liveLines(self) -> int:
+        return sum(1 << l for l in range(LINE_COUNT) if self.lineIsLive(l))
+
+    # True if no line is won or can still be won, so the game is a draw whatever is played
+    def isDeadDraw(self) -> bool:
+        if self.isWinningState:
+            return False
+        for l in range(LINE_COUNT):
+            if self.lineIsLive(l):
+                return False
+        return True
+
+#======== Zobrist Key ==================
+#   Recomputes the zobrist key of the placed and selected pieces from scratch.
+#   zobristKey is kept current incrementally, this is for syncing and auditing.
+    def computeZobrist(self) -> int:
+        key = 0
+        for s in range(SQUARE_COUNT):
+            piece = self.squarePiece(s)
+            if piece >= 0:
+                key ^= ZOBRIST_SQUARE[(s << 4) | piece]
+        for piece in self.selectedPieces:
+            key ^= ZOBRIST_SELECTED[piece]
+        return key
 
 #====== Get Avaliable Squares ====================
-#   Gets a list of squares that are avaliable to be played on
+#   Gets a list of squares that are avaliable to be played on (y outer, x inner)
 #   returns: [IntVector2]
     def getAvaliableSquares(self) -> list[IntVector2]:
-        squares = []
-        for y in range(self.board.shape[1]):
-            for x in range(self.board.shape[0]):
-                if self.board[x,y] < 0:
-                    squares.append(IntVector2(x, y))
-        return squares
+        return list(MASK_SQUARES[~self.occupied & FULL_MASK])
 
     def getSelectedPieces(self) -> list[int]: return [piece for piece in self.selectedPieces]
     def getRemainingPieces(self) -> list[int]: 
-        pieces = []
-        for i in range(len(self.remainingPieces)):
-            if self.remainingPieces[i] > 0:
-                pieces.append(i)
-        return pieces
+        return list(MASK_BITS[self.remainingMask])
+
+#====== Move Iterators ====================
+#   Allocation free versions of getAvaliableSquares and getRemainingPieces.
+#   These return shared precomputed tuples, indexed by the current masks. They are a
+#   snapshot, so the game can be changed while iterating over them.
+    def iterAvaliableSquares(self) -> tuple[IntVector2, ...]:
+        return MASK_SQUARES[~self.occupied & FULL_MASK]
+
+    # Square indices (see QuartoBitboard) rather than IntVector2
+    def iterAvaliableSquareIndices(self) -> tuple[int, ...]:
+        return MASK_BITS[~self.occupied & FULL_MASK]
+
+    def iterRemainingPieces(self) -> tuple[int, ...]:
+        return MASK_BITS[self.remainingMask]
 
     # Returns true if the board has a winning state on it.
     # Assumes the board is square
@@ -350,7 +602,7 @@ class QuartoGame:
                     self.avaliableSquareCount -= 1
                     self.remainingPieceCount -= 1
 
-        self.isWinningState = self.checkWinFull()
+        self.syncState()
 
     """
     Populates the board with a given number of pieces (0-8) ensuring no winning row/col/diag exists.
@@ -411,4 +663,39 @@ class QuartoGame:
                 index = i ^ xorPiece
                 newRemPieces[index] = 1
         self.remainingPieces = newRemPieces
-
+        self.syncPoolMask()
+        self.zobristKey = self.computeZobrist()
+
+#======== Cannonize ==================
+#   Cannonizes the board, selected pieces and remaining pool in place with a single
+#   CannonBackend call, giving the same game as GreatQuartoCannon.cannonizeGame.
+#   The undo history refers to the old squares, so it is cleared.
+#   returns: transform id applied (see CannonBackend)
+    def cannonize(self) -> int:
+        board = np.ascontiguousarray(self.board, dtype=np.int16)
+        remainingMask, self.selectedPieces, transformId = CannonBackend.cannonizeGame(
+            board, self.remainingMask, self.selectedPieces)
+        self.board = board
+        self.remainingPieces = np.array([(remainingMask >> p) & 1 for p in range(len(self.remainingPieces))], dtype=np.uint8)
+        self.undoCount = 0
+        self.syncState()
+        return transformId
+
+#======== Apply Transform ==================
+#   Maps the game in place through a transform id returned by cannonize (see CannonBackend).
+#   Applying a game's cannonization transform gives the same game as cannonize.
+    def applyTransform(self, transformId: int) -> None:
+        squareTransform, xorPiece, featurePerm = CannonBackend.decodeTransform(transformId)
+        squareMap = CannonBackend.SQUARE_TRANSFORMS[squareTransform]
+        pieceMap  = CannonBackend.FEATURE_PERM_MAP[featurePerm]
+
+        board = - np.ones(self.dims, dtype=np.int16)
+        for s in MASK_BITS[self.occupied]:
+            dest = SQUARE_VECTORS[squareMap[s]]
+            board[dest.x, dest.y] = pieceMap[self.squarePiece(s) ^ xorPiece]
+        self.board = board
+        self.selectedPieces = [pieceMap[piece ^ xorPiece] for piece in self.selectedPieces]
+        remainingMask = CannonBackend.transformPool(transformId, self.remainingMask)
+        self.remainingPieces = np.array([(remainingMask >> p) & 1 for p in range(len(self.remainingPieces))], dtype=np.uint8)
+        self.undoCount = 0
+        self.syncState()
@@ -8,7 +8,17 @@ from Profiler import Profiler
 import time
 import multiprocessing
 import pickle
-from QuartoDataTypes import IntVector2
+from QuartoDataTypes import IntVector2, SearchResult
+from SearchBudget import SearchBudget, SearchAborted
+from QuartoBitboard import ZOBRIST_SELECTED
+from CannonCache import CannonCache
+import CannonBackend
+import numpy as np
+from QuartoBatchBoards import encodeBoards, zobristKeys
+
+# Draft of memo entries whose subtree hit the breadth limit. They still order the moves of
+# the next iteration, but never answer a search, since their score came from dummy returns.
+CUTOFF_DRAFT = -1
 
 """
 MiniMaxSolver implements a Minimax algorithm with memoization to solve the game of Quarto.
@@ -23,41 +33,49 @@ class QuartoIterativeMiniMax:
 
     Parameters:
         depth (int): Maximum search depth minimax will go to. (32 for full game)
+        cannonCacheSize (int): Capacity of a cannon cache for this solver alone.
+            By default the process wide shared cache is used (see CannonCache), and its
+            counters are reset at every move so the printed stats are this move's.
+        buildMoveStrings (bool): Build the move path string at every node of the search.
+            When False the memo only keeps scores and best moves, and the move path of the
+            deepest search is rebuilt from the memo by principalVariationString().
     """
-    def __init__(self, depth=16):
+    def __init__(self, depth=16, cannonCacheSize=None, buildMoveStrings=True):
+        self.buildMoveStrings = buildMoveStrings
         self.memoTable = {}
-        self.cannonTable = {}
         self.toCannonize = {}
         self.depth = depth
-        self.cannonizer  = GreatQuartoCannon()
+        self.cannonizer  = GreatQuartoCannon(CannonCache(cannonCacheSize) if cannonCacheSize is not None else None)
+        self.cannonCache = self.cannonizer.cache
         self.naiveCannon = BasicQuartoCannon()
         self.profiler    = Profiler()
         self.exploredCounter = 0
         self.memoedCounter = 0
+        self.deadDrawCounter = 0
+        self.budget = None
         self.bredthCount = [0] * 33
         self.bredthMax = 5000
+        self.cutoffCounter = 0
 
         self.currDepth = 0
 
         self.memoTablePath = "memoTables/"
         #self.loadCannonTable()
 
+    # Saves the cannon cache as (raw key, canonical key, transform id) triples
     def saveCannonTable(self):
-        # try:
         canonList = []
-        for key in self.cannonTable.keys():
-            canonList.append((key, self.cannonTable[key].hashBoard()))
-        #print(canonList)
-        with open(self.memoTablePath + "canonTable.pkl", 'ab') as f:
+        for rawKey, (cannonKey, transformId) in self.cannonCache.items():
+            canonList.append((rawKey, cannonKey, transformId))
+        with open(self.memoTablePath + "canonTable.pkl", 'wb') as f:
             pickle.dump(canonList, f)
-        # except:
-        #     print("Could not save canon table")
 
     def loadCannonTable(self):
         try:
             with open(self.memoTablePath + "canonTable.pkl", 'rb') as f:
-                self.cannonTable = pickle.load(f)
-            print(self.cannonTable)
+                for rawKey, cannonKey, transformId in pickle.load(f):
+                    self.cannonCache.put(rawKey, cannonKey, transformId)
+            print(self.cannonCache)
         except:
             print("Could not open cannon table")
 
@@ -69,69 +87,128 @@ class QuartoIterativeMiniMax:
     Determines the best square to place the currently selected piece using the minimax 
     algorithm. Places the piece in the chosen square on the game board.
 
+    With a time or node budget the deepening stops when the budget runs out, and the
+    square of the deepest search that finished is placed.
+
     Parameters:
         game (QuartoGame): The current state of the game.
+        time_ms (float): Wall clock budget for the move in milliseconds.
+        max_nodes (int): Explored node budget for the move.
+
+    Returns:
+        SearchResult: The placed square, its score, the depth searched and whether the score is proven.
     """
-    def placePiece(self, game: QuartoGame) -> None:
+    def placePiece(self, game: QuartoGame, time_ms=None, max_nodes=None) -> SearchResult:
         prevMemLength = game.undoMemLength
         game.undoMemLength = 0
         self.profiler.fullReset()
-        for i in range(1, self.depth + 1):
-            self.memoTable = {} # reset memo table, it only memoizes up to a given depth
-            score, _, square, moves = self.miniMax(game, i, True, True)
-            if len(self.toCannonize) > 0:
-                print(f'Canonizing {len(self.toCannonize)} boards.')
-                for key in self.toCannonize.keys():
-                    currGame = self.toCannonize[key]
-                    cannonGame = self.cannonizer.cannonizeGame(currGame)
-                    self.cannonTable[currGame.hashBoard()] = cannonGame
-                self.toCannonize = {}
+        startExplored = self.exploredCounter
+        self.cannonCache.resetCounters() # the cache may be shared, so its stats cover this move only
+        self.memoTable = {} # kept between the iterations of a move only, so it does not grow for the life of the solver
+        self.budget = SearchBudget(time_ms, max_nodes) if time_ms is not None or max_nodes is not None else None
+        score, square, moves, reached, cutOff = 0, None, "Budget ran out", 0, False
+        try:
+            for i in range(1, self.depth + 1):
+                self.bredthCount = [0] * 33
+                startCutoffs = self.cutoffCounter
+                score, _, square, moves = self.miniMax(game, i, True, True)
+                if not self.buildMoveStrings:
+                    moves = self.principalVariationString(game, True)
+                reached, cutOff = i, self.cutoffCounter != startCutoffs
+                self.cannonizeSavedBoards()
+                if self.isProven(game, True, reached, cutOff):
+                    break
+        except SearchAborted:
+            print(f'Stopped after depth {reached} | {self.budget}')
+        finally:
+            self.budget = None
+
+        if square is None:
+            square = next(iter(game.iterAvaliableSquares()))
+        result = SearchResult(score, square, reached, self.isProven(game, True, reached, cutOff), self.exploredCounter - startExplored)
 
         print("Placement Path: ", end="")
         print(moves)
-        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {len(self.memoTable.keys())}')
+        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {len(self.memoTable.keys())} | Dead draws: {self.deadDrawCounter}')
         print()
-        if square is not None:
-            game.placePiece(game.selectedPieces[0], square)
-        else:
-            print("Square WAS NONE: You shouldn't see this")
+        game.placePiece(game.selectedPieces[0], square)
         game.undoMemLength = prevMemLength
+        return result
 
 
     """ choosePiece()
     Determines the best piece to give to the opponent using the minimax algorithm.
     Selects the chosen piece for the opponent's turn.
+    Takes the same budgets as placePiece().
 
     Parameters:
         game (QuartoGame): The current state of the game.
+        time_ms (float): Wall clock budget for the move in milliseconds.
+        max_nodes (int): Explored node budget for the move.
+
+    Returns:
+        SearchResult: The chosen piece, its score, the depth searched and whether the score is proven.
     """
-    def choosePiece(self, game: QuartoGame) -> None:
+    def choosePiece(self, game: QuartoGame, time_ms=None, max_nodes=None) -> SearchResult:
         prevMemLength = game.undoMemLength
         game.undoMemLength = 0
         self.profiler.fullReset()
-        for i in range(1, self.depth + 1):
-            self.bredthCount = [0] * 33
-
-            startTime = time.time()
-            self.memoTable = {} # reset memo table, it only memoizes up to a given depth
-            score, piece, square, moves = self.miniMax(game, i, True, False)
-            
-            #if i % 2 == 0:
-            print(f'----------------- Depth:{i} ------------------')
-            print(f'   --- {self.bredthCount[1]} became {len(self.toCannonize)} boards')
-            print('      ---         ---          ---       ---')
-
-            self.profiler.pause()
-            self.cannonizeSavedBoards()
-            print(f'Executed step in {(time.time() - startTime) :.05f}')
-            startTime = time.time()
+        startExplored = self.exploredCounter
+        self.cannonCache.resetCounters() # the cache may be shared, so its stats cover this move only
+        self.memoTable = {} # kept between the iterations of a move only, so it does not grow for the life of the solver
+        self.budget = SearchBudget(time_ms, max_nodes) if time_ms is not None or max_nodes is not None else None
+        score, piece, moves, reached, cutOff = 0, None, "Budget ran out", 0, False
+        rawRootKey = game.zobristKey
+        try:
+            for i in range(1, self.depth + 1):
+                self.bredthCount = [0] * 33
+                startCutoffs = self.cutoffCounter
+
+                startTime = time.time()
+                score, piece, square, moves = self.miniMax(game, i, True, False)
+                # Once the root is cannonized miniMax searches its canonical form, map the piece back
+                rootEntry = self.cannonCache.get(rawRootKey)
+                if rootEntry is not None and piece is not None:
+                    piece = CannonBackend.untransformPiece(rootEntry[1], piece)
+                if not self.buildMoveStrings:
+                    moves = self.principalVariationString(game, False)
+                reached, cutOff = i, self.cutoffCounter != startCutoffs
+                
+                #if i % 2 == 0:
+                print(f'----------------- Depth:{i} ------------------')
+                print(f'   --- {self.bredthCount[1]} became {len(self.toCannonize)} boards')
+                print('      ---         ---          ---       ---')
+
+                self.profiler.pause()
+                self.cannonizeSavedBoards()
+                print(f'Executed step in {(time.time() - startTime) :.05f}')
+                startTime = time.time()
+                if self.isProven(game, False, reached, cutOff):
+                    break
+        except SearchAborted:
+            game.deselectAll() # the root choose loop selects pieces on the game itself
+            print(f'Stopped after depth {reached} | {self.budget}')
+        finally:
+            self.budget = None
         print("\n")
 
+        if piece is None:
+            piece = next(iter(game.iterRemainingPieces()))
+        result = SearchResult(score, piece, reached, self.isProven(game, False, reached, cutOff), self.exploredCounter - startExplored)
+
         self.printMinimaxData(moves)
-        if piece is not None: game.selectPiece(piece)
-        else: print("PIECE WAS NONE: You shouldn't see this")
+        game.selectPiece(piece)
 
         game.undoMemLength = prevMemLength
+        return result
+
+    """ isProven()
+    Returns True if a search to depth reached the end of the game and the breadth limit
+    did not cut it off (cutOff), or the game is a dead draw.
+    """
+    def isProven(self, game: QuartoGame, placingPiece: bool, depth: int, cutOff: bool) -> bool:
+        plies = 2 * game.avaliableSquareCount - (1 if placingPiece else 0)
+        return (depth >= plies and not cutOff) or game.isDeadDraw()
 
     # Not currently functional, commented out for safety
     # def populateCannontableParallel(self, game: QuartoGame, numPieces) -> None:
@@ -169,34 +246,41 @@ class QuartoIterativeMiniMax:
     #     game.undoMemLength = prevMemLength
 
 
-    # Saves the boards logged in the 'toCannonize' board
-    # as boardHash : canonizedGame pairs in the cannonTable
+    # Cannonizes the boards logged in 'toCannonize' in one batched call, and stores them in the cannon cache
     # Clears toCannonize, and count how many new boards are added
     def cannonizeSavedBoards(self):
         if len(self.toCannonize) > 0:
             print(f'Canonizing {len(self.toCannonize)} boards.')
-            newCanonBoards = set()
-            cannonGames = []
+            self.profiler.unpause()
 
-            for key in self.toCannonize.keys():
-                self.profiler.unpause()
-
-                self.profiler.log("Reading Memo")
-                currGame     = self.toCannonize[key]
+            self.profiler.log("Reading Memo")
+            rawKeys = list(self.toCannonize.keys())
+            games   = list(self.toCannonize.values())
+            boards  = np.array([game.board.reshape(-1) for game in games], dtype=np.int16)
 
+            self.profiler.log("Cannonizing")
+            cannonBoards, _, transformIds = CannonBackend.cannonize_many(boards)
 
-                self.profiler.log("Cannonizing")
-                cannonGame   = self.cannonizer.cannonizeGame(currGame)
+            # Saved games have no selected pieces, so their keys are the keys of their boards
+            self.profiler.log("Storing Hash")
+            cannonKeys = zobristKeys(cannonBoards)
+            for rawKey, cannonKey, transformId in zip(rawKeys, cannonKeys.tolist(), transformIds.tolist()):
+                self.cannonCache.put(rawKey, cannonKey, transformId)
 
-                self.profiler.log("Storing Hash")
-                self.cannonTable[currGame.hashBoard()] = cannonGame
-                cannonHash = cannonGame.hashBoard()
+            self.profiler.log("Hashing")
+            values, occupied = encodeBoards(cannonBoards)
+            cannonHashes = np.zeros(len(values), dtype=[('values', np.uint64), ('occupied', np.uint16)])
+            cannonHashes['values'], cannonHashes['occupied'] = values, occupied
+            _, firstIndices = np.unique(cannonHashes, return_index=True)
 
-                if cannonHash not in newCanonBoards:
-                    newCanonBoards.add(cannonGame.hashBoard())
-                    cannonGames.append(cannonGame)
+            self.profiler.log("Copying Game")
+            cannonGames = []
+            for i in np.sort(firstIndices).tolist():
+                cannonGame = games[i].copy()
+                cannonGame.applyTransform(int(transformIds[i]))
+                cannonGames.append(cannonGame)
 
-            print(f'Added {len(newCanonBoards)} new boards.')
+            print(f'Added {len(cannonGames)} new boards.')
             self.toCannonize = {}
             return cannonGames
         return []
@@ -204,15 +288,53 @@ class QuartoIterativeMiniMax:
     def printMinimaxData(self, moves):
         print("Placement Path: ", end="")
         print(moves)
-        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {len(self.memoTable.keys())}')
+        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {len(self.memoTable.keys())} | Dead draws: {self.deadDrawCounter}')
+        print(self.cannonCache)
         print()
         self.profiler.print()
 
+    """ principalVariationString()
+    Rebuilds the move path of the last search from the memo, in the format miniMax() builds,
+    following each memoized game's best move until a final game or a game that is not memoized.
+    It has to run before cannonizeSavedBoards(), so choose games are cannonized as they were in the search.
+    """
+    def principalVariationString(self, game: QuartoGame, placingPiece: bool) -> str:
+        game = game.copy()
+        turn = True
+        moveStr = ""
+        while not (game.checkWin() or game.avaliableSquareCount <= 0 or game.remainingPieceCount <= 0):
+            if placingPiece:
+                entry = self.memoTable.get((game.hashBoard(), game.selectedPieces[0]))
+                if entry is None:
+                    break
+                square = entry[2]
+                game.placePiece(game.selectedPieces[0], square)
+                moveStr += f'({square.x},{square.y})' + "->"
+            else:
+                cannonEntry = self.cannonCache.get(game.zobristKey)
+                if cannonEntry is not None:
+                    game.applyTransform(cannonEntry[1])
+                entry = self.memoTable.get((game.hashBoard(), None))
+                if entry is None:
+                    break
+                game.selectPiece(entry[1])
+                moveStr += str(entry[1]) + "->"
+                turn = not turn
+            placingPiece = not placingPiece
+        return moveStr + " Score:" + str(self.eval(game, turn))
+
     """ miniMax()
     Recursive minimax function with memoization.
     Explores all possible game states to determine the optimal move.
     Determines the best move for a current piece or best piece to give to the opponent.
     
+    The memo is kept between the iterations of placePiece() and choosePiece(), and cleared at
+    the start of each move. Entries are [score, piece, square, move path, depth] and only answer
+    searches at most as deep as they were made. A shallower entry still gives the move searched
+    first, so the earlier iterations order the moves of the next one and a winning first move
+    ends the loop. Entries of subtrees where the breadth limit cut the search off are stored
+    with CUTOFF_DRAFT, so they only order moves.
+
     Parameters:
         game (QuartoGame): Current game state.
         depth (int): Remaining depth to search.
@@ -231,26 +353,29 @@ class QuartoIterativeMiniMax:
     ):
         self.profiler.log("Hashing")
         gameHash = game.hashBoard()
+        boardKey = game.zobristKey # key of the board alone, without the selected pieces
+        for piece in game.selectedPieces:
+            boardKey ^= ZOBRIST_SELECTED[piece]
 
         #Game has been canonized already
-        self.profiler.log("Checking Memo")
-        if gameHash in self.cannonTable:
+        self.profiler.log("Checking Cannon Cache")
+        entry = self.cannonCache.get(boardKey)
+        if entry is not None:
             if not placingPiece: # only canonize a board with no selected pieces
-                self.profiler.log("Reading Memo")
-                game = self.cannonTable[gameHash] # get canonized game
                 self.profiler.log("Copying Game")
                 game = game.copy() # copy game for safety
-                game.deselectAll()
+                self.profiler.log("Cannonizing")
+                game.applyTransform(entry[1]) # rebuild the canonized game from its transform
                 self.profiler.log("Hashing")
                 gameHash = game.hashBoard() # replace hash with canon hash
 
         #store game to be canonized
-        else:
+        elif boardKey not in self.toCannonize:
             self.profiler.log("Copying Game")
             copyGame = game.copy()
             copyGame.deselectAll()
             self.profiler.log("Storing hash")
-            self.toCannonize[gameHash] = copyGame
+            self.toCannonize[boardKey] = copyGame
 
 
         self.profiler.log("Checking Depth")
@@ -259,7 +384,7 @@ class QuartoIterativeMiniMax:
             gameState = self.eval(game, turn)
 
             self.profiler.log("Return")
-            return gameState, None, None, " Score:" + str(gameState)
+            return gameState, None, None, (" Score:" + str(gameState)) if self.buildMoveStrings else None
 
         
 
@@ -279,30 +404,49 @@ class QuartoIterativeMiniMax:
             pieceHash = (gameHash, currPiece)
 
             self.profiler.log("Checking Memo")
-            if pieceHash in self.memoTable:
+            entry = self.memoTable.get(pieceHash)
+            if entry is not None and entry[4] >= depth:
 
                 self.profiler.log("Reading Memo")
-                score, move, square, moveStr = self.memoTable[pieceHash]
+                score, move, square, moveStr, _ = entry
                 
                 self.profiler.log("Basic math")
                 self.memoedCounter += 1
 
                 self.profiler.log("Return")
                 return score, move, square, moveStr
+
+            # No line can be won any more, the draw holds at any depth
+            self.profiler.log("Checking Dead Lines")
+            if game.isDeadDraw():
+                self.deadDrawCounter += 1
+                square = game.iterAvaliableSquares()[0]
+                moveStr = f'({square.x},{square.y})-> Score:0' if self.buildMoveStrings else None
+                self.memoTable[pieceHash] = [0, currPiece, square, moveStr, math.inf]
+                return 0, None, square, moveStr
             
             # ============================================================
             self.profiler.log("Basic Math")
             if self.bredthMax is not None:
                 if depth != 0:
                     if self.bredthCount[depth] >= self.bredthMax:
+                        self.cutoffCounter += 1
                         return 0, 15, IntVector2(0, 0), "Dummy"
                     self.bredthCount[depth] += 1
             # ============================================================
             
             self.exploredCounter += 1
+            if self.budget is not None:
+                self.budget.spend()
 
             self.profiler.log("Avaliable Squares")
-            for square in game.getAvaliableSquares():
+            startCutoffs = self.cutoffCounter
+            squares = list(game.iterAvaliableSquares())
+            if entry is not None and entry[2] in squares: # previous iteration's best square first
+                squares.remove(entry[2])
+                squares.insert(0, entry[2])
+
+            for square in squares:
 
                 self.profiler.log("Copying Game")
                 nextGame = game.copy()
@@ -323,9 +467,13 @@ class QuartoIterativeMiniMax:
                     bestSquare = square
                     bestMoves = moves
 
+                if bestScore > 0:
+                    break
+
             self.profiler.log("Storing Hash")
-            moveStr = f'({bestSquare.x},{bestSquare.y})' + "->" + bestMoves
-            self.memoTable[pieceHash] = [bestScore, currPiece, bestSquare, moveStr]
+            moveStr = (f'({bestSquare.x},{bestSquare.y})' + "->" + bestMoves) if self.buildMoveStrings else None
+            draft = depth if self.cutoffCounter == startCutoffs else CUTOFF_DRAFT
+            self.memoTable[pieceHash] = [bestScore, currPiece, bestSquare, moveStr, draft]
 
             self.profiler.log("Calling")
             return bestScore, None, bestSquare, moveStr
@@ -339,36 +487,56 @@ class QuartoIterativeMiniMax:
             pieceHash = (gameHash, None)
 
             self.profiler.log("Checking Memo")
-            if pieceHash in self.memoTable:
+            entry = self.memoTable.get(pieceHash)
+            if entry is not None and entry[4] >= depth:
 
                 self.profiler.log("Reading Memo")
                 self.memoedCounter += 1
-                score, move, square, moveStr = self.memoTable[pieceHash]
+                score, move, square, moveStr, _ = entry
                 
                 self.profiler.log("Return")
                 return score, move, square, moveStr
+
+            self.profiler.log("Checking Dead Lines")
+            if game.isDeadDraw():
+                self.deadDrawCounter += 1
+                piece = game.iterRemainingPieces()[0]
+                moveStr = f'{piece}-> Score:0' if self.buildMoveStrings else None
+                self.memoTable[pieceHash] = [0, piece, None, moveStr, math.inf]
+                return 0, piece, None, moveStr
             
             # ============================================================
             self.profiler.log("Basic Math")
             if self.bredthMax is not None:
                 if depth != 0:
                     if self.bredthCount[depth] >= self.bredthMax:
+                        self.cutoffCounter += 1
                         return 0, 15, IntVector2(0, 0), "Dummy"
                     self.bredthCount[depth] += 1
             # ============================================================
 
+            if self.budget is not None:
+                self.budget.spend()
+
             bestMoves, bestSquare, bestPiece, bestScore = None, None, None, -math.inf
             moves = None
 
             self.profiler.log("Getting Remaining Pieces")
-            for piece in game.getRemainingPieces():
+            startCutoffs = self.cutoffCounter
+            pieces = list(game.iterRemainingPieces())
+            if entry is not None and entry[1] in pieces: # previous iteration's best piece first
+                pieces.remove(entry[1])
+                pieces.insert(0, entry[1])
+
+            for piece in pieces:
                 
                 self.profiler.log("Checking Memo")
                 pieceHash = (gameHash, piece)
-                if pieceHash in self.memoTable:
+                pieceEntry = self.memoTable.get(pieceHash)
+                if pieceEntry is not None and pieceEntry[4] >= depth - 1:
 
                     self.profiler.log("Reading Memo")
-                    score, _, square, moves = self.memoTable[pieceHash]
+                    score, _, square, moves, _ = pieceEntry
                     self.memoedCounter += 1
 
                 else:
@@ -395,10 +563,14 @@ class QuartoIterativeMiniMax:
                     bestMoves  = moves
                     bestSquare = square
 
+                if bestScore > 0:
+                    break
+
             self.profiler.log("Storing Hash")
-            moveStr = str(bestPiece) + "->" + bestMoves
+            moveStr = (str(bestPiece) + "->" + bestMoves) if self.buildMoveStrings else None
             pieceHash = (gameHash, None) #Best possible score, no piece selected
-            self.memoTable[pieceHash] = [bestScore, bestPiece, bestSquare, moveStr]
+            draft = depth if self.cutoffCounter == startCutoffs else CUTOFF_DRAFT
+            self.memoTable[pieceHash] = [bestScore, bestPiece, bestSquare, moveStr, draft]
             self.exploredCounter += 1
 
             self.profiler.log("Return")
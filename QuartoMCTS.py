@@ -0,0 +1,325 @@
+import math
+import random
+import multiprocessing
+from QuartoGame import QuartoGame
+from QuartoBitGame import QuartoBitGame
+from GreatQuartoCannon import GreatQuartoCannon
+from QuartoBitboard import FULL_MASK, MASK_BITS, MASK_SQUARES
+from QuartoDataTypes import SearchResult
+from SearchBudget import SearchBudget, SearchAborted
+
+"""
+QuartoMCTS is a Monte Carlo tree search player for the opening, where the exact solvers
+can not finish. It grows a tree of the game with UCT selection, and scores each new node
+by playing the game out to the end on a QuartoBitGame.
+
+Playouts are
+    'random' - random squares and pieces
+    'threat' - a winning square is always taken, and pieces that give one away are
+               only chosen when every piece does
+
+The tree applies the threat rules too: a place node with a winning square only has that
+square, and a choose node only has the pieces that do not give away a win (all of them if
+none are safe). With orbitPruning only one move per orbit of the board's symmetries is added,
+as in the solvers' searchPieces and searchSquares.
+
+Node values are from the view of the player who made the move into the node: 1 per win,
+0.5 per draw. With workers, each worker grows its own tree with its share of the
+playouts, and the root moves' visits and values are summed over the trees.
+"""
+
+PLAYOUTS = ('random', 'threat')
+
+# Worker globals, set up by initMCTSWorker
+mctsWorker = None
+
+
+class MCTSNode:
+    __slots__ = ('parent', 'move', 'placingPiece', 'player', 'winner', 'terminal', 'untriedMoves', 'children', 'visits', 'value')
+
+    """
+    Parameters:
+        parent (MCTSNode): Node this one was expanded from, None at the root.
+        move: Move from the parent, square (IntVector2) or piece.
+        placingPiece (bool): True if the player to move places a piece here.
+        player (int): Player to move (0 or 1), the root player is 0.
+        winner: Winning player of a finished game, None for a draw or a game still going.
+        terminal (bool): True if the game is over.
+    """
+    def __init__(self, parent, move, placingPiece: bool, player: int, winner=None, terminal=False):
+        self.parent       = parent
+        self.move         = move
+        self.placingPiece = placingPiece
+        self.player       = player
+        self.winner       = winner
+        self.terminal     = terminal
+        self.untriedMoves = None
+        self.children     = []
+        self.visits       = 0
+        self.value        = 0.0
+
+    # The player who moved into this node
+    @property
+    def mover(self) -> int:
+        return self.parent.player if self.parent is not None else self.player ^ 1
+
+    # Upper confidence bound of the node for its parent's player
+    def uct(self, exploration: float, logParentVisits: float) -> float:
+        return self.value / self.visits + exploration * math.sqrt(logParentVisits / self.visits)
+
+
+def initMCTSWorker(solverArgs: dict) -> None:
+    global mctsWorker
+    mctsWorker = QuartoMCTS(**solverArgs)
+
+""" searchWorkerTree()
+Worker task, grows a tree for a root game with its own seed.
+
+Returns:
+    Tuple: ({root move: (visits, value)}, playouts run, deepest node reached)
+"""
+def searchWorkerTree(game: QuartoGame, placingPiece: bool, time_ms, playouts: int, seed: int):
+    mctsWorker.random.seed(seed)
+    root, count, depth = mctsWorker.searchTree(game, placingPiece, time_ms, playouts)
+    return {child.move: (child.visits, child.value) for child in root.children}, count, depth
+
+
+class QuartoMCTS:
+
+    """
+    Parameters:
+        playouts (int): Playouts per move when placePiece and choosePiece get no budget.
+        playout (str): Playout policy, 'random' or 'threat'.
+        exploration (float): UCT exploration constant.
+        orbitPruning (bool): Only add one move per orbit of the board's symmetries to the tree.
+        workers (int): Number of processes to split the playouts over, each growing its own tree.
+        seed (int): Seed of the random numbers, None for a random seed.
+    """
+    def __init__(self, playouts=2000, playout='threat', exploration=math.sqrt(2), orbitPruning=True, workers=None, seed=None):
+        if playout not in PLAYOUTS:
+            raise ValueError(f'Unknown playout {playout}')
+        self.playouts     = playouts
+        self.playout      = playout
+        self.exploration  = exploration
+        self.orbitPruning = orbitPruning
+        self.workers      = workers
+        self.random       = random.Random(seed)
+        self.cannonizer   = GreatQuartoCannon()
+        self.pool         = None
+
+        self.playoutCounter = 0
+        self.treeNodeCounter = 0
+
+    # Workers keep their solver between moves, so the pool is made once
+    def getPool(self):
+        if self.pool is None:
+            workerArgs = dict(playouts=self.playouts, playout=self.playout, exploration=self.exploration,
+                              orbitPruning=self.orbitPruning)
+            self.pool = multiprocessing.Pool(self.workers, initializer=initMCTSWorker, initargs=(workerArgs,))
+        return self.pool
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+    """ placePiece()
+    Places the selected piece on the square with the most visits after the playouts.
+    max_nodes is the playout budget and time_ms a wall clock budget, self.playouts is used
+    when neither is given.
+
+    Returns:
+        SearchResult: The square, its mean score in [-1, 1], the deepest tree node, whether the
+                      score is proven (only for a winning square) and the playouts run.
+    """
+    def placePiece(self, game: QuartoGame, time_ms=None, max_nodes=None) -> SearchResult:
+        result = self.search(game, True, time_ms, max_nodes)
+        game.placePiece(game.selectedPieces[0], result.move)
+        return result
+
+    """ choosePiece()
+    Selects the piece with the most visits for the opponent, with the same budgets as placePiece().
+    """
+    def choosePiece(self, game: QuartoGame, time_ms=None, max_nodes=None) -> SearchResult:
+        result = self.search(game, False, time_ms, max_nodes)
+        game.selectPiece(result.move)
+        return result
+
+    """ search()
+    Runs the playouts from a root game, in the pool when the solver has workers.
+
+    Returns:
+        SearchResult: See placePiece()
+    """
+    def search(self, game: QuartoGame, placingPiece: bool, time_ms=None, max_nodes=None) -> SearchResult:
+        playouts = max_nodes if max_nodes is not None else (self.playouts if time_ms is None else None)
+
+        if self.workers is not None and self.workers > 1:
+            share = None if playouts is None else max(1, playouts // self.workers)
+            tasks = [(game, placingPiece, time_ms, share, self.random.getrandbits(32)) for _ in range(self.workers)]
+            stats, count, depth = {}, 0, 0
+            for workerStats, workerCount, workerDepth in self.getPool().starmap(searchWorkerTree, tasks):
+                for move, (visits, value) in workerStats.items():
+                    total = stats.setdefault(move, [0, 0.0])
+                    total[0] += visits
+                    total[1] += value
+                count += workerCount
+                depth = max(depth, workerDepth)
+        else:
+            root, count, depth = self.searchTree(game, placingPiece, time_ms, playouts)
+            stats = {child.move: (child.visits, child.value) for child in root.children}
+
+        # The most visited move, the first one on ties
+        bestMove, bestVisits, bestValue = None, -1, 0.0
+        for move, (visits, value) in stats.items():
+            if visits > bestVisits:
+                bestMove, bestVisits, bestValue = move, visits, value
+        if bestMove is None:
+            bestMove = self.fallbackMove(game, placingPiece) # the budget ran out before any playout
+        score = 2 * bestValue / bestVisits - 1 if bestVisits > 0 else 0.0
+        proven = placingPiece and game.winningSquare(game.selectedPieces[0]) is not None
+        if proven:
+            score = 1
+
+        print(f'MCTS playouts: {count} | Tree depth: {depth} | Best move: {bestMove} '
+              f'({bestVisits} visits, score {score:.3f}) | Root moves: {len(stats)}')
+        return SearchResult(score, bestMove, depth, proven, count)
+
+    """ fallbackMove()
+    Move of a root game when no playout finished: a winning square, or the first square
+    when placing, the first piece that does not give away a win (any piece if none is safe)
+    when choosing.
+    """
+    def fallbackMove(self, game: QuartoGame, placingPiece: bool):
+        if placingPiece:
+            square = game.winningSquare(game.selectedPieces[0])
+            return square if square is not None else game.iterAvaliableSquares()[0]
+        pieces = game.remainingMask & ~game.threatPieces()
+        return MASK_BITS[pieces if pieces != 0 else game.remainingMask][0]
+
+    """ searchTree()
+    Grows a tree from a root game until the playout or time budget runs out.
+
+    Returns:
+        Tuple: (root node, playouts run, deepest node reached)
+    """
+    def searchTree(self, game: QuartoGame, placingPiece: bool, time_ms=None, playouts=None):
+        rootGame = QuartoBitGame(verbose=False, undoMemLength=0)
+        rootGame.loadFromHash(game.hashBoard())
+        for piece in game.selectedPieces:
+            rootGame.selectPiece(piece)
+
+        root = MCTSNode(None, None, placingPiece, 0)
+        budget = SearchBudget(time_ms, playouts)
+        count, maxDepth = 0, 0
+        try:
+            while True:
+                budget.spend()
+                maxDepth = max(maxDepth, self.runPlayout(root, rootGame.copy()))
+                count += 1
+        except SearchAborted:
+            pass
+        self.playoutCounter += count
+        return root, count, maxDepth
+
+    """ runPlayout()
+    One iteration: selects down the tree with UCT, adds one node, plays the game out from it
+    and backs the result up the path. game is a copy of the root game, played along.
+
+    Returns:
+        int: Depth of the node the playout started from
+    """
+    def runPlayout(self, root: MCTSNode, game: QuartoBitGame) -> int:
+        node, depth = root, 0
+        while not node.terminal:
+            if node.untriedMoves is None:
+                node.untriedMoves = self.nodeMoves(game, node.placingPiece)
+            if node.untriedMoves:
+                node = self.expand(node, game)
+                depth += 1
+                break
+            logVisits = math.log(node.visits)
+            node = max(node.children, key=lambda child: child.uct(self.exploration, logVisits))
+            self.playMove(game, node.parent.placingPiece, node.move)
+            depth += 1
+
+        winner = node.winner if node.terminal else self.rollout(game, node.placingPiece, node.player)
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.value += 0.5
+            elif winner == node.mover:
+                node.value += 1
+            node = node.parent
+        return depth
+
+    # Moves of a tree node, shuffled, see the notes at the top
+    def nodeMoves(self, game: QuartoBitGame, placingPiece: bool) -> list:
+        if placingPiece:
+            piece = game.selectedPieces[0]
+            square = game.winningSquare(piece)
+            if square is not None:
+                return [square]
+            squares = self.cannonizer.placeableSquares(game, piece) if self.orbitPruning else ~game.occupied & FULL_MASK
+            moves = list(MASK_SQUARES[squares])
+        else:
+            pieces = game.remainingMask & ~game.threatPieces()
+            if pieces == 0:
+                pieces = game.remainingMask
+            if self.orbitPruning:
+                pieces &= self.cannonizer.choosablePieces(game)
+            moves = list(MASK_BITS[pieces])
+        self.random.shuffle(moves)
+        return moves
+
+    def playMove(self, game: QuartoBitGame, placingPiece: bool, move) -> None:
+        if placingPiece:
+            game.placePiece(game.selectedPieces[0], move)
+        else:
+            game.selectPiece(move)
+
+    # Plays an untried move of a node and adds its child
+    def expand(self, node: MCTSNode, game: QuartoBitGame) -> MCTSNode:
+        move = node.untriedMoves.pop()
+        self.playMove(game, node.placingPiece, move)
+        if node.placingPiece:
+            won = game.checkWin()
+            child = MCTSNode(node, move, False, node.player, winner=node.player if won else None,
+                             terminal=won or game.avaliableSquareCount == 0)
+        else:
+            child = MCTSNode(node, move, True, node.player ^ 1)
+        node.children.append(child)
+        self.treeNodeCounter += 1
+        return child
+
+    """ rollout()
+    Plays a game out with the playout policy.
+
+    Returns:
+        The winning player, None for a draw
+    """
+    def rollout(self, game: QuartoBitGame, placingPiece: bool, player: int):
+        threatAware = self.playout == 'threat'
+        rng = self.random
+        while True:
+            if placingPiece:
+                piece = game.selectedPieces[0]
+                square = game.winningSquare(piece) if threatAware else None
+                if square is None:
+                    square = rng.choice(game.iterAvaliableSquares())
+                game.placePiece(piece, square)
+                if game.checkWin():
+                    return player
+                if game.avaliableSquareCount == 0:
+                    return None
+            else:
+                pieces = game.remainingMask
+                if threatAware:
+                    safePieces = pieces & ~game.threatPieces()
+                    if safePieces != 0:
+                        pieces = safePieces
+                game.selectPiece(rng.choice(MASK_BITS[pieces]))
+                player ^= 1
+            placingPiece = not placingPiece
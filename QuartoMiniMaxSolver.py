@@ -4,7 +4,13 @@ from GreatQuartoCannon import GreatQuartoCannon
 from QuartoCannon import QuartoCannon
 import math
 from Profiler import Profiler
-from QuartoDataTypes import IntVector2
+from QuartoDataTypes import IntVector2, SearchResult
+from QuartoBitboard import ZOBRIST_SELECTED, SQUARE_VECTORS, FULL_MASK, MASK_BITS, MASK_SQUARES, squareIndex
+from CannonCache import CannonCache
+from TranspositionTable import TranspositionTable, SharedTranspositionTable, EXACT, LOWER, UPPER, PROVEN_DEPTH
+from SearchBudget import SearchBudget, SearchAborted
+from ParallelRootSearch import ParallelRootSearch
+import CannonBackend
 import time
 
 """
@@ -20,21 +26,149 @@ class QuartoMiniMaxSolver:
 
     Parameters:
         depth (int): Maximum search depth minimax will go to. (32 for full game)
+        hashMode (str): How memo keys are made.
+            'board'   - (hashBoard, selected piece) tuples, matching the saved tables
+            'zobrist' - the game's incremental 64 bit zobristKey
+            'audit'   - zobrist keys, cross checked against hashBoard to count collisions
+        cannonCacheSize (int): Capacity of a cannon cache for this solver alone.
+            By default the process wide shared cache is used (see CannonCache), and its
+            counters are reset at every move so the printed stats are this move's.
+        algorithm (str): Search used by placePiece and choosePiece.
+            'minimax' - the original memoized minimax, stopping at the first winning move
+            'negamax' - negamax with alpha-beta windows and bound tagged memo entries
+        ttBytes (int): Byte budget of a fixed size TranspositionTable used as the negamax memo
+            in place of the unbounded memoTable dict. Needs zobrist memo keys.
+        buildMoveStrings (bool): Build the move path string at every node of the minimax search.
+            When False the memo only keeps scores and best moves, and the move path is rebuilt
+            from the memo by principalVariationString() once the search is done.
+        workers (int): Number of processes to split the root moves over, see ParallelRootSearch.
+            The move path of a parallel search only holds the root move. With ttBytes, the
+            transposition table is a SharedTranspositionTable used by every worker.
+        sharedTable (SharedTranspositionTable): Table to use as the transposition table, in place of ttBytes.
+        orbitPruning (bool): Only search one piece per orbit of the board's stabilizer at choose nodes,
+            and one square per orbit of the transforms fixing the board and piece at place nodes.
+            Turn it off to measure the nodes it saves.
+        endgameTable (EndgameTable): Solved endgames with 'negamax' scores. The negamax search returns
+            the table's score for games small enough to be in it, instead of searching them.
     """
-    def __init__(self, depth=16, maxBredth=None):
+    def __init__(self, depth=16, maxBredth=None, hashMode='board', cannonCacheSize=None, algorithm='minimax', ttBytes=None,
+                 buildMoveStrings=True, workers=None, sharedTable=None, orbitPruning=True, endgameTable=None):
+        if algorithm not in ('minimax', 'negamax'):
+            raise ValueError(f'Unknown algorithm {algorithm}')
+        if (ttBytes is not None or sharedTable is not None) and (hashMode == 'board' or algorithm != 'negamax'):
+            raise ValueError('ttBytes needs the negamax algorithm with zobrist memo keys')
+        if endgameTable is not None and endgameTable.perspective != 'negamax':
+            raise ValueError('endgameTable needs negamax scores')
+        self.algorithm = algorithm
+        self.buildMoveStrings = buildMoveStrings
+        self.orbitPruning = orbitPruning
+        self.endgameTable = endgameTable
         self.memoTable = {}
-        self.cannonTable = {}
+        self.decisionMemo = {} # negamax memo of canForceWin() when the algorithm is minimax
+        self.ownsTable = sharedTable is None and ttBytes is not None and workers is not None and workers > 1
+        if sharedTable is not None:
+            self.transpositionTable = sharedTable
+        elif self.ownsTable:
+            self.transpositionTable = SharedTranspositionTable(ttBytes)
+        else:
+            self.transpositionTable = TranspositionTable(ttBytes) if ttBytes is not None else None
         self.depth = depth
         #self.cannonizer = QuartoCannon()
         #self.cannonizer = BasicQuartoCannon()
-        self.cannonizer = GreatQuartoCannon()
+        self.cannonizer = GreatQuartoCannon(CannonCache(cannonCacheSize) if cannonCacheSize is not None else None)
         self.profiler   = Profiler()
         self.exploredCounter = 0
         self.memoedCounter = 0
+        self.threatCounter = 0
+        self.deadDrawCounter = 0
+        self.orbitPrunedCounter = 0
+        self.endgameCounter = 0
+        self.budget = None
 
         self.maxBredth = maxBredth
         self.bredthCounts = [0] * 33
 
+        if hashMode not in ('board', 'zobrist', 'audit'):
+            raise ValueError(f'Unknown hashMode {hashMode}')
+        self.hashMode = hashMode
+        self.auditTable = {}
+        self.collisionCounter = 0
+
+        self.rootSearch = None
+        self.rootMoveDepth = None
+        if workers is not None and workers > 1:
+            workerArgs = dict(depth=depth, maxBredth=maxBredth, hashMode=hashMode, cannonCacheSize=cannonCacheSize,
+                              algorithm=algorithm, buildMoveStrings=False, sharedTable=self.transpositionTable,
+                              orbitPruning=orbitPruning, endgameTable=endgameTable)
+            self.rootSearch = ParallelRootSearch(workers, type(self), workerArgs)
+
+    # Stops the root search workers, and frees the shared table if this solver made it
+    def close(self) -> None:
+        if self.rootSearch is not None:
+            self.rootSearch.close()
+        if self.ownsTable:
+            self.transpositionTable.close()
+            self.transpositionTable = None
+            self.ownsTable = False
+
+
+    """ getMemoKey()
+    Returns the memo key for a game, covering its board and selected piece.
+    """
+    def getMemoKey(self, game: QuartoGame):
+        if self.hashMode == 'board':
+            return (game.hashBoard(), game.selectedPieces[0] if len(game.selectedPieces) > 0 else None)
+
+        key = game.zobristKey
+        if self.hashMode == 'audit':
+            fullKey = (game.hashBoard(), tuple(sorted(game.selectedPieces)))
+            seenKey = self.auditTable.setdefault(key, fullKey)
+            if seenKey != fullKey:
+                self.collisionCounter += 1
+                print(f'Zobrist collision on {key:016x}: {seenKey} and {fullKey}')
+        return key
+
+    """ getSelectedKey()
+    Returns the memo key of a choose node's game once piece is selected,
+    from the choose node's own key.
+    """
+    def getSelectedKey(self, gameHash, piece: int):
+        if self.hashMode == 'board':
+            return (gameHash[0], piece)
+        return gameHash ^ ZOBRIST_SELECTED[piece]
+
+
+    """ memoSize()
+    Returns the number of memo entries, from the transposition table when one is used.
+    """
+    def memoSize(self) -> int:
+        if self.transpositionTable is not None:
+            return len(self.transpositionTable)
+        return len(self.memoTable)
+
+    """ probeMemo()
+    Returns the negamax memo entry (score, bound, depth, best move) of a key, or None.
+    The transposition table keeps moves as square indices, they are turned back into squares here.
+    """
+    def probeMemo(self, gameHash, placingPiece: bool):
+        if self.transpositionTable is None:
+            return self.memoTable.get(gameHash)
+        entry = self.transpositionTable.probe(gameHash)
+        if entry is not None and placingPiece and entry[3] is not None:
+            return entry[0], entry[1], entry[2], SQUARE_VECTORS[entry[3]]
+        return entry
+
+    """ storeMemo()
+    Stores a negamax memo entry in the memo table or the transposition table.
+    """
+    def storeMemo(self, gameHash, score: int, bound: int, depth: int, move, placingPiece: bool) -> None:
+        if self.transpositionTable is None:
+            self.memoTable[gameHash] = [score, bound, depth, move]
+            return
+        if placingPiece and move is not None:
+            move = squareIndex(move)
+        self.transpositionTable.store(gameHash, score, bound, depth, move)
+
 
     """ placePiece()
     Determines and places the best piece (provided by the opponent) on the game board.
@@ -43,50 +177,302 @@ class QuartoMiniMaxSolver:
     Determines the best square to place the currently selected piece using the minimax 
     algorithm. Places the piece in the chosen square on the game board.
 
+    With a time or node budget the search deepens one ply at a time until the budget runs out,
+    and places the best square of the deepest search that finished.
+
     Parameters:
         game (QuartoGame): The current state of the game.
+        time_ms (float): Wall clock budget for the move in milliseconds.
+        max_nodes (int): Explored node budget for the move.
+
+    Returns:
+        SearchResult: The placed square, its score, the depth searched and whether the score is proven.
     """
-    def placePiece(self, game: QuartoGame) -> None:
+    def placePiece(self, game: QuartoGame, time_ms=None, max_nodes=None) -> SearchResult:
         prevMemLength = game.undoMemLength
         game.undoMemLength = 0
-        self.bredthCounts = [0] * 33
-        score, _, square, moves = self.miniMax(game, self.depth, True, True)
+        startExplored = self.exploredCounter
+        self.cannonizer.cache.resetCounters() # the cache may be shared, so its stats cover this move only
+        score, _, square, moves, depth = self.budgetedSearch(game, True, time_ms, max_nodes)
+        result = SearchResult(score, square, depth, self.isProven(game, True, score, depth), self.exploredCounter - startExplored)
         self.profiler.pause()
-        print("Placement Path: ", end="")
-        print(moves)
-        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {len(self.memoTable.keys())}')
-        print()
+        self.printSearchStats(moves)
         if square is not None:
             game.placePiece(game.selectedPieces[0], square)
         else:
             print("Square WAS NONE: You shouldn't see this")
         game.undoMemLength = prevMemLength
+        return result
 
 
     """ choosePiece()
     Determines the best piece to give to the opponent using the minimax algorithm.
     Selects the chosen piece for the opponent's turn.
 
+    Takes the same budgets as placePiece().
+
     Parameters:
         game (QuartoGame): The current state of the game.
+        time_ms (float): Wall clock budget for the move in milliseconds.
+        max_nodes (int): Explored node budget for the move.
+
+    Returns:
+        SearchResult: The chosen piece, its score, the depth searched and whether the score is proven.
     """
-    def choosePiece(self, game: QuartoGame) -> None:
+    def choosePiece(self, game: QuartoGame, time_ms=None, max_nodes=None) -> SearchResult:
         prevMemLength = game.undoMemLength
         game.undoMemLength = 0
-        self.bredthCounts = [0] * 33
         self.profiler.fullReset()
-        score, piece, _, moves = self.miniMax(game, self.depth, True, False)
+        startExplored = self.exploredCounter
+        self.cannonizer.cache.resetCounters() # the cache may be shared, so its stats cover this move only
+        score, piece, _, moves, depth = self.budgetedSearch(game, False, time_ms, max_nodes)
+        result = SearchResult(score, piece, depth, self.isProven(game, False, score, depth), self.exploredCounter - startExplored)
         self.profiler.pause()
-        print("Placement Path: ", end="")
-        print(moves)
-        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {len(self.memoTable.keys())}')
-        print()
+        self.printSearchStats(moves)
         self.profiler.print()
         if piece is not None:
             game.selectPiece(piece)
         else:
             print("PIECE WAS NONE: You shouldn't see this")
         game.undoMemLength = prevMemLength
+        return result
+
+
+    # Prints the move path and the solver's counters after placePiece() or choosePiece()
+    def printSearchStats(self, moves) -> None:
+        print("Placement Path: ", end="")
+        print(moves)
+        print(f'Explored: {self.exploredCounter} | Memoed: {self.memoedCounter} | MemoTable: {self.memoSize()} | '
+              f'Threat shortcuts: {self.threatCounter} | Dead draws: {self.deadDrawCounter}')
+        print(f'Orbit pruned moves: {self.orbitPrunedCounter} | Endgame hits: {self.endgameCounter}')
+        if self.transpositionTable is not None:
+            print(self.transpositionTable)
+        if self.rootSearch is not None:
+            print(self.rootSearch)
+        print(self.cannonizer.cache)
+        if self.hashMode == 'audit':
+            print(f'Zobrist collisions: {self.collisionCounter} in {len(self.auditTable)} keys')
+        print()
+
+
+    """ budgetedSearch()
+    Searches to the solver's depth, or with a time or node budget, deepens one ply at a time
+    until the budget runs out or the score is proven. An aborted iteration is thrown away, so
+    the move is from the deepest search that finished. If not even depth 1 finished, the first
+    legal move is returned with depth 0.
+
+    Returns:
+        Tuple: (best score, best piece (when choosing), best square (when placing), move path as string, depth searched)
+    """
+    def budgetedSearch(self, game: QuartoGame, placingPiece: bool, time_ms=None, max_nodes=None):
+        if time_ms is None and max_nodes is None:
+            self.bredthCounts = [0] * 33
+            return self.search(game, placingPiece) + (self.depth,)
+
+        self.budget = SearchBudget(time_ms, max_nodes)
+        best = None
+        try:
+            for depth in range(1, self.depth + 1):
+                self.bredthCounts = [0] * 33
+                if self.algorithm == 'minimax':
+                    self.memoTable = {} # minimax memo entries do not record their depth
+                best = self.search(game, placingPiece, depth) + (depth,)
+                if self.isProven(game, placingPiece, best[0], depth):
+                    break
+        except SearchAborted:
+            pass
+        finally:
+            print(self.budget)
+            self.budget = None
+
+        if best is None:
+            if placingPiece:
+                return 0, None, next(iter(game.iterAvaliableSquares())), "Budget ran out", 0
+            return 0, next(iter(game.iterRemainingPieces())), None, "Budget ran out", 0
+        return best
+
+    """ isProven()
+    Returns True if a root score is exact: the search reached the end of the game without
+    breadth cut offs, the game is a dead draw, or negamax found a win or a loss (which hold at any depth).
+    """
+    def isProven(self, game: QuartoGame, placingPiece: bool, score: int, depth: int) -> bool:
+        plies = 2 * game.avaliableSquareCount - (1 if placingPiece else 0)
+        if (depth >= plies and self.maxBredth is None) or game.isDeadDraw():
+            return True
+        return self.algorithm == 'negamax' and score != 0
+
+
+    """ search()
+    Runs the selected algorithm from the root game.
+    The search works on the cannonized game, so the best move is mapped back
+    through the root's transform onto the game that was passed in.
+    With workers the root moves are searched in parallel by ParallelRootSearch.
+
+    Returns:
+        Tuple: (best score, best piece (when choosing), best square (when placing), move path as string)
+    """
+    def search(self, game: QuartoGame, placingPiece: bool, depth=None):
+        if depth is None:
+            depth = self.depth
+        root, transformId = self.cannonizer.cannonizeGameWithTransform(game)
+
+        if self.rootSearch is not None and not self.isFinal(root, placingPiece):
+            score, move, nodes = self.rootSearch.search(root, self.rootMoves(root, placingPiece), placingPiece, depth, self.budget)
+            self.exploredCounter += nodes
+            piece, square = (None, move) if placingPiece else (move, None)
+            moves = (f'({move.x},{move.y})' if placingPiece else str(move)) + "-> Score:" + str(score)
+        elif self.algorithm == 'negamax':
+            score, move = self.negamax(game, depth, -1, 1, placingPiece)
+            piece, square = (None, move) if placingPiece else (move, None)
+            moves = self.principalVariationString(game, placingPiece)
+        else:
+            score, piece, square, moves = self.miniMax(game, depth, True, placingPiece)
+            if not self.buildMoveStrings:
+                moves = self.principalVariationString(game, placingPiece)
+
+        if placingPiece and square is not None and square.x >= 0:
+            square = SQUARE_VECTORS[CannonBackend.untransformSquare(transformId, squareIndex(square))]
+        if not placingPiece and piece is not None:
+            piece = CannonBackend.untransformPiece(transformId, piece)
+        return score, piece, square, moves
+
+
+    """ canForceWin()
+    Win or not decision search: True if the player to move can force a win within depth.
+    Runs negamax with the zero window (0, 1), which only proves or refutes a score above 0,
+    so every node stops at its first refutation instead of working out the exact score.
+    With the minimax algorithm the negamax entries go to decisionMemo, as the memo entries differ.
+    """
+    def canForceWin(self, game: QuartoGame, placingPiece: bool, depth=None) -> bool:
+        if depth is None:
+            depth = self.depth
+        if self.algorithm == 'negamax':
+            score, _ = self.negamax(game, depth, 0, 1, placingPiece)
+            return score > 0
+
+        memoTable, self.memoTable = self.memoTable, self.decisionMemo
+        try:
+            score, _ = self.negamax(game, depth, 0, 1, placingPiece)
+        finally:
+            self.memoTable = memoTable
+        return score > 0
+
+
+    """ rootMoves()
+    Returns the moves of a cannonized root game that the serial search would try, in order.
+    With orbitPruning only one move per orbit is tried, see searchPieces(). Negamax only tries the
+    winning square of the placed piece if it has one, and only the safe pieces (or the first
+    piece, if none are safe) when choosing.
+    """
+    def rootMoves(self, game: QuartoGame, placingPiece: bool) -> list:
+        if placingPiece:
+            square = game.winningSquare(game.selectedPieces[0]) if self.algorithm == 'negamax' else None
+            return [square] if square is not None else list(MASK_SQUARES[self.searchSquares(game, game.selectedPieces[0])])
+        if self.algorithm == 'negamax':
+            safePieces = game.remainingMask & ~game.threatPieces()
+            return list(MASK_BITS[safePieces & self.searchPieces(game)]) if safePieces != 0 else [game.iterRemainingPieces()[0]]
+        return list(MASK_BITS[self.searchPieces(game)])
+
+
+    """ searchPieces() / searchSquares()
+    Masks of the pieces a choose node searches, and of the squares a place node searches for piece.
+    With orbitPruning these hold one move per orbit of the transforms that leave the board (and the
+    placed piece) unchanged, as moves in the same orbit give symmetric games (see GreatQuartoCannon).
+    The lowest move of each orbit is kept, so the first best move found is the same.
+    """
+    def searchPieces(self, game: QuartoGame) -> int:
+        pieces = self.cannonizer.choosablePieces(game) if self.orbitPruning else game.remainingMask
+        self.orbitPrunedCounter += game.remainingPieceCount - pieces.bit_count()
+        return pieces
+
+    def searchSquares(self, game: QuartoGame, piece: int) -> int:
+        squares = self.cannonizer.placeableSquares(game, piece) if self.orbitPruning else ~game.occupied & FULL_MASK
+        self.orbitPrunedCounter += game.avaliableSquareCount - squares.bit_count()
+        return squares
+
+
+    """ searchRootMove()
+    Searches the game after one root move, for ParallelRootSearch workers.
+
+    Parameters:
+        game (QuartoGame): The cannonized root game.
+        move: Square to place on (when placing) or piece to choose (when choosing).
+        placingPiece (bool): True if the root is placing a piece, False if it's choosing a piece.
+        depth (int): Depth of the root search.
+
+    Returns:
+        score (int): Score of the move, from the view of the root player.
+    """
+    def searchRootMove(self, game: QuartoGame, move, placingPiece: bool, depth: int) -> int:
+        game = game.copy()
+        self.bredthCounts = [0] * 33
+        if self.algorithm == 'minimax' and depth != self.rootMoveDepth:
+            self.memoTable = {} # minimax memo entries do not record their depth
+            self.rootMoveDepth = depth
+
+        if placingPiece:
+            game.placePiece(game.selectedPieces[0], move)
+            if self.algorithm == 'negamax':
+                return self.negamax(game, depth-1, -1, 1, False)[0]
+            return self.miniMax(game, depth-1, True, False)[0]
+
+        game.selectPiece(move)
+        if self.algorithm == 'negamax':
+            return -self.negamax(game, depth-1, -1, 1, True)[0]
+        return -self.miniMax(game, depth-1, False, True)[0]
+
+
+    """ principalVariation()
+    Rebuilds the principal variation of a searched game by walking the memo from it,
+    following each memoized game's best move until a final game or a game that is not memoized.
+    Like the move strings, every move is in the cannonized frame of the game it is played in.
+
+    Returns:
+        Tuple: (moves alternating between squares and pieces, last game, whether it is the AI's turn in it)
+    """
+    def principalVariation(self, game: QuartoGame, placingPiece: bool):
+        game = game.copy()
+        turn = True
+        moves = []
+        while not self.isFinal(game, placingPiece):
+            game = self.cannonizer.cannonizeGame(game)
+            gameHash = self.getMemoKey(game)
+            if self.algorithm == 'negamax':
+                entry = self.probeMemo(gameHash, placingPiece)
+                move = entry[3] if entry is not None else None
+            else:
+                entry = self.memoTable.get(gameHash)
+                move = (entry[2] if placingPiece else entry[1]) if entry is not None else None
+            if move is None:
+                break
+
+            moves.append(move)
+            if placingPiece:
+                game.placePiece(game.selectedPieces[0], move)
+            else:
+                game.selectPiece(move)
+                turn = not turn
+            placingPiece = not placingPiece
+        return moves, game, turn
+
+    """ principalVariationString()
+    Exports the principal variation in the move path format built by miniMax(),
+    such as "(1,2)->5->(0,3)-> Score:1".
+    """
+    def principalVariationString(self, game: QuartoGame, placingPiece: bool) -> str:
+        moves, lastGame, turn = self.principalVariation(game, placingPiece)
+        moveStr = ""
+        for move in moves:
+            moveStr += (f'({move.x},{move.y})' if isinstance(move, IntVector2) else str(move)) + "->"
+        return moveStr + " Score:" + str(self.eval(lastGame, turn))
+
+    """ isFinal()
+    Returns True if the search stops at a game, whatever depth is left.
+    """
+    def isFinal(self, game: QuartoGame, placingPiece: bool) -> bool:
+        if self.algorithm == 'negamax':
+            return (not placingPiece and (game.checkWin() or game.remainingPieceCount <= 0)) or game.avaliableSquareCount == 0
+        return game.checkWin() or game.avaliableSquareCount == 0 or game.remainingPieceCount <= 0
 
 
     """ miniMax()
@@ -118,7 +504,7 @@ class QuartoMiniMaxSolver:
             gameState = self.eval(game, turn)
             
             self.profiler.log("Return")
-            return gameState, 0, IntVector2(-1, -1), " Score:" + str(gameState)
+            return gameState, 0, IntVector2(-1, -1), (" Score:" + str(gameState)) if self.buildMoveStrings else None
 
         # self.profiler.log("Hashing")
         # basicGameHash = game.hashBoard()
@@ -130,11 +516,22 @@ class QuartoMiniMaxSolver:
         #     gameHash = self.cannonTable[basicGameHash]
         #     self.profiler.pause()
 
+        # With zobrist keys the canonical key comes straight from the cannon cache,
+        # so memoized games are answered without cannonizing them
+        if self.hashMode == 'zobrist':
+            self.profiler.log("Checking Cannon Cache")
+            entry = self.cannonizer.cache.get(game.zobristKey)
+            if entry is not None and entry[0] in self.memoTable:
+                self.profiler.log("Reading Memo")
+                self.memoedCounter += 1
+                score, move, square, moveStr = self.memoTable[entry[0]]
+                return score, move, square, moveStr
+
         self.profiler.log("Cannonizing")
         game = self.cannonizer.cannonizeGame(game)
 
         self.profiler.log("Hashing")
-        gameHash = game.hashBoard()
+        gameHash = self.getMemoKey(game)
         
 
         # self.profiler.log("Storing Hash")
@@ -152,7 +549,7 @@ class QuartoMiniMaxSolver:
             bestMoves, bestSquare, bestScore = None, None, -math.inf
             moves = None
             currPiece = game.selectedPieces[0]
-            pieceHash = (gameHash, currPiece)
+            pieceHash = gameHash
 
             self.profiler.log("Checking Memo")
             if pieceHash in self.memoTable:
@@ -166,6 +563,14 @@ class QuartoMiniMaxSolver:
                 self.profiler.log("Return")
                 return score, move, square, moveStr
             
+            self.profiler.log("Checking Dead Lines")
+            if game.isDeadDraw():
+                self.deadDrawCounter += 1
+                square = game.iterAvaliableSquares()[0]
+                moveStr = f'({square.x},{square.y})-> Score:0' if self.buildMoveStrings else None
+                self.memoTable[pieceHash] = [0, currPiece, square, moveStr]
+                return 0, None, square, moveStr
+
             self.profiler.log("Basic Math")
             if self.maxBredth is not None:
                 if self.bredthCounts[depth] >= self.maxBredth:
@@ -173,9 +578,11 @@ class QuartoMiniMaxSolver:
                 self.bredthCounts[depth] += 1
             
             self.exploredCounter += 1
+            if self.budget is not None:
+                self.budget.spend()
 
             self.profiler.log("Avaliable Squares")
-            for square in game.getAvaliableSquares():
+            for square in MASK_SQUARES[self.searchSquares(game, currPiece)]:
 
                 # self.profiler.log("Copying Game")
                 # nextGame = game.copy()
@@ -203,7 +610,7 @@ class QuartoMiniMaxSolver:
                     break
 
             self.profiler.log("Storing Hash")
-            moveStr = f'({bestSquare.x},{bestSquare.y})' + "->" + bestMoves
+            moveStr = (f'({bestSquare.x},{bestSquare.y})' + "->" + bestMoves) if self.buildMoveStrings else None
             self.memoTable[pieceHash] = [bestScore, currPiece, bestSquare, moveStr]
             
             self.profiler.log("Return")
@@ -215,7 +622,7 @@ class QuartoMiniMaxSolver:
             and recursively evaluates the score for each choice.
             """
             self.profiler.log("Basic Math")
-            pieceHash = (gameHash, None)
+            pieceHash = gameHash
             
             self.profiler.log("Checking Memo")
             if pieceHash in self.memoTable:
@@ -226,6 +633,14 @@ class QuartoMiniMaxSolver:
                 
                 self.profiler.log("Return")
                 return score, move, square, moveStr
+
+            self.profiler.log("Checking Dead Lines")
+            if game.isDeadDraw():
+                self.deadDrawCounter += 1
+                piece = game.iterRemainingPieces()[0]
+                moveStr = f'{piece}-> Score:0' if self.buildMoveStrings else None
+                self.memoTable[pieceHash] = [0, piece, None, moveStr]
+                return 0, piece, None, moveStr
             
             self.profiler.log("Basic Math")
             if self.maxBredth is not None:
@@ -233,14 +648,17 @@ class QuartoMiniMaxSolver:
                     return 0, None, None, "Dummy Return"
                 self.bredthCounts[depth] += 1
 
+            if self.budget is not None:
+                self.budget.spend()
+
             bestMoves, bestSquare, bestPiece, bestScore = None, None, None, -math.inf
             moves = None
             
             self.profiler.log("Getting Remaining Pieces")
-            for piece in game.getRemainingPieces():
+            for piece in MASK_BITS[self.searchPieces(game)]:
                 
                 self.profiler.log("Checking Memo")
-                pieceHash = (gameHash, piece)
+                pieceHash = self.getSelectedKey(gameHash, piece)
                 if pieceHash in self.memoTable:
 
                     self.profiler.log("Reading Memo")
@@ -279,8 +697,8 @@ class QuartoMiniMaxSolver:
 
 
             self.profiler.log("Storing Hash")
-            moveStr = str(bestPiece) + "->" + bestMoves
-            pieceHash = (gameHash, None) #Best possible score, no piece selected
+            moveStr = (str(bestPiece) + "->" + bestMoves) if self.buildMoveStrings else None
+            pieceHash = gameHash #Best possible score, no piece selected
             self.memoTable[pieceHash] = [bestScore, bestPiece, bestSquare, moveStr]
             
             self.profiler.log("Basic Math")
@@ -290,6 +708,165 @@ class QuartoMiniMaxSolver:
             return bestScore, bestPiece, square, moveStr
 
 
+    """ negamax()
+    Negamax search with alpha-beta windows over the {-1, 0, 1} score range.
+    Scores are from the view of the player to move. A player places the piece they were
+    given and then chooses a piece for their opponent, so placing children keep the
+    player (and the window), while choosing children hand the move over and are negated.
+
+    Memo entries are [score, bound, depth, best move], where bound tags the score as
+    EXACT, a LOWER bound (it failed high) or an UPPER bound (it failed low).
+    They are kept in the transposition table when the solver has one.
+
+    Parameters:
+        game (QuartoGame): Current game state.
+        depth (int): Remaining depth to search.
+        alpha, beta (int): Search window, the root uses (-1, 1).
+        placingPiece (bool): True if this phase is placing a piece, False if it's choosing a piece.
+
+    Returns:
+        Tuple: (score, best square (when placing) or best piece (when choosing))
+    """
+    def negamax(self, game: QuartoGame, depth: int, alpha: int, beta: int, placingPiece: bool):
+
+        self.profiler.log("Checking Depth")
+        # The player choosing has just placed, so a win on the board is theirs
+        if not placingPiece and game.checkWin():
+            return 1, None
+        if depth == 0 or game.avaliableSquareCount == 0:
+            return 0, None
+        if not placingPiece and game.remainingPieceCount <= 0:
+            return 0, None
+
+        self.profiler.log("Cannonizing")
+        game = self.cannonizer.cannonizeGame(game)
+
+        self.profiler.log("Hashing")
+        gameHash = self.getMemoKey(game)
+
+        self.profiler.log("Checking Memo")
+        alphaOrig = alpha
+        entry = self.probeMemo(gameHash, placingPiece)
+        if entry is not None:
+            score, bound, entryDepth, move = entry
+            # Wins and losses are proven at any depth, other scores only as deep as they were searched
+            if entryDepth >= depth or (score == 1 and bound != UPPER) or (score == -1 and bound != LOWER):
+                if bound == EXACT:
+                    self.memoedCounter += 1
+                    return score, move
+                if bound == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    self.memoedCounter += 1
+                    return score, move
+
+        # Threat map shortcuts: a piece that completes a line wins at once, and a player
+        # who can only choose such pieces has lost. Otherwise only safe pieces are tried,
+        # as choosing a threat piece scores -1.
+        self.profiler.log("Checking Threats")
+        if placingPiece:
+            if len(game.selectedPieces) > 0:
+                square = game.winningSquare(game.selectedPieces[0])
+                if square is not None:
+                    self.threatCounter += 1
+                    self.storeMemo(gameHash, 1, EXACT, depth, square, True)
+                    return 1, square
+        else:
+            safePieces = game.remainingMask & ~game.threatPieces()
+            if safePieces == 0:
+                self.threatCounter += 1
+                piece = game.iterRemainingPieces()[0]
+                self.storeMemo(gameHash, -1, EXACT, depth, piece, False)
+                return -1, piece
+
+        # No line can be won any more, so the game is a draw at any depth
+        self.profiler.log("Checking Dead Lines")
+        if game.isDeadDraw():
+            self.deadDrawCounter += 1
+            move = game.iterAvaliableSquares()[0] if placingPiece else game.iterRemainingPieces()[0]
+            self.storeMemo(gameHash, 0, EXACT, PROVEN_DEPTH, move, placingPiece)
+            return 0, move
+
+        # Games small enough for the endgame table take its score, proven at any depth
+        if self.endgameTable is not None and self.endgameTable.covers(game):
+            self.profiler.log("Probing Endgame Table")
+            entry = self.endgameTable.probe(game)
+            if entry is not None:
+                self.endgameCounter += 1
+                score, move = entry
+                move = SQUARE_VECTORS[move] if placingPiece else move
+                self.storeMemo(gameHash, score, EXACT, PROVEN_DEPTH, move, placingPiece)
+                return score, move
+
+        self.profiler.log("Basic Math")
+        if self.maxBredth is not None:
+            if self.bredthCounts[depth] >= self.maxBredth:
+                return 0, None
+            self.bredthCounts[depth] += 1
+
+        self.exploredCounter += 1
+        if self.budget is not None:
+            self.budget.spend()
+        bestScore, bestMove = -2, None
+
+        if placingPiece:
+            if len(game.selectedPieces) == 0:
+                print("ERROR: NO SELECTED PIECES to be placed")
+                return 0, None
+            currPiece = game.selectedPieces[0]
+
+            self.profiler.log("Avaliable Squares")
+            for square in MASK_SQUARES[self.searchSquares(game, currPiece)]:
+                self.profiler.log("Placing Piece")
+                game.placePiece(currPiece, square)
+
+                self.profiler.log("Calling")
+                score, _ = self.negamax(game, depth-1, alpha, beta, False)
+
+                self.profiler.log("Removing Piece")
+                game.removePiece(square)
+
+                self.profiler.log("Basic Math")
+                if score > bestScore:
+                    bestScore, bestMove = score, square
+                alpha = max(alpha, score)
+                if alpha >= beta:
+                    break
+        else:
+            self.profiler.log("Getting Remaining Pieces")
+            for piece in MASK_BITS[self.searchPieces(game) & safePieces]:
+                self.profiler.log("Selecting Piece")
+                game.selectPiece(piece)
+
+                self.profiler.log("Calling")
+                score, _ = self.negamax(game, depth-1, -beta, -alpha, True)
+                score = -score
+
+                self.profiler.log("Deselecting")
+                game.deselectAll()
+
+                self.profiler.log("Basic Math")
+                if score > bestScore:
+                    bestScore, bestMove = score, piece
+                alpha = max(alpha, score)
+                if alpha >= beta:
+                    break
+
+        self.profiler.log("Storing Hash")
+        if bestScore <= alphaOrig:
+            bound = UPPER
+        elif bestScore >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.storeMemo(gameHash, bestScore, bound, depth, bestMove, placingPiece)
+
+        self.profiler.log("Return")
+        return bestScore, bestMove
+
+
     """
     Evaluates the current game state to return a score.
     A winning board state returns +1 for the AI, -1 for the opponent.
@@ -0,0 +1,194 @@
+import os
+import time
+import numpy as np
+from QuartoGame import QuartoGame
+from QuartoBitboard import SQUARE_COUNT, PIECE_COUNT
+from QuartoBatchBoards import expandLayer, expandBoardMoves, uniqueBoards, winMask, zobristKeys
+import CannonBackend
+
+"""
+RetrogradeSolver solves Quarto layer by layer instead of searching every root again.
+
+Layer d holds the cannonized boards with d pieces on them and no won line, the same boards
+DepthSaver.exploreDepthBatched finds. The layers are enumerated forward from the roots
+(the empty board by default) with expandLayer, then valued backward from the last layer:
+a board's value only needs the values of its children in the next layer, so every board
+is valued exactly once.
+
+A board of a layer is a choose node, and its value is from the view of the player choosing:
+    the placer of piece p takes the best square, 1 if it completes a line, otherwise
+    the value of the cannonized child for its chooser (the placer)
+    the chooser takes the piece whose best placement is worst for the placer
+Full boards without a win are draws.
+
+Each layer is saved as sorted binary arrays in .npy files, memory mapped when read:
+    boards - (N, 16) int16 boards in QuartoGame.board layout, in key order
+    keys   - the sorted uint64 zobrist keys of the boards (QuartoBatchBoards.zobristKeys)
+    values - a uint8 per board packing
+        bits 0-1   score + 1
+        bits 2-5   best piece to choose (0 on full boards)
+"""
+
+class RetrogradeSolver:
+
+    """
+    Parameters:
+        fileName (str): Name the layer files are saved under.
+        path (str): Folder of the layer files.
+        chunkSize (int): Boards expanded and valued at once.
+    """
+    def __init__(self, fileName: str, path="retrogradeLayers/", chunkSize=4096):
+        self.fileName = fileName
+        self.path = path
+        self.chunkSize = chunkSize
+
+    def layerFile(self, depth: int, part: str) -> str:
+        return f'{self.path}{self.fileName}.layer{depth:02d}.{part}.npy'
+
+    # Depths of the saved layers, in order
+    def layerDepths(self) -> list[int]:
+        return [depth for depth in range(SQUARE_COUNT + 1) if os.path.exists(self.layerFile(depth, 'keys'))]
+
+    def loadLayer(self, depth: int, part: str) -> np.ndarray:
+        return np.load(self.layerFile(depth, part), mmap_mode='r')
+
+    def saveLayer(self, depth: int, boards: np.ndarray) -> None:
+        keys  = zobristKeys(boards)
+        order = np.argsort(keys)
+        np.save(self.layerFile(depth, 'boards'), boards[order])
+        np.save(self.layerFile(depth, 'keys'), keys[order])
+
+    """ enumerateLayers()
+    Saves every layer reachable from the roots, from the roots' layer until a full board
+    or a layer with no boards left. The roots are cannonized like the other layers.
+    roots is an (N, 16) array of boards with the same number of pieces, the empty board if None.
+
+    Returns:
+        List: (depth, board count) of each saved layer
+    """
+    def enumerateLayers(self, roots=None) -> list[tuple[int, int]]:
+        if roots is None:
+            roots = -np.ones((1, SQUARE_COUNT), dtype=np.int16)
+        layer, _, _ = CannonBackend.cannonize_many(np.asarray(roots, dtype=np.int16).reshape(-1, SQUARE_COUNT))
+        layer = uniqueBoards(layer)
+        counts = np.unique((layer >= 0).sum(axis=1))
+        if len(counts) != 1:
+            raise ValueError('roots must all have the same number of pieces')
+        depth = int(counts[0])
+
+        os.makedirs(self.path, exist_ok=True)
+        startTime = time.time()
+        sizes = []
+        while True:
+            self.saveLayer(depth, layer)
+            sizes.append((depth, len(layer)))
+            print(f'Layer {depth}: {len(layer)} boards', end='\r')
+            if depth == SQUARE_COUNT or len(layer) == 0:
+                break
+            depth += 1
+            layer = expandLayer(layer, depth, self.chunkSize)
+        print(f'Enumerated {len(sizes)} layers ({sum(size for _, size in sizes)} boards) in {(time.time() - startTime):.03f}')
+        return sizes
+
+    """ valueBoards()
+    Values a chunk of boards with d pieces from the keys and values of layer d + 1.
+
+    Returns:
+        np.ndarray: uint8 packed values of the boards
+    """
+    def valueBoards(self, boards: np.ndarray, childKeys: np.ndarray, childValues: np.ndarray) -> np.ndarray:
+        children, parents, _, pieces = expandBoardMoves(boards)
+
+        # Score of each placement for the placer
+        wins = winMask(children)
+        placerScores = np.ones(len(children), dtype=np.int8)
+        if not wins.all():
+            cannonized, _, _ = CannonBackend.cannonize_many(children[~wins])
+            keys = zobristKeys(cannonized)
+            indices = np.minimum(np.searchsorted(childKeys, keys), len(childKeys) - 1)
+            if not np.array_equal(childKeys[indices], keys):
+                raise ValueError('Child boards missing from the next layer, enumerate the layers again')
+            placerScores[~wins] = (childValues[indices] & 3).astype(np.int8) - 1
+
+        # The placer takes the best square for each piece, the chooser the piece worst for the placer
+        pieceScores = np.full((len(boards), PIECE_COUNT), -2, dtype=np.int8)
+        np.maximum.at(pieceScores, (parents, pieces), placerScores)
+        chooserScores = np.where(pieceScores == -2, -2, -pieceScores)
+        bestPieces = chooserScores.argmax(axis=1)
+        scores = chooserScores[np.arange(len(boards)), bestPieces]
+        return ((scores + 1) | (bestPieces << 2)).astype(np.uint8)
+
+    """ backupLayers()
+    Values every saved layer, from the last one back to the first.
+
+    Returns:
+        np.ndarray: packed values of the first layer's boards
+    """
+    def backupLayers(self) -> np.ndarray:
+        depths = self.layerDepths()
+        startTime = time.time()
+        childKeys, childValues = None, None
+        for depth in reversed(depths):
+            boards = self.loadLayer(depth, 'boards')
+            if depth == SQUARE_COUNT:
+                values = np.full(len(boards), 1, dtype=np.uint8) # full boards are draws
+            else:
+                if childKeys is None or depth + 1 not in depths:
+                    raise ValueError(f'Layer {depth + 1} is missing, enumerate the layers first')
+                values = np.empty(len(boards), dtype=np.uint8)
+                for start in range(0, len(boards), self.chunkSize):
+                    values[start:start + self.chunkSize] = self.valueBoards(
+                        np.asarray(boards[start:start + self.chunkSize]), childKeys, childValues)
+            np.save(self.layerFile(depth, 'values'), values)
+            childKeys, childValues = self.loadLayer(depth, 'keys'), self.loadLayer(depth, 'values')
+            print(f'Valued layer {depth}: {len(boards)} boards', end='\r')
+        print(f'Valued {len(depths)} layers in {(time.time() - startTime):.03f}')
+        return np.asarray(childValues)
+
+    # Enumerates the layers from the roots and values them, returns the packed values of the roots' layer
+    def solve(self, roots=None) -> np.ndarray:
+        self.enumerateLayers(roots)
+        return self.backupLayers()
+
+    """ value()
+    Score of a game from the saved layers, for the player to move. With a selected piece the game
+    is a place node and takes its best square. Cannonization does not give every symmetric board
+    the same form, so the game's board is looked up under all of its transforms.
+
+    Returns:
+        int: -1, 0 or 1, or None if the game is not in the layers
+    """
+    def value(self, game: QuartoGame):
+        if len(game.selectedPieces) > 0:
+            piece = game.selectedPieces[0]
+            bestScore = None
+            for square in game.iterAvaliableSquares():
+                game.placePiece(piece, square)
+                score = 1 if game.checkWin() else self.value(game)
+                game.removePiece(square)
+                if score is None:
+                    return None
+                bestScore = score if bestScore is None else max(bestScore, score)
+            return bestScore
+
+        if game.checkWin():
+            return 1 # the player choosing has just won
+        depth = SQUARE_COUNT - game.avaliableSquareCount
+        if not os.path.exists(self.layerFile(depth, 'values')):
+            return None
+        keys, values = self.loadLayer(depth, 'keys'), self.loadLayer(depth, 'values')
+        if len(keys) == 0:
+            return None
+        cannonized, _, _ = CannonBackend.cannonize_many(CannonBackend.orbitBoards(game.board.reshape(-1)))
+        candidates = np.unique(zobristKeys(cannonized))
+        indices = np.minimum(np.searchsorted(keys, candidates), len(keys) - 1)
+        found = np.flatnonzero(keys[indices] == candidates)
+        if len(found) == 0:
+            return None
+        return int(values[indices[found[0]]] & 3) - 1
+
+
+if __name__ == '__main__':
+    solver = RetrogradeSolver("quarto")
+    values = solver.solve()
+    print(f'Empty board score: {int(values[0] & 3) - 1}')
@@ -0,0 +1,44 @@
+import time
+
+"""
+SearchBudget bounds a search by wall clock time and by explored nodes.
+Solvers call spend() once per explored node, it raises SearchAborted when either
+budget has run out, unwinding the search back to the iteration that started it.
+"""
+class SearchAborted(Exception):
+    pass
+
+
+class SearchBudget:
+
+    """
+    Parameters:
+        time_ms (float): Wall clock budget in milliseconds, None for no time limit.
+        max_nodes (int): Explored node budget, None for no node limit.
+    """
+    def __init__(self, time_ms=None, max_nodes=None):
+        self.time_ms   = time_ms
+        self.max_nodes = max_nodes
+        self.start()
+
+    # Restarts the clock and the node count
+    def start(self) -> None:
+        self.nodes     = 0
+        self.startTime = time.perf_counter()
+        self.deadline  = self.startTime + self.time_ms / 1000 if self.time_ms is not None else None
+
+    """ spend()
+    Counts one explored node, raising SearchAborted once the budget is exhausted.
+    """
+    def spend(self) -> None:
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def elapsedMs(self) -> float:
+        return (time.perf_counter() - self.startTime) * 1000
+
+    def __str__(self) -> str:
+        return f'Budget: {self.nodes}/{self.max_nodes} nodes | {self.elapsedMs():.1f}/{self.time_ms} ms'
@@ -0,0 +1,238 @@
+from multiprocessing import shared_memory
+
+"""
+TranspositionTable is a fixed size memo table for the solvers, preallocated from a byte budget
+so a long solve can not grow without bound.
+
+The table is a bytearray viewed as 64 bit words. It is split into buckets of two slots, each
+slot being a (key, data) pair of words:
+    slot 0 is depth preferred: it is only replaced by entries searched at least as deep
+           (its old entry moves down to slot 1)
+    slot 1 is always replaced
+Keys are the games' 64 bit zobrist keys, so the solver must use zobrist memo keys.
+
+The data word packs an entry as
+    bits  0-1   score + 1   (scores are -1, 0, 1)
+    bits  2-3   bound       (EXACT, LOWER or UPPER)
+    bits  4-9   depth
+    bits 10-17  best move   (square index or piece, NO_MOVE if there is none)
+    bits 18-25  id of the worker that stored it (SharedTranspositionTable only)
+    bit  63     set on every stored entry, so an empty slot is a zero data word
+
+SharedTranspositionTable keeps the same layout in shared memory, so processes can share one table.
+"""
+
+# Bound kinds of memo entries
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+BUCKET_SLOTS = 2
+SLOT_WORDS   = 2
+BUCKET_WORDS = BUCKET_SLOTS * SLOT_WORDS
+BUCKET_BYTES = BUCKET_WORDS * 8
+
+NO_MOVE    = 0xFF
+USED_FLAG  = 1 << 63
+DEPTH_MASK = 0x3F
+PROVEN_DEPTH = DEPTH_MASK # depth stored with results that hold at any depth
+WRITER_SHIFT = 18
+WRITER_MASK  = 0xFF
+
+def packEntry(score: int, bound: int, depth: int, move) -> int:
+    if move is None:
+        move = NO_MOVE
+    return USED_FLAG | (score + 1) | (bound << 2) | ((depth & DEPTH_MASK) << 4) | ((move & 0xFF) << 10)
+
+def unpackEntry(data: int) -> tuple:
+    move = (data >> 10) & 0xFF
+    return (data & 3) - 1, (data >> 2) & 3, (data >> 4) & DEPTH_MASK, (None if move == NO_MOVE else move)
+
+
+class TranspositionTable:
+
+    """
+    Parameters:
+        byteBudget (int): Memory to use. The bucket count is the largest power of two that fits.
+    """
+    def __init__(self, byteBudget: int):
+        buckets = max(1, byteBudget // BUCKET_BYTES)
+        self.bucketCount = 1 << (buckets.bit_length() - 1)
+        self.bucketMask  = self.bucketCount - 1
+        self.buffer = bytearray(self.bucketCount * BUCKET_BYTES)
+        self.words  = memoryview(self.buffer).cast('Q')
+
+        self.probes = 0
+        self.hits   = 0
+        self.stores = 0
+        self.replacements = 0
+
+    @property
+    def byteSize(self) -> int:
+        return len(self.buffer)
+
+    @property
+    def slotCount(self) -> int:
+        return self.bucketCount * BUCKET_SLOTS
+
+    """ probe()
+    Returns the (score, bound, depth, move) stored for a key, or None.
+    """
+    def probe(self, key: int):
+        self.probes += 1
+        words = self.words
+        base  = (key & self.bucketMask) * BUCKET_WORDS
+        if words[base] == key and words[base + 1]:
+            data = words[base + 1]
+        elif words[base + 2] == key and words[base + 3]:
+            data = words[base + 3]
+        else:
+            return None
+        self.hits += 1
+        return unpackEntry(data)
+
+    """ store()
+    Stores an entry, following the depth preferred / always replace scheme.
+    """
+    def store(self, key: int, score: int, bound: int, depth: int, move) -> None:
+        self.stores += 1
+        data  = packEntry(score, bound, depth, move)
+        words = self.words
+        base  = (key & self.bucketMask) * BUCKET_WORDS
+
+        if words[base + 2] == key:
+            words[base + 3] = 0 # drop the old copy, the key is stored again below
+
+        oldData = words[base + 1]
+        if not oldData or words[base] == key or depth >= (oldData >> 4) & DEPTH_MASK:
+            if oldData and words[base] != key:
+                words[base + 2] = words[base]
+                words[base + 3] = oldData
+                self.replacements += 1
+            words[base]     = key
+            words[base + 1] = data
+        else:
+            if words[base + 3]:
+                self.replacements += 1
+            words[base + 2] = key
+            words[base + 3] = data
+
+    def clear(self) -> None:
+        self.words[:] = memoryview(bytes(len(self.buffer))).cast('Q')
+        self.probes = 0
+        self.hits   = 0
+        self.stores = 0
+        self.replacements = 0
+
+    # Number of filled slots, counted by scanning the table
+    def __len__(self) -> int:
+        return sum(1 for i in range(1, len(self.words), SLOT_WORDS) if self.words[i])
+
+    def __str__(self) -> str:
+        return (f'Transposition table: {self.byteSize // (1 << 20)} MiB, {self.slotCount} slots | '
+                f'Probes: {self.probes} | Hits: {self.hits} | Stores: {self.stores} | Replacements: {self.replacements}')
+
+
+# Attaches to an existing segment. Segments are unlinked by the process that created them,
+# so the attaching process does not track them (Python 3.13+, older versions track every segment).
+def attachSharedMemory(name: str):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedTranspositionTable(TranspositionTable):
+
+    """
+    A TranspositionTable in a multiprocessing shared memory segment, read and written by
+    every process without locks. Each slot keeps key ^ data in its key word, so an entry
+    torn by two processes writing at once does not match its key and reads as a miss.
+
+    The process that creates the table owns the segment and unlinks it in close().
+    Pickling a table (as a Pool argument) attaches to the same segment on the other side.
+    Each process should set its own workerId, stored with its entries, so hits on entries
+    written by other processes are counted as cross hits.
+
+    Parameters:
+        byteBudget (int): Memory to use. The bucket count is the largest power of two that fits.
+        name (str): Name of the segment to attach to, None to create a new one.
+        workerId (int): Id stored with this process's entries (0-255).
+    """
+    def __init__(self, byteBudget: int, name=None, workerId=0):
+        buckets = max(1, byteBudget // BUCKET_BYTES)
+        self.bucketCount = 1 << (buckets.bit_length() - 1)
+        self.bucketMask  = self.bucketCount - 1
+        size = self.bucketCount * BUCKET_BYTES
+
+        self.owner  = name is None
+        self.memory = shared_memory.SharedMemory(create=True, size=size) if self.owner else attachSharedMemory(name)
+        self.buffer = self.memory.buf[:size]
+        self.words  = self.buffer.cast('Q')
+        self.workerId = workerId
+
+        self.probes = 0
+        self.hits   = 0
+        self.crossHits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def __reduce__(self):
+        return (SharedTranspositionTable, (self.byteSize, self.name, self.workerId))
+
+    def probe(self, key: int):
+        self.probes += 1
+        words = self.words
+        base  = (key & self.bucketMask) * BUCKET_WORDS
+        data  = words[base + 1]
+        if not data or words[base] ^ data != key:
+            data = words[base + 3]
+            if not data or words[base + 2] ^ data != key:
+                return None
+        self.hits += 1
+        if (data >> WRITER_SHIFT) & WRITER_MASK != self.workerId:
+            self.crossHits += 1
+        return unpackEntry(data)
+
+    def store(self, key: int, score: int, bound: int, depth: int, move) -> None:
+        self.stores += 1
+        data  = packEntry(score, bound, depth, move) | ((self.workerId & WRITER_MASK) << WRITER_SHIFT)
+        words = self.words
+        base  = (key & self.bucketMask) * BUCKET_WORDS
+
+        if words[base + 3] and words[base + 2] ^ words[base + 3] == key:
+            words[base + 3] = 0 # drop the old copy, the key is stored again below
+
+        oldData = words[base + 1]
+        oldKey  = words[base] ^ oldData
+        if not oldData or oldKey == key or depth >= (oldData >> 4) & DEPTH_MASK:
+            if oldData and oldKey != key:
+                words[base + 2] = words[base]
+                words[base + 3] = oldData
+                self.replacements += 1
+            words[base]     = key ^ data
+            words[base + 1] = data
+        else:
+            if words[base + 3]:
+                self.replacements += 1
+            words[base + 2] = key ^ data
+            words[base + 3] = data
+
+    # Returns this process's (probes, hits, cross hits, stores) counters
+    def counters(self) -> tuple:
+        return self.probes, self.hits, self.crossHits, self.stores
+
+    def close(self) -> None:
+        self.words.release()
+        self.buffer.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __str__(self) -> str:
+        crossRate = self.crossHits / self.probes if self.probes > 0 else 0.0
+        return (f'Shared {super().__str__()} | Cross hits: {self.crossHits} ({crossRate:.1%} of probes)')
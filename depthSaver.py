@@ -2,6 +2,8 @@ from QuartoGame import QuartoGame
 from GreatQuartoCannon import GreatQuartoCannon
 import time
 from QuartoDataTypes import IntVector2
+import numpy as np
+from QuartoBatchBoards import expandLayer, encodeBoards, hashesFromArrays
 
 def hasDup(game: QuartoGame):
     counts = [0] * 16
@@ -17,7 +19,9 @@ def hasDup(game: QuartoGame):
 
 
 class DepthSaver:
-    def __init__(self, bredthLimit=None):
+    # gameClass selects the game engine used for exploring and loading, QuartoGame or QuartoBitGame
+    def __init__(self, bredthLimit=None, gameClass=QuartoGame):
+        self.gameClass = gameClass
         self.memo = set()
         self.exploredAtDepth = set()
         self.depthToExplore = 0
@@ -47,11 +51,28 @@ class DepthSaver:
             self.bredthCounter = [0] * (depth + 1)
 
 
-        game = QuartoGame(twistCount=1, verbose=False, undoMemLength=0)
+        game = self.gameClass(twistCount=1, verbose=False, undoMemLength=0)
         startTime = time.time()
         self._explore(game, 0, False)
         print(f'Found {len(self.exploredAtDepth)} boards with {depth} pieces on them in {(time.time() - startTime) :.03f}')
 
+    # Explores the same boards as exploreDepth one layer at a time, expanding, cannonizing
+    # and win checking chunkSize boards at once with array operations.
+    # bredthLimit is not applied.
+    def exploreDepthBatched(self, depth, chunkSize=4096):
+        self.memo = set()
+        self.exploredAtDepth = set()
+        self.depthToExplore = depth
+
+        startTime = time.time()
+        layer = - np.ones((1, 16), dtype=np.int16)
+        for placed in range(1, depth + 1):
+            layer = expandLayer(layer, placed, chunkSize)
+            print(f'Layer {placed}: {len(layer)} boards', end='\r')
+
+        self.exploredAtDepth = set(hashesFromArrays(*encodeBoards(layer)))
+        print(f'Found {len(self.exploredAtDepth)} boards with {depth} pieces on them in {(time.time() - startTime) :.03f}')
+
     # recursive explore function
     def _explore(self, game: QuartoGame, depth: int, placingPiece: bool):
         if self.bredthLimit is not None:
@@ -89,7 +110,7 @@ class DepthSaver:
             if (gameHash, piece) in self.memo:
                 return
             self.memo.add((gameHash, piece))
-            for place in game.getAvaliableSquares():
+            for place in game.iterAvaliableSquares():
                 game.placePiece(piece, place)
                 self._explore(game, depth+1, False)
                 game.removePiece(place)
@@ -108,13 +129,13 @@ class DepthSaver:
 
             self.memo.add((gameHash, None))
             if depth == self.depthToExplore:
-                if not game.checkWinFull():
+                if not game.checkWin():
                     self.exploredAtDepth.add(gameHash)
                 return
-            if depth >= 4 and game.checkWinFull():
+            if depth >= 4 and game.checkWin():
                 return
 
-            for piece in game.getRemainingPieces():
+            for piece in game.iterRemainingPieces():
                 game.selectPiece(piece)
                 self._explore(game, depth, True)
                 game.deselectAll()
@@ -169,7 +190,7 @@ class DepthSaver:
 
     # Returns the game at a given index
     def getGame(self, index):
-        game = QuartoGame()
+        game = self.gameClass()
         game.loadFromHash(self.hashes[index])
         return game
     
@@ -5,14 +5,15 @@
 #   you can check this by going to your terminal and using
 #       python --version
 #   and 
-#       gcc --version
+#       gcc --version     (or cl on Windows, clang --version on macOS)
 #   to ensure a local version of python and the gcc compiler are recognized by your
 #   local environment path
-#       Installation on Windows:
+#       Installation (Windows, Linux and macOS):
 #   Install pybind11 using
 #       pip install pybind11
 #   Then, use your command prompt to cd into the directory containing setup.py. Then, run the following
 #       python setup.py build_ext --inplace
+#   If the extension is not built, CannonBackend falls back to a NumPy implementation.
 #
 # =================================================
 
@@ -23,6 +24,12 @@ import os
 
 #CUDA_HOME = os.environ.get("CUDA_PATH", "C:/Program Files/NVIDIA GPU Computing Toolkit/CUDA/v12.8")
 
+# MSVC and gcc/clang spell their optimization flags differently
+if sys.platform == "win32":
+    optimizeArgs = ["/O2"]
+else:
+    optimizeArgs = ["-O3"]
+
 ext_modules = [
     Pybind11Extension(
         "FastCannon",
@@ -30,7 +37,8 @@ ext_modules = [
         #include_dirs=[os.path.join(CUDA_HOME, "include")],
         #library_dirs=[os.path.join(CUDA_HOME, "lib", "x64")],
         #libraries=["cudart"],
-        extra_compile_args=["/std:c++17", "/O2"],
+        cxx_std=17,
+        extra_compile_args=optimizeArgs,
         #extra_link_args=["/LIBPATH:" + os.path.join(CUDA_HOME, "lib", "x64")]
     ),
 ]
@@ -0,0 +1,46 @@
+import random
+from QuartoGame import QuartoGame
+
+""" randomGame()
+A game with pieceCount pieces placed at random and no line won, with a selected
+piece when placing. gameClass is QuartoGame or QuartoBitGame.
+"""
+def randomGame(pieceCount: int, seed: int, placing=False, gameClass=QuartoGame):
+    rng = random.Random(seed)
+    while True:
+        game = gameClass(verbose=False, undoMemLength=0)
+        for _ in range(pieceCount):
+            piece = rng.choice(game.iterRemainingPieces())
+            game.selectPiece(piece)
+            game.placePiece(piece, rng.choice(game.iterAvaliableSquares()))
+        if not game.checkWin():
+            break
+    if placing:
+        game.selectPiece(rng.choice(game.iterRemainingPieces()))
+    return game
+
+""" bruteForce()
+Exact score of a game for the player to move, without memo, symmetry or pruning.
+"""
+def bruteForce(game, placing: bool) -> int:
+    if not placing and game.checkWin():
+        return 1
+    if game.avaliableSquareCount == 0 or (not placing and game.remainingPieceCount == 0):
+        return 0
+    best = -2
+    if placing:
+        piece = game.selectedPieces[0]
+        for square in game.iterAvaliableSquares():
+            game.placePiece(piece, square)
+            best = max(best, bruteForce(game, False))
+            game.removePiece(square)
+            if best == 1:
+                break
+    else:
+        for piece in game.iterRemainingPieces():
+            game.selectPiece(piece)
+            best = max(best, -bruteForce(game, True))
+            game.deselectAll()
+            if best == 1:
+                break
+    return best
@@ -0,0 +1,85 @@
+import types
+import numpy as np
+import pytest
+import CannonBackend
+from GreatQuartoCannon import GreatQuartoCannon
+from QuartoBitGame import QuartoBitGame
+from randomGames import randomGame
+
+
+@pytest.fixture
+def restoreBackend():
+    backend = CannonBackend.getBackend()
+    yield
+    CannonBackend.setBackend(backend)
+
+def needsNative():
+    if 'native' not in CannonBackend.avaliableBackends():
+        pytest.skip('FastCannon is not built')
+
+# Results of every cannonization entry point for some games, under one backend
+def cannonizeAll(backend: str) -> list:
+    CannonBackend.setBackend(backend)
+    results = []
+    for seed in range(40):
+        game = randomGame(seed % 14, seed, placing=seed % 3 == 0, gameClass=QuartoBitGame)
+        board = game.board.astype(np.int16)
+        gameResult = CannonBackend.cannonizeGame(board, game.remainingMask, list(game.selectedPieces))
+        packedResult = CannonBackend.cannonizePacked(game.cells, game.occupied, game.remainingMask, list(game.selectedPieces))
+        single = game.board.astype(np.int16)
+        xorPiece = CannonBackend.cannonize(single)
+        results.append((board.tolist(), gameResult, packedResult, single.tolist(), xorPiece))
+    return results
+
+
+def test_backends_agree(restoreBackend):
+    needsNative()
+    assert cannonizeAll('native') == cannonizeAll('numpy')
+
+def test_backends_agree_on_many(restoreBackend):
+    needsNative()
+    boards = np.array([randomGame(seed % 14, seed).board.reshape(-1) for seed in range(200)], dtype=np.int16)
+    pools  = np.random.default_rng(0).integers(0, 1 << 16, len(boards))
+    CannonBackend.setBackend('native')
+    native = CannonBackend.cannonize_many(boards, pools)
+    CannonBackend.setBackend('numpy')
+    numpy = CannonBackend.cannonize_many(boards, pools)
+    for nativeArray, numpyArray in zip(native, numpy):
+        assert np.array_equal(nativeArray, numpyArray)
+
+@pytest.mark.parametrize('backend', CannonBackend.avaliableBackends())
+def test_cannonize_many_rejects_bad_shapes(backend, restoreBackend):
+    CannonBackend.setBackend(backend)
+    with pytest.raises(ValueError):
+        CannonBackend.cannonize_many(np.zeros((3, 15), dtype=np.int16))
+    with pytest.raises(ValueError):
+        CannonBackend.cannonize_many(np.zeros(16, dtype=np.int16))
+    with pytest.raises(ValueError):
+        CannonBackend.cannonize_many(np.full((3, 16), -1, dtype=np.int16), np.zeros(2, dtype=np.int64))
+
+def test_stale_extension_falls_back_to_numpy(restoreBackend, monkeypatch):
+    stale = types.SimpleNamespace(cannonize=lambda board: -1, placePiece=lambda *args: None)
+    monkeypatch.setattr(CannonBackend, 'FastCannon', stale)
+    assert CannonBackend.avaliableBackends() == ['numpy']
+    with pytest.raises(ValueError):
+        CannonBackend.setBackend('native')
+
+def test_exact_canonical_key_is_symmetry_invariant():
+    cannonizer = GreatQuartoCannon()
+    rng = np.random.default_rng(1)
+    for seed in range(20):
+        game = randomGame(seed % 12, seed, placing=seed % 2 == 0)
+        key, transformId = cannonizer.exactCannonKey(game)
+        canonical = game.copy()
+        canonical.applyTransform(transformId)
+        assert canonical.zobristKey == key
+        for transformId in rng.choice(CannonBackend.TRANSFORM_ID_COUNT, 5, replace=False):
+            moved = game.copy()
+            moved.applyTransform(int(transformId))
+            assert cannonizer.exactCannonKey(moved)[0] == key
+
+def test_untransform_inverts_transform():
+    for transformId in range(0, CannonBackend.TRANSFORM_ID_COUNT, 37):
+        for value in range(16):
+            assert CannonBackend.untransformPiece(transformId, CannonBackend.transformPiece(transformId, value)) == value
+            assert CannonBackend.untransformSquare(transformId, CannonBackend.transformSquare(transformId, value)) == value
@@ -0,0 +1,46 @@
+import pytest
+from EndgameTable import buildEndgameTable
+from QuartoMiniMaxSolver import QuartoMiniMaxSolver
+from randomGames import randomGame
+
+
+@pytest.fixture(scope='module')
+def roots():
+    return [randomGame(10, seed) for seed in range(3)]
+
+@pytest.fixture(scope='module')
+def table(roots, tmp_path_factory):
+    return buildEndgameTable(roots, 5, 'test', path=f'{tmp_path_factory.mktemp("endgame")}/')
+
+
+def test_negamax_with_table_matches_negamax(roots, table):
+    hits = 0
+    for root in roots:
+        plain = QuartoMiniMaxSolver(depth=32, hashMode='zobrist', algorithm='negamax')
+        probed = QuartoMiniMaxSolver(depth=32, hashMode='zobrist', algorithm='negamax', endgameTable=table)
+        assert probed.negamax(root.copy(), 32, -1, 1, False)[0] == plain.negamax(root.copy(), 32, -1, 1, False)[0]
+        hits += probed.endgameCounter
+    assert hits > 0
+
+def test_probes_give_exact_scores_and_legal_moves(roots, table):
+    solver = QuartoMiniMaxSolver(depth=32, hashMode='zobrist', algorithm='negamax')
+    checked = 0
+    for root in roots:
+        for piece in root.iterRemainingPieces():
+            for square in root.iterAvaliableSquares():
+                game = root.copy()
+                game.selectPiece(piece)
+                game.placePiece(piece, square)
+                if game.checkWin():
+                    continue
+                entry = table.probe(game)
+                if entry is None:
+                    continue
+                score, move = entry
+                assert move in game.iterRemainingPieces()
+                assert score == solver.negamax(game.copy(), 32, -1, 1, False)[0]
+                checked += 1
+    assert checked > 0
+
+def test_games_with_more_empty_squares_are_not_covered(roots, table):
+    assert table.probe(roots[0]) is None
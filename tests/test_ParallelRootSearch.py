@@ -0,0 +1,45 @@
+import time
+import pytest
+from ParallelRootSearch import NODE_FLUSH_NODES
+from QuartoBitGame import QuartoBitGame
+from QuartoMiniMaxSolver import QuartoMiniMaxSolver
+from SearchBudget import SearchBudget, SearchAborted
+from randomGames import randomGame
+
+WORKERS = 2
+
+
+@pytest.fixture(scope='module')
+def parallel():
+    solver = QuartoMiniMaxSolver(depth=32, hashMode='zobrist', algorithm='negamax', workers=WORKERS)
+    yield solver
+    solver.close()
+
+# Searches the root moves of a game in the pool with a budget, returns the budget and the time taken
+def budgetedRootSearch(solver, game, placing: bool, budget: SearchBudget):
+    root, _ = solver.cannonizer.cannonizeGameWithTransform(game)
+    startTime = time.perf_counter()
+    with pytest.raises(SearchAborted):
+        solver.rootSearch.search(root, solver.rootMoves(root, placing), placing, 32, budget)
+    return budget, (time.perf_counter() - startTime) * 1000
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_parallel_search_matches_serial(parallel, seed):
+    placing = seed % 2 == 1
+    game = randomGame(10, seed, placing, gameClass=QuartoBitGame)
+    serial = QuartoMiniMaxSolver(depth=32, hashMode='zobrist', algorithm='negamax')
+    serialScore, serialPiece, serialSquare, _ = serial.search(game.copy(), placing)
+    score, piece, square, _ = parallel.search(game.copy(), placing)
+    assert (score, piece, square) == (serialScore, serialPiece, serialSquare)
+
+def test_node_budget_is_shared_by_the_workers(parallel):
+    game = randomGame(4, 0, gameClass=QuartoBitGame)
+    budget, _ = budgetedRootSearch(parallel, game, False, SearchBudget(max_nodes=500))
+    assert budget.nodes <= 500 + WORKERS * NODE_FLUSH_NODES
+
+def test_time_budget_is_a_deadline_for_queued_moves(parallel):
+    game = randomGame(4, 0, gameClass=QuartoBitGame)
+    parallel.rootSearch.getPool() # start the workers before the clock does
+    _, elapsedMs = budgetedRootSearch(parallel, game, False, SearchBudget(time_ms=200))
+    assert elapsedMs < 400
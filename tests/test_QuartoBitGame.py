@@ -0,0 +1,56 @@
+import random
+import pytest
+from QuartoGame import QuartoGame
+from QuartoBitGame import QuartoBitGame
+
+LINE_STATE = ('lineAnd', 'lineOr', 'lineFill', 'lineFeatures', 'winningLineCount', 'placedFeatures', 'isWinningState')
+
+
+# Plays the same random selects, places and removes on both engines
+@pytest.mark.parametrize('seed', range(20))
+def test_engines_agree_on_random_play(seed):
+    rng = random.Random(seed)
+    games = [QuartoGame(verbose=False, undoMemLength=0), QuartoBitGame(verbose=False, undoMemLength=0)]
+    placed = []
+    for _ in range(40):
+        game = games[0]
+        if placed and (rng.random() < 0.3 or game.avaliableSquareCount == 0):
+            square = placed.pop(rng.randrange(len(placed)))
+            for g in games:
+                g.removePiece(square)
+                g.deselectAll()
+        elif game.remainingPieceCount > 0:
+            piece = rng.choice(game.iterRemainingPieces())
+            square = rng.choice(game.iterAvaliableSquares())
+            placed.append(square)
+            for g in games:
+                g.selectPiece(piece)
+                g.placePiece(piece, square)
+        a, b = games
+        assert a.hashBoard() == b.hashBoard()
+        assert a.zobristKey == b.zobristKey
+        assert a.checkWin() == b.checkWin()
+        assert a.iterRemainingPieces() == b.iterRemainingPieces()
+        assert a.threatPieces() == b.threatPieces()
+
+# The line accumulators kept on place and remove match ones rebuilt from the board
+@pytest.mark.parametrize('gameClass', [QuartoGame, QuartoBitGame])
+def test_line_state_matches_a_rebuild(gameClass):
+    rng = random.Random(7)
+    for _ in range(100):
+        game = gameClass(verbose=False, undoMemLength=0)
+        placed = []
+        for _ in range(rng.randint(1, 40)):
+            if placed and (rng.random() < 0.4 or game.avaliableSquareCount == 0):
+                game.removePiece(placed.pop(rng.randrange(len(placed))))
+                game.deselectAll()
+            elif game.remainingPieceCount > 0:
+                piece = rng.choice(game.iterRemainingPieces())
+                game.selectPiece(piece)
+                square = rng.choice(game.iterAvaliableSquares())
+                game.placePiece(piece, square)
+                placed.append(square)
+        rebuilt = game.copy()
+        rebuilt.syncState()
+        for name in LINE_STATE:
+            assert getattr(game, name) == getattr(rebuilt, name), name
@@ -0,0 +1,51 @@
+import pytest
+from QuartoMCTS import QuartoMCTS
+from randomGames import randomGame
+
+
+@pytest.mark.parametrize('budget', [dict(max_nodes=0), dict(time_ms=0)])
+def test_choose_with_exhausted_budget_selects_a_legal_piece(budget):
+    game = randomGame(6, 1, False)
+    pool = set(game.iterRemainingPieces())
+    result = QuartoMCTS(seed=1).choosePiece(game, **budget)
+    assert result.nodes == 0
+    assert result.move in pool
+    assert game.selectedPieces == [result.move]
+
+@pytest.mark.parametrize('budget', [dict(max_nodes=0), dict(time_ms=0)])
+def test_place_with_exhausted_budget_places_on_a_free_square(budget):
+    game = randomGame(6, 2, True)
+    squares = set(game.iterAvaliableSquares())
+    result = QuartoMCTS(seed=1).placePiece(game, **budget)
+    assert result.move in squares
+    assert result.move not in game.iterAvaliableSquares()
+    assert len(game.selectedPieces) == 0
+
+def test_exhausted_budget_still_takes_a_winning_square():
+    for seed in range(50):
+        game = randomGame(8, seed, True)
+        square = game.winningSquare(game.selectedPieces[0])
+        if square is not None:
+            break
+    else:
+        pytest.fail('no game with a winning square')
+    result = QuartoMCTS(seed=1).placePiece(game, max_nodes=0)
+    assert result.move == square
+    assert game.checkWin()
+
+def test_choose_with_exhausted_budget_avoids_giving_away_a_win():
+    for seed in range(50):
+        game = randomGame(8, seed, False)
+        threats = game.remainingMask & game.threatPieces()
+        if threats != 0 and threats != game.remainingMask:
+            break
+    else:
+        pytest.fail('no game with both safe and threat pieces')
+    result = QuartoMCTS(seed=1).choosePiece(game, max_nodes=0)
+    assert not (threats >> result.move) & 1
+
+def test_search_returns_a_legal_move():
+    game = randomGame(4, 3, False)
+    result = QuartoMCTS(playouts=200, seed=1).choosePiece(game)
+    assert result.nodes == 200
+    assert game.selectedPieces == [result.move]
@@ -0,0 +1,41 @@
+import numpy as np
+import CannonBackend
+from QuartoBatchBoards import zobristKeys
+from QuartoMiniMaxSolver import QuartoMiniMaxSolver
+from RetrogradeSolver import RetrogradeSolver
+from randomGames import randomGame, bruteForce
+
+
+def solveRoots(tmp_path, roots: list) -> RetrogradeSolver:
+    solver = RetrogradeSolver('test', path=f'{tmp_path}/')
+    solver.solve(np.array([root.board.reshape(-1) for root in roots]))
+    return solver
+
+
+def test_values_match_negamax(tmp_path):
+    roots = [randomGame(11, seed) for seed in range(4)]
+    solver = solveRoots(tmp_path, roots)
+    negamax = QuartoMiniMaxSolver(depth=32, hashMode='zobrist', algorithm='negamax')
+    for root in roots:
+        score, _ = negamax.negamax(root.copy(), 32, -1, 1, False)
+        assert solver.value(root) == score
+        for piece in root.iterRemainingPieces()[:3]:
+            game = root.copy()
+            game.selectPiece(piece)
+            score, _ = negamax.negamax(game.copy(), 32, -1, 1, True)
+            assert solver.value(game) == score
+
+def test_saved_root_scores_match_brute_force(tmp_path):
+    roots = [randomGame(11, seed) for seed in range(4, 8)]
+    solver = solveRoots(tmp_path, roots)
+    values = solver.loadLayer(11, 'values')
+    keys = solver.loadLayer(11, 'keys')
+    for root in roots:
+        cannonized, _, _ = CannonBackend.cannonize_many(root.board.reshape(1, -1))
+        packed = int(values[np.searchsorted(keys, zobristKeys(cannonized))[0]])
+        assert (packed & 3) - 1 == bruteForce(root.copy(), False)
+
+def test_layers_not_enumerated_give_no_value(tmp_path):
+    roots = [randomGame(12, 0)]
+    solver = solveRoots(tmp_path, roots)
+    assert solver.value(randomGame(10, 1)) is None